@@ -126,6 +126,9 @@ class Label(Widget):
     def set_text(self, x):
         self._text = x
 
+    def get_surface_signature(self):
+        return self.text, self.enabled, self.highlighted
+
     def get_align(self):
         return self._align
 
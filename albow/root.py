@@ -90,6 +90,15 @@ class RootWidget(Widget):
     do_draw = False
     _is_gl_container = True
 
+    # Bumped by input events that may change how widgets look. Widgets drawn
+    # into surfaces draw them again when it changes. See Widget.gl_draw_all
+    input_generation = 0
+    motion_widget = None
+
+    # Widget surfaces drawn again and drawn in total during the last frame
+    surface_redraws = 0
+    surface_draws = 0
+
     def __init__(self, surface):
         global root_widget
         Widget.__init__(self, surface.get_rect())
@@ -155,6 +164,7 @@ class RootWidget(Widget):
                     self.hover_widget = self.find_widget(mouse.get_pos())
                     if self.do_draw:
                         if self.is_gl:
+                            self.surface_redraws = self.surface_draws = 0
                             self.gl_clear()
                             self.gl_draw_all(self, (0, 0))
                             GL.glFlush()
@@ -175,6 +185,7 @@ class RootWidget(Widget):
                             self.quit()
                         elif type == MOUSEBUTTONDOWN:
                             self.do_draw = True
+                            self.input_generation += 1
                             t = datetime.now()
                             if t - last_click_time <= double_click_time and event.button == last_click_button:
                                 num_clicks += 1
@@ -204,6 +215,12 @@ class RootWidget(Widget):
 
                             mouse_widget = self.update_tooltip(event.pos)
 
+                            # moving within a GL widget doesn't change how the other widgets look
+                            if not self.captured_widget:
+                                if clicked_widget or mouse_widget is not self.motion_widget or not mouse_widget.is_gl_container:
+                                    self.input_generation += 1
+                                self.motion_widget = mouse_widget
+
                             if clicked_widget:
                                 last_mouse_event_handler = clicked_widget
                                 clicked_widget.handle_mouse('mouse_drag', event)
@@ -215,6 +232,7 @@ class RootWidget(Widget):
                         elif type == MOUSEBUTTONUP:
                             add_modifiers(event)
                             self.do_draw = True
+                            self.input_generation += 1
                             mouse_widget = self.find_widget(event.pos)
                             if self.captured_widget:
                                 mouse_widget = self.captured_widget
@@ -232,6 +250,7 @@ class RootWidget(Widget):
                             key = event.key
                             set_modifier(key, True)
                             self.do_draw = True
+                            self.input_generation += 1
                             self.send_key(modal_widget, 'key_down', event)
                             if last_mouse_event_handler:
                                 event.dict['pos'] = last_mouse_event.pos
@@ -241,6 +260,7 @@ class RootWidget(Widget):
                             key = event.key
                             set_modifier(key, False)
                             self.do_draw = True
+                            self.input_generation += 1
                             self.send_key(modal_widget, 'key_up', event)
                             if last_mouse_event_handler:
                                 event.dict['pos'] = last_mouse_event.pos
@@ -261,6 +281,7 @@ class RootWidget(Widget):
                         elif type == VIDEORESIZE:
                             #add_modifiers(event)
                             self.do_draw = True
+                            self.input_generation += 1
                             self.size = (event.w, event.h)
                             #self.dispatch_key('reshape', event)
                         elif type == ACTIVEEVENT:
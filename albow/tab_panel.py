@@ -10,7 +10,7 @@ from OpenGL.GLUT import *
 from albow import *
 from pygame import Rect, Surface, draw, image
 from pygame.locals import SRCALPHA
-from widget import Widget
+from widget import Widget, SurfaceTexture
 from theme import ThemeProperty, FontProperty
 from utils import brighten
 from numpy import fromstring
@@ -158,6 +158,8 @@ class TabPanel(Widget):
         if 0 <= i < n:
             return i
         
+    titles_texture = None
+
     def gl_draw_self(self, root, offset):
         self.gl_draw(root, offset)
 
@@ -178,8 +180,7 @@ class TabPanel(Widget):
             x0 = m + tlcorner[0]
 
             font = self.tab_font
-            fg = self.tab_fg_color
-            surface = Surface(self.size, SRCALPHA)
+            fg = self.fg_color or self.tab_fg_color
 
             glEnable(GL_BLEND)
             
@@ -191,29 +192,25 @@ class TabPanel(Widget):
                 else:
                     glColor(0.5, 0.5, 0.5, 0.5)
                 glRectf(x0, tlcorner[1]-(m+b), x1, tlcorner[1]-(h))
-                buf = font.render(self.pages[i].tab_title, True, self.fg_color or fg)
-                r = buf.get_rect()
+                x0 = x1 + s    
 
-                offs = ((tabWidth - r.size[0])/2) + m +((s+tabWidth)*i)
+            # the tab titles are only drawn again when they change
+            titles = self.titles_texture
+            if titles is None:
+                titles = self.titles_texture = SurfaceTexture()
+            key = (tuple(self.size), tuple(page.tab_title for page in pages), font, tuple(fg))
+            if key != titles.key:
+                surface = Surface(self.size, SRCALPHA)
+                for i, page in enumerate(pages):
+                    buf = font.render(page.tab_title, True, fg)
+                    r = buf.get_rect()
 
-                surface.blit(buf, (offs, m))
-                x0 = x1 + s    
-            
-            data = image.tostring(surface, 'RGBA', 1)
-            rect = self.rect.move(offset)
-            w, h = root.size
-            glViewport(0, 0, w, h)
-            glMatrixMode(GL_PROJECTION)
-            glLoadIdentity()
-            gluOrtho2D(0, w, 0, h)
-            glMatrixMode(GL_MODELVIEW)
-            glLoadIdentity()
-            glRasterPos2i(rect.left, h - rect.bottom)
-            glPushAttrib(GL_COLOR_BUFFER_BIT)
-            glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
-            glDrawPixels(self.width, self.height,
-                GL_RGBA, GL_UNSIGNED_BYTE, fromstring(data, dtype='uint8'))
-            glPopAttrib()
-            glFlush()
+                    offs = ((tabWidth - r.size[0])/2) + m +((s+tabWidth)*i)
+
+                    surface.blit(buf, (offs, m))
+                titles.load(surface)
+                titles.key = key
+
+            titles.draw(root, self.rect.move(offset))
 
             glDisable(GL_BLEND)
@@ -1,5 +1,6 @@
 from __future__ import division
 import sys
+import time
 from pygame import Rect, Surface, draw, image
 from pygame.locals import K_RETURN, K_KP_ENTER, K_ESCAPE, K_TAB, \
     KEYDOWN, SRCALPHA
@@ -47,6 +48,101 @@ def rect_property(name):
             self._resized(old_size)
     return property(get, set)
 
+def next_power_of_two(x):
+    n = 1
+    while n < x:
+        n <<= 1
+    return n
+
+# GL textures of collected SurfaceTextures, deleted the next time a surface is loaded
+doomed_textures = []
+
+
+class SurfaceTexture(object):
+    """A pygame Surface kept in an OpenGL texture and drawn as a textured quad.
+    The texture has power of two dimensions and is only reallocated when a
+    larger surface is loaded. key may be used by the owner to remember what
+    was drawn on the surface."""
+
+    key = None
+    texture = None
+    drawn_at = 0
+
+    def __init__(self):
+        self.texture_size = (0, 0)
+        self.size = (0, 0)
+
+    def __del__(self):
+        if self.texture is not None:
+            doomed_textures.append(self.texture)
+
+    def load(self, surface):
+        from OpenGL import GL
+        if doomed_textures:
+            GL.glDeleteTextures(doomed_textures)
+            del doomed_textures[:]
+
+        w, h = surface.get_size()
+        tw, th = self.texture_size
+        GL.glPushAttrib(GL.GL_TEXTURE_BIT)
+        if self.texture is None:
+            self.texture = GL.glGenTextures(1)
+        GL.glBindTexture(GL.GL_TEXTURE_2D, self.texture)
+        if w > tw or h > th:
+            tw, th = self.texture_size = next_power_of_two(max(w, tw)), next_power_of_two(max(h, th))
+            GL.glTexParameter(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, GL.GL_NEAREST)
+            GL.glTexParameter(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, GL.GL_NEAREST)
+            GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, GL.GL_RGBA, tw, th, 0, GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, None)
+
+        data = image.tostring(surface, 'RGBA')
+        GL.glTexSubImage2D(GL.GL_TEXTURE_2D, 0, 0, 0, w, h, GL.GL_RGBA, GL.GL_UNSIGNED_BYTE,
+            fromstring(data, dtype='uint8'))
+        GL.glPopAttrib()
+        self.size = (w, h)
+
+    def draw(self, root, rect):
+        """Draw the surface at rect, in root's coordinates."""
+        from OpenGL import GL, GLU
+        w, h = root.size
+        GL.glViewport(0, 0, w, h)
+        GL.glMatrixMode(GL.GL_PROJECTION)
+        GL.glLoadIdentity()
+        GLU.gluOrtho2D(0, w, 0, h)
+        GL.glMatrixMode(GL.GL_TEXTURE)
+        GL.glPushMatrix()
+        GL.glLoadIdentity()
+        GL.glMatrixMode(GL.GL_MODELVIEW)
+        GL.glLoadIdentity()
+
+        GL.glPushAttrib(GL.GL_COLOR_BUFFER_BIT | GL.GL_ENABLE_BIT | GL.GL_TEXTURE_BIT | GL.GL_CURRENT_BIT)
+        GL.glEnable(GL.GL_BLEND)
+        GL.glBlendFunc(GL.GL_SRC_ALPHA, GL.GL_ONE_MINUS_SRC_ALPHA)
+        GL.glEnable(GL.GL_TEXTURE_2D)
+        GL.glBindTexture(GL.GL_TEXTURE_2D, self.texture)
+        GL.glColor4f(1.0, 1.0, 1.0, 1.0)
+
+        # the surface's top row is the first row of the texture
+        s = self.size[0] / self.texture_size[0]
+        t = self.size[1] / self.texture_size[1]
+        top = h - rect.top
+        bottom = h - rect.top - self.size[1]
+        right = rect.left + self.size[0]
+        GL.glBegin(GL.GL_QUADS)
+        GL.glTexCoord2f(0, 0)
+        GL.glVertex2f(rect.left, top)
+        GL.glTexCoord2f(0, t)
+        GL.glVertex2f(rect.left, bottom)
+        GL.glTexCoord2f(s, t)
+        GL.glVertex2f(right, bottom)
+        GL.glTexCoord2f(s, 0)
+        GL.glVertex2f(right, top)
+        GL.glEnd()
+
+        GL.glPopAttrib()
+        GL.glMatrixMode(GL.GL_TEXTURE)
+        GL.glPopMatrix()
+        GL.glMatrixMode(GL.GL_MODELVIEW)
+
 #noinspection PyPropertyAccess
 
 
@@ -84,6 +180,13 @@ class Widget(object):
     _visible = True
     _is_gl_container = False
 
+    # Widgets drawn into a pygame Surface keep it in a SurfaceTexture. It is
+    # drawn again when the widget or a subwidget is invalidated, after input
+    # events, when a surface signature changes, or after surface_max_age seconds.
+    surface_max_age = 0.5
+    _surface_cache = None
+    _surface_dirty = True
+
     tooltip = None
     tooltipText = None
 
@@ -549,10 +652,24 @@ class Widget(object):
             self._rect.size = add(rmax.topleft, rmax.bottomright)
 
     def invalidate(self):
+        widget = self
+        while widget:
+            widget._surface_dirty = True
+            widget = widget.parent
         root = self.get_root()
         if root:
             root.do_draw = True
 
+    def get_surface_signature(self):
+        """Returns some of the state the widget is drawn from, for state that
+        can change without invalidate() being called. None by default."""
+        return None
+
+    def surface_signature(self):
+        """The surface signatures of the widget and its visible subwidgets"""
+        return (self.get_surface_signature(), tuple(self._rect),
+            tuple(widget.surface_signature() for widget in self.subwidgets if widget.visible))
+
     def get_cursor(self, event):
         return arrow_cursor
 
@@ -729,28 +846,27 @@ class Widget(object):
             for subwidget in self.subwidgets:
                 subwidget.gl_draw_all(root, suboffset)
         else:
-            try:
-                surface = Surface(self.size, SRCALPHA)
-            except Exception, e:
-                #size error?
-                return
-            self.draw_all(surface)
-            data = image.tostring(surface, 'RGBA', 1)
-            w, h = root.size
-            GL.glViewport(0, 0, w, h)
-            GL.glMatrixMode(GL.GL_PROJECTION)
-            GL.glLoadIdentity()
-            GLU.gluOrtho2D(0, w, 0, h)
-            GL.glMatrixMode(GL.GL_MODELVIEW)
-            GL.glLoadIdentity()
-            GL.glRasterPos2i(max(rect.left, 0), max(h - rect.bottom, 0))
-            GL.glPushAttrib(GL.GL_COLOR_BUFFER_BIT)
-            GL.glEnable(GL.GL_BLEND)
-            GL.glBlendFunc(GL.GL_SRC_ALPHA, GL.GL_ONE_MINUS_SRC_ALPHA)
-            GL.glDrawPixels(self.width, self.height,
-                GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, fromstring(data, dtype='uint8'))
-            GL.glPopAttrib()
-            GL.glFlush()
+            cache = self._surface_cache
+            if cache is None:
+                cache = self._surface_cache = SurfaceTexture()
+
+            now = time.time()
+            key = (self.surface_signature(), getattr(root, 'input_generation', None))
+            if self._surface_dirty or key != cache.key or now - cache.drawn_at > self.surface_max_age:
+                try:
+                    surface = Surface(self.size, SRCALPHA)
+                except Exception, e:
+                    #size error?
+                    return
+                self.draw_all(surface)
+                cache.load(surface)
+                cache.key = key
+                cache.drawn_at = now
+                self._surface_dirty = False
+                root.surface_redraws = getattr(root, 'surface_redraws', 0) + 1
+
+            root.surface_draws = getattr(root, 'surface_draws', 0) + 1
+            cache.draw(root, rect)
 
     def gl_draw_self(self, root, offset):
         pass
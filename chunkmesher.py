@@ -0,0 +1,117 @@
+"""Copyright (c) 2010-2012 David Rio Vierra
+
+Permission to use, copy, modify, and/or distribute this software for any
+purpose with or without fee is hereby granted, provided that the above
+copyright notice and this permission notice appear in all copies.
+
+THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE."""
+
+"""
+chunkmesher.py
+
+A pool of worker processes for the high detail chunk geometry.
+
+The main thread gathers a chunk's blocks and lights along with the
+border blocks of its neighbors, and sends those arrays to a worker. The worker
+runs the same ChunkCalculator code the renderer would, and sends back the
+vertex arrays of each BlockRenderer, ready to be compiled into display lists.
+"""
+
+import logging
+import multiprocessing
+import signal
+
+log = logging.getLogger(__name__)
+
+_calculators = {}
+
+
+def _initWorker():
+    # Ctrl-C is handled by the main process
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _getCalculator(materialsName, fastLeaves, roughGraphics, greedyMeshing):
+    key = (materialsName, fastLeaves, roughGraphics, greedyMeshing)
+    calc = _calculators.get(key)
+    if calc is None:
+        import pymclevel
+        from renderer import ChunkCalculator
+
+        materials = pymclevel.materials.namedMaterials[materialsName]
+        calc = ChunkCalculator.forMaterials(materials, fastLeaves, roughGraphics, greedyMeshing)
+        _calculators[key] = calc
+
+    return calc
+
+
+def meshChunk(materialsName, fastLeaves, roughGraphics, greedyMeshing, showHiddenOres, areaBlocks, blockData, areaBlockLights, sections=None):
+    """ Runs in the worker. Returns a list of (blockRendererClassName, y, vertexArrays, sourceFaces)
+    for the given sections, or the whole chunk, and the chunk's section connectivity """
+    import pymclevel
+
+    calc = _getCalculator(materialsName, fastLeaves, roughGraphics, greedyMeshing)
+    materials = pymclevel.materials.namedMaterials[materialsName]
+
+    blockRenderers = []
+    for _ in calc.calcHighDetailGeometry(areaBlocks, blockData, areaBlockLights, materials, showHiddenOres, None, blockRenderers, sections):
+        pass
+
+    geometry = [(type(br).__name__, br.y, br.vertexArrays, br.sourceFaces) for br in blockRenderers]
+    return geometry, calc.calcSectionConnectivity(areaBlocks)
+
+
+class ChunkMesherPool(object):
+    def __init__(self, processes):
+        self.processes = processes
+        self.pool = multiprocessing.Pool(processes, _initWorker)
+
+    @property
+    def maxPending(self):
+        """ Number of chunks the renderer should keep in flight to keep every worker busy. """
+        return self.processes * 2
+
+    def canMesh(self, materials):
+        """ Levels with their own materials can't be sent by name. Mesh those in the main process. """
+        import pymclevel
+        return pymclevel.materials.namedMaterials.get(materials.name) is materials
+
+    def submit(self, materials, fastLeaves, roughGraphics, greedyMeshing, showHiddenOres, areaBlocks, blockData, areaBlockLights, sections=None):
+        """ Returns an AsyncResult. Call ready() until True, then get() for the renderers """
+        return self.pool.apply_async(meshChunk, (materials.name, fastLeaves, roughGraphics, greedyMeshing, showHiddenOres,
+                                                 areaBlocks, blockData, areaBlockLights, sections))
+
+    def close(self):
+        self.pool.terminate()
+
+_mesherPool = None
+
+
+def getMesherPool(processes):
+    """ Returns the shared ChunkMesherPool with the given number of processes,
+    or None if processes is 0. Pass -1 to use one process less than the number of cores. """
+    global _mesherPool
+
+    if processes < 0:
+        try:
+            processes = multiprocessing.cpu_count() - 1
+        except NotImplementedError:
+            processes = 0
+
+    if _mesherPool and _mesherPool.processes != processes:
+        _mesherPool.close()
+        _mesherPool = None
+
+    if processes > 0 and _mesherPool is None:
+        try:
+            _mesherPool = ChunkMesherPool(processes)
+        except Exception, e:
+            log.warn(u"Unable to start the chunk mesher processes: {0!r}".format(e))
+
+    return _mesherPool
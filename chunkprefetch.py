@@ -0,0 +1,208 @@
+"""Copyright (c) 2010-2012 David Rio Vierra
+
+Permission to use, copy, modify, and/or distribute this software for any
+purpose with or without fee is hereby granted, provided that the above
+copyright notice and this permission notice appear in all copies.
+
+THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE."""
+
+"""
+chunkprefetch.py
+
+A background thread that reads the chunks the renderer will mesh next.
+
+The renderer passes the front of its chunk queue to request(). The thread reads
+and decompresses those chunks straight from the world's region files with its
+own file handles, so it never touches the level. The results wait in a bounded
+ready queue. When the level reads one of those chunks, the prefetched data is
+used instead of reading the region file again on the GUI thread.
+
+Only chunks that are neither loaded nor in the level's unsaved work folder are
+prefetched, since the region file holds the current copy of exactly those.
+"""
+
+from collections import deque, OrderedDict
+import logging
+import os
+import struct
+import threading
+import zlib
+
+log = logging.getLogger(__name__)
+
+SECTOR_BYTES = 4096
+
+
+def readRegionChunk(f, cx, cz):
+    """ Returns the decompressed data of a chunk in an open region file, or None if it isn't there """
+    f.seek(((cx & 0x1f) + (cz & 0x1f) * 32) * 4)
+    offset, = struct.unpack(">I", f.read(4))
+    sector, count = offset >> 8, offset & 0xff
+    if sector == 0 or count == 0:
+        return None
+
+    f.seek(sector * SECTOR_BYTES)
+    length, compression = struct.unpack(">IB", f.read(5))
+    if length > count * SECTOR_BYTES:
+        raise ValueError("Chunk length {0} is longer than its {1} sectors".format(length, count))
+    data = f.read(length - 1)
+
+    if compression == 1:
+        return zlib.decompress(data, zlib.MAX_WBITS | 16)
+    if compression == 2:
+        return zlib.decompress(data)
+    raise ValueError("Unknown chunk compression type {0}".format(compression))
+
+
+class ChunkPrefetcher(object):
+    maxReady = 256
+    maxOpenFiles = 16
+
+    def __init__(self, level):
+        self.level = level
+        self.regionFolder, regionFilename = os.path.split(level.worldFolder.getRegionFilename(0, 0))
+        self.regionExtension = os.path.splitext(regionFilename)[1]
+        self.hits = 0
+
+        self.condition = threading.Condition()
+        self.wanted = deque()
+        self.ready = OrderedDict()  # (cx, cz) -> decompressed chunk data, oldest first
+        self.reading = None
+        self.readingDiscarded = False
+        self.running = True
+
+        self.hookLevel()
+
+        self.thread = threading.Thread(target=self.run, name="ChunkPrefetcher")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def hookLevel(self):
+        """ Serve the level's reads of prefetched chunks. The level checks for the
+        chunk in its unsaved work folder before it reads the region file, but look
+        again here in case a chunk was written there since it was prefetched. """
+        level = self.level
+        readChunkBytes = level._getChunkBytes
+        unsavedWorkFolder = getattr(level, "unsavedWorkFolder", None)
+
+        def _getChunkBytes(cx, cz):
+            data = self.take((cx, cz))
+            if data is not None and not (unsavedWorkFolder and unsavedWorkFolder.containsChunk(cx, cz)):
+                self.hits += 1
+                return data
+            return readChunkBytes(cx, cz)
+
+        level._getChunkBytes = _getChunkBytes
+
+    def unhookLevel(self):
+        self.level.__dict__.pop("_getChunkBytes", None)
+
+    def needsRead(self, c):
+        level = self.level
+        if c in getattr(level, "_loadedChunkData", ()):
+            return False
+        unsavedWorkFolder = getattr(level, "unsavedWorkFolder", None)
+        if unsavedWorkFolder and unsavedWorkFolder.containsChunk(*c):
+            return False
+        return True
+
+    def request(self, chunks):
+        """ Replace the chunks waiting to be read, in order. """
+        chunks = [c for c in chunks if self.needsRead(c)]
+        with self.condition:
+            self.wanted = deque(c for c in chunks if c not in self.ready and c != self.reading)
+            self.condition.notify()
+
+    def pending(self, c):
+        """ True while the chunk is waiting to be read or being read """
+        with self.condition:
+            return c == self.reading or c in self.wanted
+
+    def take(self, c):
+        """ Removes and returns the prefetched data for a chunk, or None """
+        with self.condition:
+            return self.ready.pop(c, None)
+
+    def discard(self, c):
+        """ Forget a chunk that may have changed since it was read """
+        with self.condition:
+            self.ready.pop(c, None)
+            if c == self.reading:
+                self.readingDiscarded = True
+            if c in self.wanted:
+                self.wanted.remove(c)
+
+    def clear(self):
+        with self.condition:
+            self.ready.clear()
+            self.wanted.clear()
+            if self.reading is not None:
+                self.readingDiscarded = True
+
+    def close(self):
+        self.unhookLevel()
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+    def run(self):
+        files = OrderedDict()
+        try:
+            while True:
+                with self.condition:
+                    while self.running and not len(self.wanted):
+                        self.condition.wait()
+                    if not self.running:
+                        return
+                    c = self.reading = self.wanted.popleft()
+                    self.readingDiscarded = False
+
+                try:
+                    data = self.read(files, *c)
+                except Exception, e:
+                    log.debug(u"Unable to prefetch chunk {0}: {1!r}".format(c, e))
+                    data = None
+
+                with self.condition:
+                    if data is not None and not self.readingDiscarded:
+                        self.ready[c] = data
+                        while len(self.ready) > self.maxReady:
+                            self.ready.popitem(last=False)
+                    self.reading = None
+
+        finally:
+            for f in files.itervalues():
+                f.close()
+
+    def read(self, files, cx, cz):
+        rx, rz = cx >> 5, cz >> 5
+        f = files.pop((rx, rz), None)
+        if f is None:
+            filename = os.path.join(self.regionFolder, "r.{0}.{1}{2}".format(rx, rz, self.regionExtension))
+            if not os.path.exists(filename):
+                return None
+            f = file(filename, "rb")
+            while len(files) >= self.maxOpenFiles:
+                files.popitem(last=False)[1].close()
+        files[rx, rz] = f
+
+        return readRegionChunk(f, cx, cz)
+
+
+def getChunkPrefetcher(level):
+    """ Returns a ChunkPrefetcher for a level stored in region files, or None """
+    worldFolder = getattr(level, "worldFolder", None)
+    if not (hasattr(worldFolder, "getRegionFilename") and hasattr(level, "_getChunkBytes")):
+        return None
+
+    try:
+        return ChunkPrefetcher(level)
+    except Exception, e:
+        log.warn(u"Unable to start the chunk prefetcher: {0!r}".format(e))
+        return None
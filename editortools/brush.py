@@ -11,15 +11,15 @@ ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
 WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
 ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
 OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE."""
-import collections
-from datetime import datetime
 import numpy
 from numpy import newaxis
 import pygame
 from albow import AttrRef, Button, ValueDisplay, Row, Label, ValueButton, Column, IntField, CheckBox, FloatField, alert
 import bresenham
+from floodfill import floodFill
 from editortools.blockpicker import BlockPicker
 from editortools.blockview import BlockButton
+from editortools.clipboard import ClipboardView
 from editortools.editortool import EditorTool
 from editortools.tooloptions import ToolOptions
 from glbackground import Panel
@@ -31,9 +31,10 @@ from pymclevel.level import extractHeights
 from mceutils import ChoiceButton, CheckBoxLabel, showProgress, IntInputRow, alertException, drawTerrainCuttingWire
 from os.path import basename
 import tempfile
-import itertools
 import logging
-from operation import Operation, mkundotemp
+from collections import OrderedDict
+from operation import Operation
+from undojournal import ChunkUndoRecord
 from pymclevel.mclevelbase import exhaust
 
 from OpenGL import GL
@@ -88,6 +89,15 @@ class BrushMode(object):
     def applyToChunkSlices(self, op, chunk, slices, brushBox, brushBoxThisChunk):
         raise NotImplementedError
 
+    def applyToChunkMask(self, op, chunk, slices, brushMask):
+        """
+        Called by BrushOperation once per chunk with the union of the masks of every point in the stroke,
+        for brush modes whose result doesn't depend on the order the points are painted in.
+        slices select the part of the chunk's arrays that brushMask covers.
+        """
+        pass
+    applyToChunkMask = NotImplemented
+
     def createOptions(self, panel, tool):
         pass
 
@@ -107,8 +117,10 @@ class Modes:
             return col
 
         def applyToChunkSlices(self, op, chunk, slices, brushBox, brushBoxThisChunk):
-            brushMask = createBrushMask(op.brushSize, op.brushStyle, brushBox.origin, brushBoxThisChunk, op.noise, op.hollow)
+            brushMask = op.brushMask(brushBox, brushBoxThisChunk)
+            self.applyToChunkMask(op, chunk, slices, brushMask)
 
+        def applyToChunkMask(self, op, chunk, slices, brushMask):
             chunk.Blocks[slices][brushMask] = op.blockInfo.ID
             chunk.Data[slices][brushMask] = op.blockInfo.blockData
 
@@ -128,14 +140,13 @@ class Modes:
 
         def apply(self, op, point):
 
-            undoLevel = pymclevel.MCInfdevOldLevel(mkundotemp(), create=True)
             dirtyChunks = set()
 
-            def saveUndoChunk(cx, cz):
-                if (cx, cz) in dirtyChunks:
-                    return
+            def chunkEntered(cx, cz):
                 dirtyChunks.add((cx, cz))
-                undoLevel.copyChunkFrom(op.level, cx, cz)
+                # the fill may leave the chunks the operation started recording
+                if isinstance(op.undoLevel, ChunkUndoRecord):
+                    op.undoLevel.include(cx, cz)
 
             doomedBlock = op.level.blockAt(*point)
             doomedBlockData = op.level.blockDataAt(*point)
@@ -149,50 +160,24 @@ class Modes:
                 if doomedBlock == 2:  # grass
                     doomedBlock = 3  # dirt
 
-            x, y, z = point
-            saveUndoChunk(x // 16, z // 16)
-            op.level.setBlockAt(x, y, z, op.blockInfo.ID)
-            op.level.setBlockDataAt(x, y, z, op.blockInfo.blockData)
-
-            def processCoords(coords):
-                newcoords = collections.deque()
-
-                for (x, y, z) in coords:
-                    for _dir, offsets in pymclevel.faceDirections:
-                        dx, dy, dz = offsets
-                        p = (x + dx, y + dy, z + dz)
-
-                        nx, ny, nz = p
-                        b = op.level.blockAt(nx, ny, nz)
-                        if indiscriminate:
-                            if b == 2:
-                                b = 3
-                        if b == doomedBlock:
-                            if checkData:
-                                if op.level.blockDataAt(nx, ny, nz) != doomedBlockData:
-                                    continue
-
-                            saveUndoChunk(nx // 16, nz // 16)
-                            op.level.setBlockAt(nx, ny, nz, op.blockInfo.ID)
-                            op.level.setBlockDataAt(nx, ny, nz, op.blockInfo.blockData)
-                            newcoords.append(p)
-
-                return newcoords
-
-            def spread(coords):
-                while len(coords):
-                    start = datetime.now()
-
-                    num = len(coords)
-                    coords = processCoords(coords)
-                    d = datetime.now() - start
-                    progress = "Did {0} coords in {1}".format(num, d)
-                    log.info(progress)
-                    yield progress
-
-            showProgress("Flood fill...", spread([point]), cancel=True)
+            blockID = op.blockInfo.ID
+            blockData = op.blockInfo.blockData
+
+            def fillable(chunk):
+                blocks = chunk.Blocks
+                if indiscriminate:
+                    blocks = numpy.where(blocks == 2, 3, blocks)
+                mask = blocks == doomedBlock
+                if checkData:
+                    mask &= chunk.Data == doomedBlockData
+                return mask
+
+            def fill(chunk, mask):
+                chunk.Blocks[mask] = blockID
+                chunk.Data[mask] = blockData
+
+            showProgress("Flood fill...", floodFill(op.level, [point], fillable, fill, chunkEntered=chunkEntered), cancel=True)
             op.editor.invalidateChunks(dirtyChunks)
-            op.undoLevel = undoLevel
 
     class Replace(Fill):
         name = "Replace"
@@ -200,13 +185,11 @@ class Modes:
         def createOptions(self, panel, tool):
             return Modes.Fill.createOptions(self, panel, tool) + [panel.replaceBlockButton]
 
-        def applyToChunkSlices(self, op, chunk, slices, brushBox, brushBoxThisChunk):
+        def applyToChunkMask(self, op, chunk, slices, brushMask):
 
             blocks = chunk.Blocks[slices]
             data = chunk.Data[slices]
 
-            brushMask = createBrushMask(op.brushSize, op.brushStyle, brushBox.origin, brushBoxThisChunk, op.noise, op.hollow)
-
             replaceWith = op.options['replaceBlockInfo']
             # xxx pasted from fill.py
             if op.blockInfo.wildcard:
@@ -219,7 +202,7 @@ class Modes:
 
             replaceTable = block_fill.blockReplaceTable(blocksToReplace)
             replaceMask = replaceTable[blocks, data]
-            brushMask &= replaceMask
+            brushMask = brushMask & replaceMask
 
             blocks[brushMask] = replaceWith.ID
             data[brushMask] = replaceWith.blockData
@@ -266,7 +249,7 @@ class Modes:
                 solidBlocks = blocks != 0
                 neighbors = getNeighbors(solidBlocks)
 
-                brushMask = createBrushMask(op.brushSize, op.brushStyle)
+                brushMask = cachedBrushMask(op.brushSize, op.brushStyle)
                 erodeBlocks = neighbors < 5
                 erodeBlocks &= (numpy.random.random(erodeBlocks.shape) > 0.3)
                 erodeBlocks[1:-1, 1:-1, 1:-1] &= brushMask
@@ -308,7 +291,7 @@ class Modes:
             blocks = chunk.Blocks[slices]
             data = chunk.Data[slices]
 
-            brushMask = createBrushMask(op.brushSize, op.brushStyle, brushBox.origin, brushBoxThisChunk, op.noise, op.hollow)
+            brushMask = op.brushMask(brushBox, brushBoxThisChunk)
 
 
             if op.options['naturalEarth']:
@@ -330,20 +313,19 @@ class Modes:
             if depth < 0:
                 blocktypeMask &= (blocks != blocktype.ID)
 
-            heightmap = extractHeights(blocktypeMask)
+            heightmap = extractHeights(blocktypeMask).astype(int)[:, :, newaxis]
+            y = numpy.arange(blocks.shape[2])
 
-            for x, z in itertools.product(*map(xrange, heightmap.shape)):
-                h = heightmap[x, z]
-                if h >= brushBoxThisChunk.height:
-                    continue
-                if depth > 0:
-                    idx = x, z, slice(max(0, h - depth), h)
-                else:
-                    # negative depth values mean to put a layer above the surface
-                    idx = x, z, slice(h, min(blocks.shape[2], h - depth))
-                mask = brushMask[idx]
-                blocks[idx][mask] = blocktype.ID
-                data[idx][mask] = blocktype.blockData
+            if depth > 0:
+                band = (y >= heightmap - depth) & (y < heightmap)
+            else:
+                # negative depth values mean to put a layer above the surface
+                band = (y >= heightmap) & (y < heightmap - depth)
+            band &= heightmap < brushBoxThisChunk.height
+            band &= brushMask
+
+            blocks[band] = blocktype.ID
+            data[band] = blocktype.blockData
 
     class Paste(BrushMode):
 
@@ -431,7 +413,54 @@ class BrushOperation(Operation):
     def hollow(self):
         return self.options.get('brushHollow', False)
 
+    noisyMasks = None
+
+    def brushMask(self, brushBox, box):
+        """
+        Return the brush's mask for the part of brushBox inside box, indexed like a Blocks array.
+        The whole mask is made once for each brush shape, or once for each point if the brush has noise.
+        The mask may be shared, so don't change it.
+        """
+        if self.noise < 100:
+            key = tuple(brushBox.origin)
+            if self.noisyMasks is None:
+                self.noisyMasks = {}
+            if key not in self.noisyMasks:
+                self.noisyMasks[key] = createBrushMask(self.brushSize, self.brushStyle, chance=self.noise, hollow=self.hollow)
+            mask = self.noisyMasks[key]
+        else:
+            mask = cachedBrushMask(self.brushSize, self.brushStyle, self.hollow)
 
+        x, y, z = [a - b for a, b in zip(box.origin, brushBox.origin)]
+        w, h, l = box.size
+        return mask[x:x + w, z:z + l, y:y + h]
+
+    def strokeMask(self, chunk):
+        """
+        Return the union of the masks of every point for the part of the chunk inside the dirty box,
+        and the slices of the chunk's arrays it covers, or None if no point touches the chunk.
+        """
+        boxThisChunk, slices = chunk.getChunkSlicesForBox(self._dirtyBox)
+        if boxThisChunk.volume == 0:
+            return None
+
+        w, h, l = boxThisChunk.size
+        mask = numpy.zeros((w, l, h), dtype='bool')
+        touched = False
+        for point in self.points:
+            brushBox = self.brushMode.brushBoxForPointAndOptions(point, self.options)
+            part = brushBox.intersect(boxThisChunk)
+            if part.volume == 0:
+                continue
+
+            x, y, z = [a - b for a, b in zip(part.origin, boxThisChunk.origin)]
+            pw, ph, pl = part.size
+            mask[x:x + pw, z:z + pl, y:y + ph] |= self.brushMask(brushBox, part)
+            touched = True
+
+        if not touched:
+            return None
+        return mask, slices
 
     def dirtyBox(self):
         return self._dirtyBox
@@ -450,6 +479,19 @@ class BrushOperation(Operation):
                             yield progress
                     else:
                         yield i, len(self.points), "Applying {0} brush...".format(self.brushMode.name)
+            elif self.brushMode.applyToChunkMask is not NotImplemented:
+                # the whole stroke is written to each chunk at once
+                for j, cPos in enumerate(self._dirtyBox.chunkPositions):
+                    if not self.level.containsChunk(*cPos):
+                        continue
+                    chunk = self.level.getChunk(*cPos)
+                    stroke = self.strokeMask(chunk)
+                    if stroke is not None:
+                        mask, slices = stroke
+                        self.brushMode.applyToChunkMask(self, chunk, slices, mask)
+                        chunk.chunkChanged()
+
+                    yield j, self._dirtyBox.chunkCount, "Applying {0} brush...".format(self.brushMode.name)
             else:
 
                 for j, cPos in enumerate(self._dirtyBox.chunkPositions):
@@ -468,10 +510,13 @@ class BrushOperation(Operation):
 
                     chunk.chunkChanged()
 
-        if len(self.points) > 10:
-            showProgress("Performing brush...", _perform(), cancel=True)
-        else:
-            exhaust(_perform())
+        try:
+            if len(self.points) > 10:
+                showProgress("Performing brush...", _perform(), cancel=True)
+            else:
+                exhaust(_perform())
+        finally:
+            self.noisyMasks = None
 
 
 
@@ -722,6 +767,8 @@ class BrushTool(CloneTool):
                 return
 
     def loadLevel(self, level):
+        if isinstance(level, ClipboardView):
+            level = level.extract()
         self.level = level
         self.minimumSpacing = min([s / 4 for s in level.size])
         self.centerx, self.centery, self.centerz = -level.Width / 2, 0, -level.Length / 2
@@ -1077,6 +1124,26 @@ class BrushTool(CloneTool):
     def option3(self):
         self.brushHollow = not self.brushHollow
 
+_brushMasks = OrderedDict()
+maxCachedBrushMasks = 16
+
+
+def cachedBrushMask(shape, style="Round", hollow=False):
+    """
+    Return the whole mask for a brush with the given shape and style, from createBrushMask.
+    The most recently used masks are kept, and are read-only.
+    """
+    key = (tuple(shape), style, hollow)
+    mask = _brushMasks.pop(key, None)
+    if mask is None:
+        mask = createBrushMask(shape, style, hollow=hollow)
+        mask.flags.writeable = False
+        while len(_brushMasks) >= maxCachedBrushMasks:
+            _brushMasks.popitem(last=False)
+    _brushMasks[key] = mask
+    return mask
+
+
 def createBrushMask(shape, style="Round", offset=(0, 0, 0), box=None, chance=100, hollow=False):
     """
     Return a boolean array for a brush with the given shape and style.
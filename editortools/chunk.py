@@ -17,6 +17,7 @@ import numpy
 from numpy import newaxis
 
 from albow import Label, ValueDisplay, AttrRef, Button, Column, ask, Row, alert, Widget, Menu
+from editortools.clipboard import captureChunks, copyOnWrite
 from editortools.editortool import EditorTool
 from glbackground import Panel
 from glutils import DisplayList, gl
@@ -250,7 +251,8 @@ class ChunkTool(EditorTool):
                     except Exception, e:
                         print "Error during chunk delete: ", e
 
-        with setWindowCaption("DELETING - "):
+        with setWindowCaption("DELETING - "), copyOnWrite(self.editor.level):
+            captureChunks(self.editor.level, chunks)
             showProgress("Deleting chunks...", _destroyChunks())
 
         self.editor.renderer.invalidateChunkMarkers()
@@ -275,7 +277,9 @@ class ChunkTool(EditorTool):
 
                 yield i, self.editor.level.chunkCount
 
-        with setWindowCaption("PRUNING - "):
+        with setWindowCaption("PRUNING - "), copyOnWrite(self.editor.level):
+            selectedChunks = self.selectedChunks()
+            captureChunks(self.editor.level, (c for c in self.editor.level.allChunks if c not in selectedChunks))
             showProgress("Pruning chunks...", _pruneChunks())
 
         self.editor.renderer.invalidateChunkMarkers()
@@ -313,7 +317,8 @@ class ChunkTool(EditorTool):
         createChunks = panel.generate(self.editor.level, chunks)
 
         try:
-            with setWindowCaption("CREATING - "):
+            with setWindowCaption("CREATING - "), copyOnWrite(self.editor.level):
+                captureChunks(self.editor.level, chunks)
                 showProgress("Creating {0} chunks...".format(len(chunks)), createChunks, cancel=True)
         except Exception, e:
             traceback.print_exc()
@@ -0,0 +1,314 @@
+"""Copyright (c) 2010-2012 David Rio Vierra
+
+Permission to use, copy, modify, and/or distribute this software for any
+purpose with or without fee is hereby granted, provided that the above
+copyright notice and this permission notice appear in all copies.
+
+THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE."""
+
+"""
+clipboard.py
+
+Copies of a box in a world that aren't made until they are needed.
+
+A ClipboardView is what the Copy command and the clone tool hold instead of a
+schematic. It only remembers the world and the box. The previewer reads it one
+chunk at a time through getChunk, which slices the blocks out of the world's
+chunks, and the schematic is only extracted when the blocks are placed, saved
+or changed.
+
+The world can still be edited while a view is alive. The editor runs every
+operation, undo and redo inside copyOnWrite(level), which hooks the level's
+getChunk the same way a ChunkUndoRecord does. The first time a chunk under a
+view is loaded, the part of it in the view's box is copied and kept, and the
+view reads that copy from then on, so it always shows the blocks as they were
+when they were copied. Edits that delete, create or replace whole chunks call
+captureChunks first, since they don't load the chunks they change.
+"""
+
+from contextlib import contextmanager
+import copy
+import logging
+import os
+import tempfile
+import weakref
+
+import numpy
+
+from albow.root import Cancel
+from mceutils import showProgress
+import pymclevel
+from pymclevel import BoundingBox
+
+log = logging.getLogger(__name__)
+
+# views that haven't extracted their schematic yet
+liveViews = weakref.WeakSet()
+
+
+def viewsOf(level):
+    return [view for view in liveViews if view.sourceLevel is level]
+
+
+@contextmanager
+def copyOnWrite(level):
+    """ While the block is running, any chunk of level under a live view is
+    copied into the view before whoever loaded it can change it. """
+    if not viewsOf(level):
+        yield
+        return
+
+    getChunk = level.getChunk
+    previousGetChunk = level.__dict__.get("getChunk")
+
+    def _getChunk(cx, cz):
+        chunk = getChunk(cx, cz)
+        for view in viewsOf(level):
+            view.capture(cx, cz, chunk)
+        return chunk
+
+    level.getChunk = _getChunk
+    try:
+        yield
+    finally:
+        if previousGetChunk is None:
+            level.__dict__.pop("getChunk", None)
+        else:
+            level.getChunk = previousGetChunk
+
+
+def captureChunks(level, chunks):
+    """ Keep the parts of the given chunks under each live view of level before
+    they are deleted or replaced by something that doesn't load them with
+    getChunk. Chunks that aren't there yet are kept as air. """
+    views = viewsOf(level)
+    for cx, cz in chunks:
+        covering = [view for view in views if view.coversChunk(cx, cz)]
+        if not covering:
+            continue
+        chunk = level.getChunk(cx, cz) if level.containsChunk(cx, cz) else None
+        for view in covering:
+            view.capture(cx, cz, chunk)
+
+
+def copyPart(source, cx, cz, box, dest, entityOffset):
+    """ Copy the blocks and entities of the world's chunk (cx, cz) that are in box
+    into dest, whose arrays are the size of box. source is the chunk or its
+    ChunkSnapshot. Entities are moved by entityOffset. """
+    part = box.intersect(BoundingBox((cx << 4, box.miny, cz << 4), (16, box.height, 16)))
+    if not part.volume:
+        return
+
+    yOffset = getattr(source, "yOffset", 0)
+    sourceSlices = numpy.s_[part.minx - (cx << 4):part.maxx - (cx << 4),
+                            part.minz - (cz << 4):part.maxz - (cz << 4),
+                            part.miny - yOffset:part.maxy - yOffset]
+    destSlices = numpy.s_[part.minx - box.minx:part.maxx - box.minx,
+                          part.minz - box.minz:part.maxz - box.minz,
+                          part.miny - box.miny:part.maxy - box.miny]
+    dest.Blocks[destSlices] = source.Blocks[sourceSlices]
+    dest.Data[destSlices] = source.Data[sourceSlices]
+
+    for tag in source.Entities:
+        if pymclevel.Entity.pos(tag) in part:
+            dest.Entities.append(pymclevel.Entity.copyWithOffset(tag, entityOffset))
+    for tag in source.TileEntities:
+        if pymclevel.TileEntity.pos(tag) in part:
+            dest.TileEntities.append(pymclevel.TileEntity.copyWithOffset(tag, entityOffset))
+
+
+class ChunkSnapshot(object):
+    """ The blocks and entities of a chunk that are in a view's box, as they were
+    before the chunk was changed. The arrays hold the box's layers of the whole
+    chunk, starting at yOffset. Entity positions are in world coordinates. If
+    chunk is None, the chunk wasn't there and the snapshot is air. """
+
+    def __init__(self, chunk, box):
+        layers = numpy.s_[:, :, box.miny:box.maxy]
+        self.yOffset = box.miny
+        if chunk is None:
+            self.Blocks = numpy.zeros((16, 16, box.height), 'uint16')
+            self.Data = numpy.zeros((16, 16, box.height), 'uint8')
+            self.Entities = []
+            self.TileEntities = []
+            return
+
+        self.Blocks = numpy.array(chunk.Blocks[layers])
+        self.Data = numpy.array(chunk.Data[layers])
+        self.Entities = [copy.deepcopy(tag) for tag in chunk.Entities if pymclevel.Entity.pos(tag) in box]
+        self.TileEntities = [copy.deepcopy(tag) for tag in chunk.TileEntities if pymclevel.TileEntity.pos(tag) in box]
+
+
+class ClipboardChunk(object):
+    """ One chunk of a ClipboardView, in the view's coordinates, for the previewer.
+    Lit with full brightness, like a schematic's chunks. """
+    root_tag = None
+    dirty = False
+
+    def __init__(self, view, cx, cz):
+        self.world = weakref.proxy(view)  # the view caches its chunks
+        self.chunkPosition = (cx, cz)
+        self.materials = view.materials
+
+        box = BoundingBox((cx << 4, 0, cz << 4), (16, view.Height, 16)).intersect(view.bounds)
+        w, h, l = box.size
+        self.Blocks = numpy.zeros((w, l, h), 'uint16')
+        self.Data = numpy.zeros((w, l, h), 'uint8')
+        self.Entities = []
+        self.TileEntities = []
+        view.copyRegion(box, self)
+
+        self.SkyLight = numpy.empty((w, l, h), 'uint8')
+        self.SkyLight[:] = 15
+        self.BlockLight = self.SkyLight
+
+        solid = self.Blocks != 0
+        self.HeightMap = numpy.where(solid.any(2), h - solid[:, :, ::-1].argmax(2), 0).T
+
+
+class ClipboardView(object):
+    """ A box of a world, held by the copy stack or the clone tool in place of the
+    schematic extracted from it. Has what the previewer and the tools need from
+    a level; call extract() for the schematic itself. If the box holds more than
+    maxBlocks, the schematic is extracted into a zip file. """
+
+    filename = None
+    chunkCacheSize = 32
+
+    def __init__(self, level, box, maxBlocks=None):
+        self.sourceLevel = level
+        self.sourceBox = box
+        self.maxBlocks = maxBlocks
+        self.bounds = BoundingBox((0, 0, 0), box.size)
+        self.Width, self.Height, self.Length = box.size
+        self.materials = level.materials
+        self.snapshots = {}  # (cx, cz) in the world -> ChunkSnapshot
+        self.chunkCache = {}
+        self.schematic = None
+        liveViews.add(self)
+
+    @property
+    def size(self):
+        return self.bounds.size
+
+    @property
+    def displayName(self):
+        return self.sourceLevel.displayName
+
+    @property
+    def allChunks(self):
+        if self.schematic is not None:
+            return self.schematic.allChunks
+        return [(cx, cz) for cx in xrange((self.Width + 15) >> 4) for cz in xrange((self.Length + 15) >> 4)]
+
+    @property
+    def chunkCount(self):
+        if self.schematic is not None:
+            return self.schematic.chunkCount
+        return ((self.Width + 15) >> 4) * ((self.Length + 15) >> 4)
+
+    def containsChunk(self, cx, cz):
+        if self.schematic is not None:
+            return self.schematic.containsChunk(cx, cz)
+        return 0 <= cx < (self.Width + 15) >> 4 and 0 <= cz < (self.Length + 15) >> 4
+
+    def getChunk(self, cx, cz):
+        if self.schematic is not None:
+            return self.schematic.getChunk(cx, cz)
+        if not self.containsChunk(cx, cz):
+            raise pymclevel.ChunkNotPresent((cx, cz))
+
+        chunk = self.chunkCache.get((cx, cz))
+        if chunk is None:
+            if len(self.chunkCache) >= self.chunkCacheSize:
+                self.chunkCache.clear()
+            chunk = self.chunkCache[cx, cz] = ClipboardChunk(self, cx, cz)
+        return chunk
+
+    def sourceChunk(self, cx, cz):
+        """ The chunk of the world to read the view's blocks from, as it was when
+        the view was made, or None if it has no blocks """
+        snapshot = self.snapshots.get((cx, cz))
+        if snapshot is not None:
+            return snapshot
+        if not self.sourceLevel.containsChunk(cx, cz):
+            return None
+        return self.sourceLevel.getChunk(cx, cz)
+
+    def copyRegion(self, box, chunk):
+        """ Copy the blocks and entities in box, in the view's coordinates, into the
+        arrays and lists of chunk, which are the size of box """
+        origin = self.sourceBox.origin
+        worldBox = BoundingBox([a + b for a, b in zip(box.origin, origin)], box.size)
+
+        for cx, cz in worldBox.chunkPositions:
+            source = self.sourceChunk(cx, cz)
+            if source is not None:
+                copyPart(source, cx, cz, worldBox, chunk, [-a for a in origin])
+
+    def coversChunk(self, cx, cz):
+        """ True if part of the world's chunk (cx, cz) is in the box """
+        chunkBox = BoundingBox((cx << 4, 0, cz << 4), (16, self.sourceLevel.Height, 16))
+        return bool(chunkBox.intersect(self.sourceBox).volume)
+
+    def capture(self, cx, cz, chunk):
+        """ Called before a chunk of the world may be changed. Keeps the part of it
+        in the box unless it was kept already. chunk is None if it isn't there. """
+        if (cx, cz) in self.snapshots or not self.coversChunk(cx, cz):
+            return
+        self.snapshots[cx, cz] = ChunkSnapshot(chunk, self.sourceBox)
+
+    def extract(self):
+        """ Returns the schematic of the box as it was when the view was made,
+        extracting it the first time. Raises Cancel if the user cancels. """
+        if self.schematic is not None:
+            return self.schematic
+
+        box = self.sourceBox
+        status = "Copying {0:n} blocks...".format(box.volume)
+        if self.maxBlocks is not None and box.volume > self.maxBlocks:
+            filename = tempfile.mkdtemp(".zip", "mceditcopy")
+            os.rmdir(filename)
+            schematic = showProgress(status, self.sourceLevel.extractZipSchematicIter(box, filename), cancel=True)
+        else:
+            schematic = showProgress(status, self.sourceLevel.extractSchematicIter(box), cancel=True)
+        if schematic == "Canceled":
+            raise Cancel
+
+        # put back the parts of the box that were changed since the view was made
+        for (cx, cz), snapshot in self.snapshots.iteritems():
+            part = box.intersect(BoundingBox((cx << 4, box.miny, cz << 4), (16, box.height, 16)))
+            patch = pymclevel.MCSchematic(part.size, mats=self.materials)
+            copyPart(snapshot, cx, cz, part, patch, [-a for a in part.origin])
+
+            destBox = BoundingBox([a - b for a, b in zip(part.origin, box.origin)], part.size)
+            schematic.removeEntitiesInBox(destBox)
+            schematic.removeTileEntitiesInBox(destBox)
+            schematic.copyBlocksFrom(patch, patch.bounds, destBox.origin)
+
+        self.schematic = schematic
+        self.filename = getattr(schematic, "filename", None)
+        self.snapshots = {}
+        self.chunkCache = {}
+        liveViews.discard(self)
+        return schematic
+
+    def saveToFile(self, filename):
+        self.extract().saveToFile(filename)
+
+    def release(self):
+        """ Stop keeping the blocks that change in the world. For views that won't be read again. """
+        liveViews.discard(self)
+        self.snapshots = {}
+        self.chunkCache = {}
+
+    def close(self):
+        self.release()
+        if hasattr(self.schematic, "close"):
+            self.schematic.close()
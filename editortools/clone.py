@@ -18,6 +18,7 @@ import numpy
 import pygame
 from albow import Widget, IntField, Column, Row, Label, Button, CheckBox, AttrRef, FloatField, alert
 from depths import DepthOffset
+from editortools.clipboard import ClipboardView
 from editortools.editortool import EditorTool
 from editortools.nudgebutton import NudgeButton
 from editortools.tooloptions import ToolOptions
@@ -46,6 +47,69 @@ CloneSettings.copyWater = CloneSettings("Copy Water", True)
 CloneSettings.copyBiomes = CloneSettings("Copy Biomes", True)
 CloneSettings.placeImmediately = CloneSettings("Place Immediately", True)
 
+_schematicAxes = {}
+
+
+def schematicAxes(level, operation):
+    """ Returns how a schematic's rotateLeft, roll, flipVertical, flipNorthSouth or
+    flipEastWest moves its blocks, as a 3x3 matrix of 0, 1 and -1. Entry [i, j] is
+    the step along the old axis i for a step along the new axis j, in x, y, z order.
+
+    Found by performing the operation on a small schematic with numbered blocks.
+    Returns None if the operation does more than turn or mirror the block arrays. """
+    if operation not in _schematicAxes:
+        axes = None
+        try:
+            probe = pymclevel.MCSchematic((2, 3, 4), mats=level.materials)
+            probe.Blocks[:] = numpy.arange(1, 25).reshape(probe.Blocks.shape)
+            getattr(probe, operation)()
+
+            blocks = numpy.asarray(probe.Blocks, dtype='int64') - 1
+            if sorted(blocks.ravel().tolist()) == range(24):
+                ox, oz, oy = numpy.unravel_index(blocks.ravel(), (2, 4, 3))
+                w, l, h = blocks.shape
+                old = numpy.array([ox, oy, oz]).reshape(3, w, l, h).transpose(0, 1, 3, 2)
+                origin = old[:, 0, 0, 0]
+                steps = numpy.array([old[:, 1, 0, 0], old[:, 0, 1, 0], old[:, 0, 0, 1]]).T - origin[:, numpy.newaxis]
+
+                grid = numpy.indices(old.shape[1:])
+                if ((abs(steps).sum(0) == 1).all() and (abs(steps).sum(1) == 1).all()
+                        and (numpy.tensordot(steps, grid, 1) + origin[:, numpy.newaxis, numpy.newaxis, numpy.newaxis] == old).all()):
+                    axes = steps
+        except Exception, e:
+            log.warn(u"Unable to find how {0} moves blocks: {1!r}".format(operation, e))
+
+        _schematicAxes[operation] = axes
+    return _schematicAxes[operation]
+
+
+def transformMatrix(axes, size):
+    """ Returns the 4x4 matrix that moves points in a level of the given (width,
+    height, length) to where an operation with the given axes moves them, and the
+    size of the level after the operation """
+    size = numpy.array(size)
+    offsets = numpy.where(axes.sum(1) < 0, size, 0)
+    matrix = numpy.identity(4)
+    matrix[:3, :3] = axes.T
+    matrix[:3, 3] = -axes.T.dot(offsets)
+    return matrix, tuple(abs(axes.T).dot(size).tolist())
+
+
+def scaledIndices(size, factor):
+    """ For each cell along an axis of the given size scaled by factor, the index
+    of the nearest cell before scaling. At least one cell is kept. """
+    count = max(1, int(size * factor))
+    return numpy.minimum((numpy.arange(count) / factor).astype('intp'), size - 1)
+
+
+def rescaleArray(dest, source, indices, slabSize=16):
+    """ Fill dest with the cells of source picked by an index vector for each axis,
+    slabSize planes of the first axis at a time, so only one slab of indices and
+    values is ever made """
+    first, second, third = indices
+    for start in xrange(0, len(first), slabSize):
+        dest[start:start + slabSize] = source[numpy.ix_(first[start:start + slabSize], second, third)]
+
 
 class CoordsInput(Widget):
     is_gl_container = True
@@ -208,6 +272,12 @@ class CloneOperation(Operation):
         super(CloneOperation, self).undo()
         [i.undo() for i in self.selectionOps]
 
+    def redo(self):
+        performsAgain = self.redoLevel is None
+        super(CloneOperation, self).redo()
+        if not performsAgain:
+            [i.perform() for i in self.selectionOps]
+
 
 class CloneToolPanel(Panel):
     useOffsetInput = True
@@ -391,6 +461,7 @@ class CloneTool(EditorTool):
         self.optionsPanel = CloneToolOptions(self)
 
         self.destPoint = None
+        self.originalLevel = None
 
     @property
     def statusText(self):
@@ -457,8 +528,10 @@ class CloneTool(EditorTool):
             self.panel = None
 
         self.destPoint = None
+        self.releaseView()
         self.level = None
         self.originalLevel = None
+        self.pendingOperations = []
 
     def toolReselected(self):
         self.pickUp()
@@ -503,37 +576,25 @@ class CloneTool(EditorTool):
         #    return
         # oldfactor = self.level.cloneToolScaleFactor
         # factor = newFactor / oldfactor
-        if factor == 1:
+        # a number, or a factor for each of x, y and z
+        factors = numpy.ones(3) * factor
+        if (factors == 1).all():
             self.level = self.originalLevel
             self.setupPreview()
             return
 
-        oldshape = self.originalLevel.Blocks.shape
+        if isinstance(self.originalLevel, ClipboardView):
+            self.originalLevel = self.originalLevel.extract()
         blocks = self.originalLevel.Blocks
         data = self.originalLevel.Data
 
-        if factor < 1.0:
-            roundedShape = map(lambda x: int(int(x * factor) / factor), oldshape)
-            roundedSlices = map(lambda x: slice(0, x), roundedShape)
-            blocks = blocks[roundedSlices]
-            data = data[roundedSlices]
-        else:
-            roundedShape = oldshape
-
-        newshape = map(lambda x: int(x * factor), oldshape)
-        xyzshape = newshape[0], newshape[2], newshape[1]
-        newlevel = pymclevel.MCSchematic(xyzshape, mats=self.editor.level.materials)
-
-        srcgrid = numpy.mgrid[0:roundedShape[0]:1.0 / factor, 0:roundedShape[1]:1.0 / factor, 0:roundedShape[2]:1.0 / factor].astype('uint')
-        dstgrid = numpy.mgrid[0:newshape[0], 0:newshape[1], 0:newshape[2]].astype('uint')
-        srcgrid = srcgrid[map(slice, dstgrid.shape)]
-        dstgrid = dstgrid[map(slice, srcgrid.shape)]
-
-        def copyArray(dest, src):
-            dest[dstgrid[0], dstgrid[1], dstgrid[2]] = src[srcgrid[0], srcgrid[1], srcgrid[2]]
+        # the arrays are x, z, y
+        indices = [scaledIndices(size, f) for size, f in zip(blocks.shape, factors[[0, 2, 1]])]
+        w, l, h = [len(i) for i in indices]
+        newlevel = pymclevel.MCSchematic((w, h, l), mats=self.editor.level.materials)
 
-        copyArray(newlevel.Blocks, blocks)
-        copyArray(newlevel.Data, data)
+        rescaleArray(newlevel.Blocks, blocks, indices)
+        rescaleArray(newlevel.Data, data, indices)
 
         self.level = newlevel
         self.setupPreview()
@@ -580,8 +641,14 @@ class CloneTool(EditorTool):
         with setWindowCaption("COPYING - "):
             self.editor.freezeStatus("Copying to clone buffer...")
             box = self.selectionBox()
-            self.level = self.editor.level.extractSchematic(box)
+            self.releaseView()
+            if isinstance(self.editor.level, pymclevel.MCInfdevOldLevel):
+                # blocks are read from the world as the preview needs them
+                self.level = ClipboardView(self.editor.level, box)
+            else:
+                self.level = self.editor.level.extractSchematic(box)
             self.originalLevel = self.level
+            self.pendingOperations = []
             # self.level.cloneToolScaleFactor = 1.0
             self.rescaleLevel(self.scaleFactor)
             self.setupPreview()
@@ -602,18 +669,66 @@ class CloneTool(EditorTool):
         if self.level:
             self.previewRenderer = PreviewRenderer(self.level, alpha)
             self.previewRenderer.position = self.editor.renderer.position
+            self.updatePreviewTransform()
             self.editor.addWorker(self.previewRenderer)
         else:
             self.editor.toolbar.selectTool(-1)
 
+    # Rotations and flips the preview shows, but which aren't done to the level's blocks
+    # until the clone is placed. The names of the schematic's methods, in order.
+    pendingOperations = ()
+
+    def transformLevel(self, operation):
+        """ Turn or flip the level with one of its methods. Only the preview is turned
+        until sourceLevel() is called, unless the operation can't be shown that way. """
+        if schematicAxes(self.level, operation) is None:
+            self.applyPendingOperations()
+            self.extractView()
+            getattr(self.level, operation)()
+            self.previewRenderer.level = self.level
+            return
+
+        self.pendingOperations = list(self.pendingOperations) + [operation]
+        self.updatePreviewTransform()
+
+    def transformedLevel(self):
+        """ Returns the matrix that moves the level's blocks to where the pending
+        operations will put them, and the level's size after them """
+        size = (self.level.Width, self.level.Height, self.level.Length)
+        matrix = numpy.identity(4)
+        for operation in self.pendingOperations:
+            step, size = transformMatrix(schematicAxes(self.level, operation), size)
+            matrix = step.dot(matrix)
+        return matrix, size
+
+    def updatePreviewTransform(self):
+        if self.previewRenderer:
+            if self.pendingOperations:
+                self.previewRenderer.transform = self.transformedLevel()[0]
+            else:
+                self.previewRenderer.transform = None
+
+    def applyPendingOperations(self):
+        if not self.pendingOperations:
+            return
+
+        self.extractView()
+        operations = self.pendingOperations
+        self.pendingOperations = []
+        for operation in operations:
+            getattr(self.level, operation)()
+
+        if self.previewRenderer:
+            self.previewRenderer.transform = None
+            self.previewRenderer.level = self.level
+
     @property
     def canRotateLevel(self):
         return not isinstance(self.level, (pymclevel.MCInfdevOldLevel, PocketWorld))
 
     def rotatedSelectionSize(self):
         if self.canRotateLevel:
-            sizes = self.level.Blocks.shape
-            return sizes[0], sizes[2], sizes[1]
+            return self.transformedLevel()[1]
         else:
             return self.level.size
 
@@ -757,7 +872,21 @@ class CloneTool(EditorTool):
             self.editor.drawConstructionCube(box, color)
             box = BoundingBox(box.origin + delta, box.size)
 
+    def extractView(self):
+        """ If the tool holds a ClipboardView, swap it for the schematic extracted from it """
+        if isinstance(self.level, ClipboardView):
+            if self.originalLevel is self.level:
+                self.originalLevel = self.level.extract()
+            self.level = self.level.extract()
+
+    def releaseView(self):
+        """ Stop a ClipboardView made by the tool from keeping the world's old blocks """
+        if isinstance(self.originalLevel, ClipboardView) and self.originalLevel not in self.editor.copyStack:
+            self.originalLevel.release()
+
     def sourceLevel(self):
+        self.applyPendingOperations()
+        self.extractView()
         return self.level
 
     @alertException
@@ -766,36 +895,28 @@ class CloneTool(EditorTool):
             self.rotation += amount
             self.rotation &= 0x3
             for i in range(amount & 0x3):
-                self.level.rotateLeft()
-
-            self.previewRenderer.level = self.level
+                self.transformLevel("rotateLeft")
 
     @alertException
     def roll(self, amount=1):
         if self.canRotateLevel:
             for i in range(amount & 0x3):
-                self.level.roll()
-
-            self.previewRenderer.level = self.level
+                self.transformLevel("roll")
 
     @alertException
     def flip(self, amount=1):
         if self.canRotateLevel:
             for i in range(amount & 0x1):
-                self.level.flipVertical()
-
-            self.previewRenderer.level = self.level
+                self.transformLevel("flipVertical")
 
     @alertException
     def mirror(self):
         if self.canRotateLevel:
             yaw = int(self.editor.mainViewport.yaw) % 360
             if (yaw >= 45 and yaw < 135) or (yaw > 225 and yaw <= 315):
-                self.level.flipEastWest()
+                self.transformLevel("flipEastWest")
             else:
-                self.level.flipNorthSouth()
-
-            self.previewRenderer.level = self.level
+                self.transformLevel("flipNorthSouth")
 
     def option1(self):
         self.copyAir = not self.copyAir
@@ -1100,6 +1221,7 @@ class ConstructionTool(CloneTool):
     def loadLevel(self, level):
         if level:
             self.level = level
+            self.pendingOperations = []
             self.repeatCount = 1
             self.destPoint = None
 
@@ -1125,7 +1247,7 @@ class ConstructionTool(CloneTool):
         return BoundingBox((0, 0, 0), self.selectionSize())
 
     def sourceLevel(self):
-        return self.level
+        return CloneTool.sourceLevel(self)
 
     def mouseDown(self, evt, pos, direction):
         # x,y,z = pos
@@ -2,13 +2,13 @@ import atexit
 import os
 import shutil
 import tempfile
-import albow
 from pymclevel import BoundingBox
 import numpy
 from albow.root import Cancel
 import pymclevel
 from mceutils import showProgress
 from pymclevel.mclevelbase import exhaust
+from undojournal import UndoJournal, ChunkUndoRecord
 
 undo_folder = os.path.join(tempfile.gettempdir(), "mcedit_undo", str(os.getpid()))
 
@@ -20,9 +20,22 @@ def mkundotemp():
 
 atexit.register(shutil.rmtree, undo_folder, True)
 
+_undoJournal = None
+
+def getUndoJournal():
+    global _undoJournal
+    if _undoJournal is None:
+        if not os.path.exists(undo_folder):
+            os.makedirs(undo_folder)
+        _undoJournal = UndoJournal(os.path.join(undo_folder, "undo.journal"))
+        atexit.register(_undoJournal.close)
+
+    return _undoJournal
+
 class Operation(object):
     changedLevel = True
     undoLevel = None
+    redoLevel = None
 
     def __init__(self, editor, level):
         self.editor = editor
@@ -43,29 +56,9 @@ class Operation(object):
 
             return self.extractUndoSchematic(level, box)
 
-        undoLevel = pymclevel.MCInfdevOldLevel(mkundotemp(), create=True)
-        if not chunkCount:
-            try:
-                chunkCount = len(chunks)
-            except TypeError:
-                chunkCount = -1
-
-        def _extractUndo():
-            yield 0, 0, "Recording undo..."
-            for i, (cx, cz) in enumerate(chunks):
-                undoLevel.copyChunkFrom(level, cx, cz)
-                yield i, chunkCount, "Copying chunk %s..." % ((cx, cz),)
-            undoLevel.saveInPlace()
-
-        if chunkCount > 25 or chunkCount < 1:
-            if "Canceled" == showProgress("Recording undo...", _extractUndo(), cancel=True):
-                if albow.ask("Continue with undo disabled?", ["Continue", "Cancel"]) == "Cancel":
-                    raise Cancel
-                else:
-                    return None
-        else:
-            exhaust(_extractUndo())
-
+        # chunks are recorded as the operation loads them, until finishUndo is called
+        undoLevel = ChunkUndoRecord(getUndoJournal(), level, chunks)
+        undoLevel.start()
         return undoLevel
 
     def extractUndoSchematic(self, level, box):
@@ -90,7 +83,11 @@ class Operation(object):
             Default implementation copies all chunks in undoLevel back into level. Non-chunk-based operations
             should override this."""
 
-        if self.undoLevel:
+        if isinstance(self.undoLevel, ChunkUndoRecord):
+            self.redoLevel = self.restoreRecord(self.undoLevel, "Undoing...")
+            self.undoLevel = None
+
+        elif self.undoLevel:
 
             def _undo():
                 yield 0, 0, "Undoing..."
@@ -110,6 +107,60 @@ class Operation(object):
             self.editor.invalidateChunks(self.undoLevel.allChunks)
 
 
+    def redo(self):
+        """ Redo the operation after undo(). If undo() recorded the chunks it put back,
+            the operation's chunks are restored from that record and it isn't performed again. """
+
+        if isinstance(self.redoLevel, ChunkUndoRecord):
+            self.undoLevel = self.restoreRecord(self.redoLevel, "Redoing...")
+            self.redoLevel = None
+        else:
+            try:
+                self.perform()
+            finally:
+                self.finishUndo()
+
+    def restoreRecord(self, record, title):
+        """ Put back the chunks in record and release it. Returns a new record of
+        what those chunks held before. """
+        record.finish()
+        chunks = record.allChunks
+        newRecord = ChunkUndoRecord(record.journal, self.level, chunks)
+        newRecord.start()
+        try:
+            if len(chunks) > 25:
+                showProgress(title, record.restoreIter())
+            else:
+                exhaust(record.restoreIter())
+        finally:
+            newRecord.finish()
+        record.release()
+
+        self.editor.invalidateChunks(chunks)
+        return newRecord
+
+    def finishUndo(self):
+        """ Called when perform() returns. Stops recording chunks into a ChunkUndoRecord. """
+        if isinstance(self.undoLevel, ChunkUndoRecord):
+            self.undoLevel.finish()
+
+    def discardUndo(self):
+        """ Called when the operation leaves the undo or redo stack. """
+        for record in (self.undoLevel, self.redoLevel):
+            if isinstance(record, ChunkUndoRecord):
+                record.release()
+        self.undoLevel = self.redoLevel = None
+
+    def undoSize(self):
+        """ Roughly how many bytes of undo and redo information the operation keeps """
+        size = 0
+        for record in (self.undoLevel, self.redoLevel):
+            if isinstance(record, ChunkUndoRecord):
+                size += record.size
+            elif getattr(record, "bounds", None) is not None:
+                size += record.bounds.volume * 2
+        return size
+
     def dirtyBox(self):
         """ The region modified by the operation.
         Return None to indicate no blocks were changed.
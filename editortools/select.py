@@ -25,6 +25,7 @@ from editortools.editortool import EditorTool
 from editortools.nudgebutton import NudgeButton
 from editortools.tooloptions import ToolOptions
 from glbackground import Panel
+from clipboard import ClipboardView
 from mceutils import ChoiceButton, CheckBoxLabel, IntInputRow, alertException, drawCube, drawFace, drawTerrainCuttingWire, setWindowCaption, showProgress
 import mcplatform
 from operation import Operation
@@ -241,6 +242,12 @@ class NudgeBlocksOperation(Operation):
         super(NudgeBlocksOperation, self).undo()
         self.nudgeSelection.undo()
 
+    def redo(self):
+        performsAgain = self.redoLevel is None
+        super(NudgeBlocksOperation, self).redo()
+        if not performsAgain:
+            self.nudgeSelection.perform()
+
 
 class SelectionTool(EditorTool):
     # selectionColor = (1.0, .9, .9)
@@ -1021,12 +1028,12 @@ class SelectionTool(EditorTool):
                 def perform(self, recordUndo=True):
                     self.undoEntities = level.getEntitiesInBox(box)
                     level.removeEntitiesInBox(box)
-                    editor.renderer.invalidateEntitiesInBox(box)
+                    editor.renderer.updateEntities(removed=self.undoEntities)
 
                 def undo(self):
                     level.removeEntitiesInBox(box)
                     level.addEntities(self.undoEntities)
-                    editor.renderer.invalidateEntitiesInBox(box)
+                    editor.renderer.updateEntities(added=self.undoEntities)
 
             op = DeleteEntitiesOperation(self.editor, self.editor.level)
             if recordUndo:
@@ -1073,6 +1080,10 @@ class SelectionTool(EditorTool):
                         self.selectChunks()
                         box = self.selectionBox()
 
+        if isinstance(self.editor.level, pymclevel.MCInfdevOldLevel):
+            # the blocks are read from the world when they are pasted
+            return ClipboardView(self.editor.level, box, self.maxBlocks)
+
         with setWindowCaption("Copying - "):
             filename = tempfile.mkdtemp(".zip", "mceditcopy")
             os.rmdir(filename)
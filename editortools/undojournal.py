@@ -0,0 +1,334 @@
+"""Copyright (c) 2010-2012 David Rio Vierra
+
+Permission to use, copy, modify, and/or distribute this software for any
+purpose with or without fee is hereby granted, provided that the above
+copyright notice and this permission notice appear in all copies.
+
+THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE."""
+
+"""
+undojournal.py
+
+Undo information for operations on chunked worlds.
+
+Nothing is copied before an operation runs. While its ChunkUndoRecord is
+recording, the first time the operation loads one of the chunks it may change,
+that chunk's arrays and entity lists are compressed and kept. When the
+operation is done, the snapshots of the chunks it really changed are appended
+to the UndoJournal, a file shared by every record, and the record keeps an
+index of where they are. Only the cells that changed are written: for each
+array, a bitmask of the changed cells and their old values. Undoing reads them
+back into the level's chunks.
+"""
+
+import cPickle
+import hashlib
+import logging
+import os
+import weakref
+import zlib
+import numpy
+import pymclevel
+from pymclevel import nbt
+
+log = logging.getLogger(__name__)
+
+chunkArrays = ("Blocks", "Data", "BlockLight", "SkyLight", "HeightMap", "Biomes")
+entityLists = ("Entities", "TileEntities", "TileTicks")
+
+
+def saveEntities(chunk):
+    """ Returns the chunk's entity lists as uncompressed NBT data, or None """
+    root = getattr(chunk, "root_tag", None)
+    if root is None or "Level" not in root:
+        return None
+
+    levelTag = root["Level"]
+    tag = nbt.TAG_Compound()
+    for name in entityLists:
+        if name in levelTag:
+            tag[name] = nbt.TAG_List(list(levelTag[name]), list_type=levelTag[name].list_type)
+    return tag.save(compressed=False)
+
+
+def loadEntities(chunk, data):
+    levelTag = chunk.root_tag["Level"]
+    tag = nbt.load(buf=data)
+    for name in entityLists:
+        if name in tag:
+            levelTag[name] = tag[name]
+        elif name in levelTag:
+            del levelTag[name]
+
+
+def chunkState(chunk):
+    """ Returns the chunk's arrays by name, its entity lists and a digest of both """
+    arrays = {}
+    digest = hashlib.md5()
+    for name in chunkArrays:
+        array = getattr(chunk, name, None)
+        if isinstance(array, numpy.ndarray):
+            arrays[name] = array
+            digest.update(numpy.ascontiguousarray(array))
+
+    entities = saveEntities(chunk)
+    if entities is not None:
+        digest.update(entities)
+
+    return arrays, entities, digest.digest()
+
+
+def diffChunk(oldArrays, oldEntities, newArrays, newEntities):
+    """ Returns what changed between two chunk states, as the old values of the
+    changed cells of each array and the old entity lists if they changed. Each
+    array's changes are a packed bitmask of the changed cells and their old
+    values, or None and the whole old array if the shapes don't match. """
+    changes = {}
+    for name, oldArray in oldArrays.iteritems():
+        newArray = newArrays.get(name)
+        if newArray is None or newArray.shape != oldArray.shape:
+            changes[name] = (None, oldArray)
+            continue
+
+        mask = oldArray != newArray
+        if mask.any():
+            changes[name] = (numpy.packbits(mask.ravel()), oldArray[mask])
+
+    if oldEntities == newEntities:
+        oldEntities = None
+    return changes, oldEntities
+
+
+def applyChanges(chunk, changes, entities):
+    """ Put the old values from diffChunk back into the chunk """
+    for name, (packedMask, values) in changes.iteritems():
+        array = getattr(chunk, name)
+        if packedMask is None:
+            array[:] = values
+        else:
+            mask = numpy.unpackbits(packedMask)[:array.size].reshape(array.shape).view('bool')
+            array[mask] = values
+
+    if entities is not None:
+        loadEntities(chunk, entities)
+
+
+class UndoJournal(object):
+    """ An append-only file of compressed chunk changes. Once most of it
+    belongs to records that were released or forgotten, the live records are
+    copied to a new file. """
+    compactSize = 64 * 1048576
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = None
+        self.end = 0
+        self.records = weakref.WeakSet()
+
+    @property
+    def liveSize(self):
+        return sum(record.journalSize for record in self.records)
+
+    def open(self):
+        if self.file is None:
+            self.file = file(self.filename, "w+b")
+            self.end = 0
+        return self.file
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def append(self, data):
+        """ Returns the offset and length of data in the file """
+        liveSize = self.liveSize
+        if liveSize == 0 and self.end:
+            self.open().truncate(0)
+            self.end = 0
+        elif self.end - liveSize > max(liveSize, self.compactSize):
+            self.compact()
+
+        f = self.open()
+        f.seek(self.end)
+        f.write(data)
+        offset = self.end
+        self.end += len(data)
+        return offset, len(data)
+
+    def read(self, offset, length):
+        f = self.open()
+        f.seek(offset)
+        return f.read(length)
+
+    def compact(self):
+        log.info(u"Compacting undo journal: {0} of {1} bytes in use".format(self.liveSize, self.end))
+        newFilename = self.filename + ".new"
+        newFile = file(newFilename, "w+b")
+        end = 0
+        for record in list(self.records):
+            for c, (offset, length) in sorted(record.index.items(), key=lambda item: item[1]):
+                newFile.write(self.read(offset, length))
+                record.index[c] = (end, length)
+                end += length
+
+        newFile.close()
+        self.close()
+        os.remove(self.filename)
+        os.rename(newFilename, self.filename)
+        self.file = file(self.filename, "r+b")
+        self.end = end
+
+
+class ChunkUndoRecord(object):
+    """ The chunks an operation changed, as they were before it ran. Used as an
+    Operation's undoLevel. If chunks is None, any chunk the operation loads may
+    be recorded. """
+    spillSize = 64 * 1048576
+
+    recording = None  # the record whose level.getChunk is hooked
+
+    def __init__(self, journal, level, chunks=None):
+        self.journal = journal
+        self.level = level
+        self.chunks = None if chunks is None else set(chunks)
+        self.index = {}  # (cx, cz) -> (offset, length) in the journal
+        self.snapshots = {}  # (cx, cz) -> (digest, compressed data or None if in the journal)
+        self.pendingSize = 0
+        self.journalSize = 0
+        self.previousGetChunk = None
+        journal.records.add(self)
+
+    @property
+    def isRecording(self):
+        return ChunkUndoRecord.recording is self
+
+    @property
+    def allChunks(self):
+        return list(set(self.index) | set(self.snapshots))
+
+    @property
+    def chunkCount(self):
+        return len(self.allChunks)
+
+    @property
+    def size(self):
+        return self.journalSize + self.pendingSize
+
+    def start(self):
+        """ Hook the level's getChunk to snapshot chunks as the operation loads them """
+        if ChunkUndoRecord.recording is not None:
+            ChunkUndoRecord.recording.finish()
+
+        level = self.level
+        getChunk = level.getChunk
+        self.previousGetChunk = level.__dict__.get("getChunk")
+
+        def _getChunk(cx, cz):
+            chunk = getChunk(cx, cz)
+            c = (cx, cz)
+            if c not in self.snapshots and (self.chunks is None or c in self.chunks):
+                self.snapshot(c, chunk)
+            return chunk
+
+        level.getChunk = _getChunk
+        ChunkUndoRecord.recording = self
+
+    def stop(self):
+        if not self.isRecording:
+            return
+        ChunkUndoRecord.recording = None
+        if self.previousGetChunk is None:
+            self.level.__dict__.pop("getChunk", None)
+        else:
+            self.level.getChunk = self.previousGetChunk
+
+    def include(self, cx, cz):
+        """ Record a chunk that wasn't in the chunks given at the start. Call this
+        before changing the chunk. """
+        if self.chunks is not None:
+            self.chunks.add((cx, cz))
+        if self.isRecording:
+            self.level.getChunk(cx, cz)
+
+    def snapshot(self, c, chunk):
+        arrays, entities, digest = chunkState(chunk)
+        data = zlib.compress(cPickle.dumps((arrays, entities), cPickle.HIGHEST_PROTOCOL), 1)
+        self.snapshots[c] = (digest, data)
+        self.pendingSize += len(data)
+
+        if self.pendingSize > self.spillSize:
+            # too much to keep in memory until the operation is done
+            for c, (digest, data) in self.snapshots.items():
+                if data is not None:
+                    self.write(c, data)
+                    self.snapshots[c] = (digest, None)
+            self.pendingSize = 0
+
+    def write(self, c, data):
+        self.index[c] = self.journal.append(data)
+        self.journalSize += len(data)
+
+    def forget(self, c):
+        offset, length = self.index.pop(c)
+        self.journalSize -= length
+
+    def finish(self):
+        """ Stop recording and keep only the chunks that were changed """
+        if not self.isRecording:
+            return
+        self.stop()
+
+        for c, (digest, data) in self.snapshots.iteritems():
+            try:
+                newArrays, newEntities, newDigest = chunkState(self.level.getChunk(*c))
+            except (EnvironmentError, pymclevel.ChunkNotPresent):
+                newArrays, newEntities, newDigest = {}, None, None
+
+            if data is None:
+                if newDigest == digest:
+                    self.forget(c)
+                    continue
+                data = self.journal.read(*self.index[c])
+                self.forget(c)
+            elif newDigest == digest:
+                continue
+
+            oldArrays, oldEntities = cPickle.loads(zlib.decompress(data))
+            changes = diffChunk(oldArrays, oldEntities, newArrays, newEntities)
+            self.write(c, zlib.compress(cPickle.dumps(changes, cPickle.HIGHEST_PROTOCOL)))
+
+        self.snapshots = {}
+        self.pendingSize = 0
+
+    def release(self):
+        """ Forget everything recorded. The journal reuses the space later. """
+        self.stop()
+        self.snapshots = {}
+        self.pendingSize = 0
+        self.index = {}
+        self.journalSize = 0
+        self.journal.records.discard(self)
+
+    def restoreIter(self):
+        """ Put the recorded chunks back into the level. Yields progress. """
+        self.finish()
+        chunks = sorted(self.index.items(), key=lambda item: item[1])
+        for i, (c, (offset, length)) in enumerate(chunks):
+            changes, entities = cPickle.loads(zlib.decompress(self.journal.read(offset, length)))
+            try:
+                chunk = self.level.getChunk(*c)
+            except (EnvironmentError, pymclevel.ChunkNotPresent), e:
+                log.warn(u"Unable to undo changes to chunk {0}: {1!r}".format(c, e))
+                continue
+
+            applyChanges(chunk, changes, entities)
+            chunk.chunkChanged(False)
+
+            yield i, len(chunks), "Restoring chunk {0}...".format(c)
@@ -1,7 +1,6 @@
 from numpy import *
 from pymclevel import alphaMaterials, faceDirections, FaceYIncreasing
-from collections import deque
-import datetime
+from floodfill import floodFill
 
 displayName = "Classic Water Flood"
 inputs = (
@@ -12,6 +11,7 @@ inputs = (
 
 
 def perform(level, box, options):
+    directions = [offsets for _dir, offsets in faceDirections if _dir != FaceYIncreasing]
 
     def floodFluid(waterIDs, waterID):
         waterTable = zeros(256, dtype='bool')
@@ -28,41 +28,17 @@ def perform(level, box, options):
             y = y + (point[1] + box.miny)
             coords.append(transpose((x, y, z)))
 
-        print "Stacking coords..."
+        if not coords:
+            return
         coords = vstack(tuple(coords))
 
-        def processCoords(coords):
-            newcoords = deque()
+        def fillable(chunk):
+            return chunk.Blocks == 0
 
-            for (x, y, z) in coords:
-                for _dir, offsets in faceDirections:
-                    if _dir == FaceYIncreasing:
-                        continue
+        def fill(chunk, mask):
+            chunk.Blocks[mask] = waterID
 
-                    dx, dy, dz = offsets
-                    p = (x + dx, y + dy, z + dz)
-                    if p not in box:
-                        continue
-
-                    nx, ny, nz = p
-                    if level.blockAt(nx, ny, nz) == 0:
-                        level.setBlockAt(nx, ny, nz, waterID)
-                        newcoords.append(p)
-
-            return newcoords
-
-        def spread(coords):
-            while len(coords):
-                start = datetime.datetime.now()
-
-                num = len(coords)
-                print "Did {0} coords in ".format(num),
-                coords = processCoords(coords)
-                d = datetime.datetime.now() - start
-                print d
-                yield "Did {0} coords in {1}".format(num, d)
-
-        level.showProgress("Spreading water...", spread(coords), cancel=True)
+        level.showProgress("Spreading water...", floodFill(level, coords, fillable, fill, directions, box), cancel=True)
 
     if options["Flood Water"]:
         waterIDs = [alphaMaterials.WaterActive.ID, alphaMaterials.Water.ID]
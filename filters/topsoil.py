@@ -1,6 +1,5 @@
 
-from numpy import zeros
-import itertools
+from numpy import arange, newaxis, zeros
 from pymclevel import alphaMaterials
 from pymclevel.level import extractHeights
 
@@ -63,17 +62,19 @@ def perform(level, box, options):
         # naturally-occuring. these blocks will "count" for column height.
         maskedBlocks = blockmask[blocks]
 
-        heightmap = extractHeights(maskedBlocks)
-
-        for x, z in itertools.product(*map(xrange, heightmap.shape)):
-            h = heightmap[x, z]
-            if depth > 0:
-                blocks[x, z, max(0, h - depth):h] = blocktype.ID
-                data[x, z, max(0, h - depth):h] = blocktype.blockData
-            else:
-                #negative depth values mean to put a layer above the surface
-                blocks[x, z, h:min(blocks.shape[2], h - depth)] = blocktype.ID
-                data[x, z, h:min(blocks.shape[2], h - depth)] = blocktype.blockData
+        heightmap = extractHeights(maskedBlocks).astype(int)[:, :, newaxis]
+
+        # compare each block's height with its column's surface to find the
+        # layer to cover, for the whole slice at once
+        y = arange(blocks.shape[2])
+        if depth > 0:
+            band = (y >= heightmap - depth) & (y < heightmap)
+        else:
+            #negative depth values mean to put a layer above the surface
+            band = (y >= heightmap) & (y < heightmap - depth)
+
+        blocks[band] = blocktype.ID
+        data[band] = blocktype.blockData
 
         #remember to do this to make sure the chunk is saved
         chunk.chunkChanged()
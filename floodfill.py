@@ -0,0 +1,173 @@
+"""Copyright (c) 2010-2012 David Rio Vierra
+
+Permission to use, copy, modify, and/or distribute this software for any
+purpose with or without fee is hereby granted, provided that the above
+copyright notice and this permission notice appear in all copies.
+
+THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE."""
+
+"""
+floodfill.py
+
+Flood fill through a level one chunk at a time.
+
+Inside a chunk, the filled region grows by sweeping along each allowed
+direction over the whole block array at once: a block is reached if there is a
+filled block before it on the same line with nothing unfillable in between.
+The sweeps repeat until the region stops growing. The region's blocks on the
+chunk's sides are then handed to the neighboring chunks, which are filled the
+same way when their turn comes.
+"""
+
+from collections import deque
+import numpy
+import pymclevel
+
+# (dx, dy, dz) of the six faces of a block
+allDirections = ((1, 0, 0), (-1, 0, 0), (0, 1, 0), (0, -1, 0), (0, 0, 1), (0, 0, -1))
+
+
+def sweep(region, passable, axis, step):
+    """ Extend region along one axis of the arrays, in the direction of step, through passable blocks """
+    if step < 0:
+        region = numpy.flip(region, axis)
+        passable = numpy.flip(passable, axis)
+
+    shape = [1, 1, 1]
+    shape[axis] = region.shape[axis]
+    index = numpy.arange(region.shape[axis], dtype='int16').reshape(shape)
+
+    lastFilled = numpy.maximum.accumulate(numpy.where(region, index, -1), axis=axis)
+    lastBlocked = numpy.maximum.accumulate(numpy.where(passable, -1, index), axis=axis)
+    region |= passable & (lastFilled > lastBlocked)
+
+
+def spread(region, fillable, directions=allDirections):
+    """ Grow region, a boolean array indexed [x, z, y] like chunk.Blocks, through
+    the fillable blocks in the given directions, in place. """
+    passable = region | fillable
+    count = numpy.count_nonzero(region)
+    while True:
+        for dx, dy, dz in directions:
+            if dx:
+                sweep(region, passable, 0, dx)
+            elif dz:
+                sweep(region, passable, 1, dz)
+            else:
+                sweep(region, passable, 2, dy)
+
+        newCount = numpy.count_nonzero(region)
+        if newCount == count:
+            return
+        count = newCount
+
+
+def boxMask(chunk, box):
+    """ The blocks of the chunk inside box """
+    cx, cz = chunk.chunkPosition
+    w, l, h = chunk.Blocks.shape
+    mask = numpy.zeros((w, l, h), dtype='bool')
+    x0, z0 = cx << 4, cz << 4
+    mask[max(0, box.minx - x0):max(0, box.maxx - x0),
+         max(0, box.minz - z0):max(0, box.maxz - z0),
+         max(0, box.miny):max(0, box.maxy)] = True
+    return mask
+
+
+def floodFill(level, seeds, fillable, fill, directions=allDirections, box=None, chunkEntered=None):
+    """ Fill outward from each of the (x, y, z) points in seeds. The seeds spread
+    into neighboring blocks whether or not they can be filled themselves.
+
+    fillable(chunk) returns a boolean array of the chunk's blocks that may be
+    filled. fill(chunk, mask) changes the blocks in mask. Blocks are only reached
+    through their faces in directions, and only inside box if it is given.
+    chunkEntered(cx, cz) is called before a chunk is changed for the first time.
+
+    Yields a progress string after each chunk. """
+
+    sources = {}  # (cx, cz) -> [(x, z, y), ...] of seeds in the chunk
+    for x, y, z in numpy.asarray(seeds, dtype='int64').reshape(-1, 3).tolist():
+        sources.setdefault((x >> 4, z >> 4), []).append((x & 0xf, z & 0xf, y))
+
+    entries = {}  # (cx, cz) -> boolean array of blocks reached from a neighbor
+    done = {}  # (cx, cz) -> boolean array of blocks already reached
+    entered = set()
+
+    # neighbor offset, slice of this chunk's edge, slice of the neighbor's edge
+    sides = []
+    for dx, dy, dz in directions:
+        if dx:
+            sides.append(((dx, 0), numpy.s_[-1:] if dx > 0 else numpy.s_[:1], numpy.s_[:1] if dx > 0 else numpy.s_[-1:]))
+        elif dz:
+            sides.append(((0, dz), numpy.s_[:, -1:] if dz > 0 else numpy.s_[:, :1], numpy.s_[:, :1] if dz > 0 else numpy.s_[:, -1:]))
+
+    queue = deque(sources)
+    blockCount = chunkCount = 0
+    while len(queue):
+        cx, cz = queue.popleft()
+        chunkSources = sources.pop((cx, cz), None)
+        chunkEntries = entries.pop((cx, cz), None)
+        if chunkSources is None and chunkEntries is None:
+            continue
+
+        try:
+            chunk = level.getChunk(cx, cz)
+        except (EnvironmentError, pymclevel.ChunkNotPresent, pymclevel.mclevelbase.ChunkMalformed):
+            continue
+
+        reached = done.get((cx, cz))
+        if reached is None:
+            reached = done[cx, cz] = numpy.zeros(chunk.Blocks.shape, dtype='bool')
+
+        canFill = fillable(chunk) & ~reached
+        if box is not None:
+            canFill &= boxMask(chunk, box)
+
+        region = numpy.zeros(chunk.Blocks.shape, dtype='bool')
+        if chunkEntries is not None:
+            region |= chunkEntries & canFill
+        if chunkSources is not None:
+            x, z, y = numpy.array(chunkSources).T
+            inChunk = (y >= 0) & (y < region.shape[2])
+            region[x[inChunk], z[inChunk], y[inChunk]] = True
+
+        if not region.any():
+            continue
+
+        spread(region, canFill, directions)
+        reached |= region
+
+        filled = region & canFill
+        count = numpy.count_nonzero(filled)
+        if count:
+            if chunkEntered and (cx, cz) not in entered:
+                chunkEntered(cx, cz)
+            entered.add((cx, cz))
+            fill(chunk, filled)
+            chunk.chunkChanged()
+            blockCount += count
+
+        for (dx, dz), edge, neighborEdge in sides:
+            face = region[edge]
+            if not face.any():
+                continue
+            neighbor = (cx + dx, cz + dz)
+            if neighbor not in entries:
+                if not level.containsChunk(*neighbor):
+                    continue
+                w, l, h = level.getChunk(*neighbor).Blocks.shape
+                entries[neighbor] = numpy.zeros((w, l, h), dtype='bool')
+                queue.append(neighbor)
+
+            neighborEntries = entries[neighbor][neighborEdge]
+            h = min(face.shape[2], neighborEntries.shape[2])
+            neighborEntries[..., :h] |= face[..., :h]
+
+        chunkCount += 1
+        yield "Filled {0} blocks in {1} chunks".format(blockCount, chunkCount)
@@ -0,0 +1,207 @@
+"""Copyright (c) 2010-2012 David Rio Vierra
+
+Permission to use, copy, modify, and/or distribute this software for any
+purpose with or without fee is hereby granted, provided that the above
+copyright notice and this permission notice appear in all copies.
+
+THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE."""
+
+"""
+gltext.py
+
+Text drawn from a glyph atlas, for overlays that change every frame.
+
+Each font gets a GlyphAtlas: one texture holding every character drawn with it
+so far, rendered in white so glColor sets the text color. A string is turned
+into vertex and texture coordinate arrays once and kept in a least recently
+used cache, so drawing it again is one glDrawArrays call.
+"""
+
+from collections import OrderedDict
+from albow.controls import Control
+from albow.openglwidgets import GLPixelOrtho
+from OpenGL import GL
+import numpy
+from pygame import image
+
+
+class GlyphAtlas(object):
+    size = 512
+    padding = 1
+
+    def __init__(self, font):
+        self.font = font
+        self.height = font.get_height()
+        self.lineSize = font.get_linesize()
+        self.texture = None
+        self.clear()
+
+    def clear(self):
+        """ Forget every glyph. Meshes made before this are no longer valid, so
+        generation is increased. """
+        self.glyphs = {}  # char -> (advance, s0, t0, s1, t1)
+        self.x = self.y = 0
+        self.generation = getattr(self, "generation", 0) + 1
+        if self.texture is not None:
+            GL.glBindTexture(GL.GL_TEXTURE_2D, self.texture)
+            self.allocate()
+
+    def allocate(self):
+        size = self.size
+        GL.glTexParameter(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, GL.GL_NEAREST)
+        GL.glTexParameter(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, GL.GL_NEAREST)
+        GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, GL.GL_RGBA, size, size, 0, GL.GL_RGBA, GL.GL_UNSIGNED_BYTE,
+                        numpy.zeros((size, size, 4), dtype='uint8'))
+
+    def bind(self):
+        if self.texture is None:
+            self.texture = GL.glGenTextures(1)
+            GL.glBindTexture(GL.GL_TEXTURE_2D, self.texture)
+            self.allocate()
+        else:
+            GL.glBindTexture(GL.GL_TEXTURE_2D, self.texture)
+
+    def addGlyphs(self, text):
+        """ Render the characters of text that aren't in the atlas yet. The texture must be bound. """
+        missing = set(text) - set(self.glyphs)
+        missing.discard("\n")
+        if not missing:
+            return
+
+        size = self.size
+        for char in sorted(missing):
+            surface = self.font.render(char, True, (255, 255, 255))
+            w, h = surface.get_size()
+            if self.x + w > size:
+                self.x = 0
+                self.y += self.height + self.padding
+            if self.y + h > size:
+                if self.glyphs:
+                    # full. start again with only the glyphs of this string
+                    self.clear()
+                    self.addGlyphs(text)
+                    return
+                w = 0  # this string alone doesn't fit, leave out the rest of it
+
+            if w:
+                data = numpy.fromstring(image.tostring(surface, 'RGBA'), dtype='uint8')
+                GL.glTexSubImage2D(GL.GL_TEXTURE_2D, 0, self.x, self.y, w, h, GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, data)
+
+            self.glyphs[char] = (w, float(self.x) / size, float(self.y) / size,
+                                 float(self.x + w) / size, float(self.y + h) / size)
+            self.x += w + self.padding
+
+    def makeMesh(self, text):
+        """ Returns vertex and texture coordinate arrays for text, with its top left
+        corner at the origin and y increasing upward, as everywhere in GL """
+        glyphs = self.glyphs
+        vertices = []
+        texCoords = []
+        x = y = 0
+        for char in text:
+            if char == "\n":
+                x = 0
+                y -= self.lineSize
+                continue
+
+            w, s0, t0, s1, t1 = glyphs[char]
+            if w:
+                bottom = y - self.height
+                vertices.extend(((x, y), (x, bottom), (x + w, bottom), (x + w, y)))
+                texCoords.extend(((s0, t0), (s0, t1), (s1, t1), (s1, t0)))
+            x += w
+
+        return (numpy.array(vertices, dtype='float32').reshape(-1, 2),
+                numpy.array(texCoords, dtype='float32').reshape(-1, 2))
+
+
+_atlases = {}
+
+# (font, text) -> (atlas generation, vertices, texCoords), least recently used first
+meshCache = OrderedDict()
+maxCachedMeshes = 512
+
+
+def getGlyphAtlas(font):
+    atlas = _atlases.get(font)
+    if atlas is None:
+        atlas = _atlases[font] = GlyphAtlas(font)
+    return atlas
+
+
+def drawText(font, text, x, y, color=(1.0, 1.0, 1.0, 1.0)):
+    """ Draw text with its top left corner at x, y in the current coordinates,
+    where one unit should be one pixel and y increases upward. """
+    if not text:
+        return
+
+    atlas = getGlyphAtlas(font)
+    key = (font, text)
+
+    GL.glPushAttrib(GL.GL_ENABLE_BIT | GL.GL_TEXTURE_BIT | GL.GL_CURRENT_BIT | GL.GL_COLOR_BUFFER_BIT)
+    GL.glPushClientAttrib(GL.GL_CLIENT_VERTEX_ARRAY_BIT)
+    GL.glEnable(GL.GL_TEXTURE_2D)
+    GL.glEnable(GL.GL_BLEND)
+    GL.glBlendFunc(GL.GL_SRC_ALPHA, GL.GL_ONE_MINUS_SRC_ALPHA)
+    GL.glDisable(GL.GL_CULL_FACE)
+    GL.glDisable(GL.GL_DEPTH_TEST)
+    atlas.bind()
+
+    entry = meshCache.pop(key, None)
+    if entry is None or entry[0] != atlas.generation:
+        atlas.addGlyphs(text)
+        entry = (atlas.generation,) + atlas.makeMesh(text)
+        while len(meshCache) >= maxCachedMeshes:
+            meshCache.popitem(last=False)
+    meshCache[key] = entry
+    generation, vertices, texCoords = entry
+
+    GL.glMatrixMode(GL.GL_TEXTURE)
+    GL.glPushMatrix()
+    GL.glLoadIdentity()
+    GL.glMatrixMode(GL.GL_MODELVIEW)
+    GL.glPushMatrix()
+    GL.glTranslatef(x, y, 0)
+
+    GL.glColor(*color)
+    GL.glEnableClientState(GL.GL_VERTEX_ARRAY)
+    GL.glEnableClientState(GL.GL_TEXTURE_COORD_ARRAY)
+    GL.glDisableClientState(GL.GL_COLOR_ARRAY)
+    GL.glVertexPointer(2, GL.GL_FLOAT, 0, vertices)
+    GL.glTexCoordPointer(2, GL.GL_FLOAT, 0, texCoords)
+    GL.glDrawArrays(GL.GL_QUADS, 0, len(vertices))
+
+    GL.glPopMatrix()
+    GL.glMatrixMode(GL.GL_TEXTURE)
+    GL.glPopMatrix()
+    GL.glMatrixMode(GL.GL_MODELVIEW)
+    GL.glPopClientAttrib()
+    GL.glPopAttrib()
+
+
+class GLValueDisplay(Control, GLPixelOrtho):
+    """ A ValueDisplay for values that change every frame, drawn with drawText
+    instead of being rendered into a new surface. """
+    format = "%s"
+
+    def __init__(self, width=100, lines=1, **kwds):
+        GLPixelOrtho.__init__(self, **kwds)
+        self.size = (width, self.font.get_linesize() * lines + 2 * self.margin)
+        self.xmax, self.ymax = self.size
+
+    def format_value(self, value):
+        if value is not None:
+            return self.format % value
+        else:
+            return ""
+
+    def gl_draw(self):
+        r, g, b = self.fg_color[:3]
+        drawText(self.font, self.format_value(self.value), self.margin, self.height - self.margin,
+                 (r / 255., g / 255., b / 255., 1.0))
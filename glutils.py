@@ -28,10 +28,14 @@ from albow import Label
 from albow.openglwidgets import GLOrtho
 import config
 
+import ctypes
+import logging
 import weakref
 from OpenGL.GL import framebufferobjects as FBO
 import sys
 
+log = logging.getLogger(__name__)
+
 
 class gl(object):
     @classmethod
@@ -169,6 +173,251 @@ class DisplayList(object):
             GL.glCallLists(self._list)
 
 
+class VertexArena(object):
+    """ A single vertex buffer holding the vertex arrays of many objects that share a
+    vertex format. Each array gets a range of vertices from a free list. Holes left
+    by freed arrays are reclaimed by compacting the buffer, which happens when an
+    array doesn't fit anywhere, before the buffer is grown.
+
+    Draws the allocated ranges with glMultiDrawArrays after setting the attribute
+    pointers with pointer(offset). Without vertex buffer objects, the vertices are
+    kept in client memory and drawn from there instead.
+    """
+
+    allArenas = []
+    minimumVertices = 65536
+
+    class Allocation(object):
+        def __init__(self, arena, first, count):
+            self.arena = arena
+            self.first = first
+            self.count = count
+
+        def free(self):
+            if self.arena:
+                self.arena.free(self)
+                self.arena = None
+
+    def __init__(self, stride):
+        self.stride = stride
+        self.capacity = 0
+        self.buffer = None
+        self.clientData = None
+        self.freeRanges = []  # sorted list of [first, count]
+        self.allocations = set()
+        self.verticesUsed = 0
+        self.compactions = 0
+
+        def _delete(r):
+            VertexArena.allArenas.remove(r)
+        self.allArenas.append(weakref.ref(self, _delete))
+
+    def __del__(self):
+        self.delete()
+
+    _useBuffers = None
+
+    @classmethod
+    def useBuffers(cls):
+        if cls._useBuffers is None:
+            cls._useBuffers = bool(GL.glGenBuffers) and "-nobuffers" not in sys.argv
+        return cls._useBuffers
+
+    @property
+    def bytesUsed(self):
+        return self.verticesUsed * self.stride
+
+    @property
+    def bytesAllocated(self):
+        return self.capacity * self.stride
+
+    def delete(self):
+        if self.buffer is not None:
+            GL.glDeleteBuffers(1, [self.buffer])
+            self.buffer = None
+        self.clientData = None
+
+    def allocate(self, array):
+        """ Copy the vertices in array into the arena. Returns an Allocation. """
+        count = array.nbytes // self.stride
+        first = self._findRange(count)
+        if first is None:
+            self._rebuild(count)
+            first = self._findRange(count)
+
+        allocation = self.Allocation(self, first, count)
+        self.allocations.add(allocation)
+        self.verticesUsed += count
+        self._upload(first, array)
+        return allocation
+
+    def free(self, allocation):
+        if allocation not in self.allocations:
+            return
+
+        self.allocations.remove(allocation)
+        self.verticesUsed -= allocation.count
+        self._addFreeRange(allocation.first, allocation.count)
+
+    def reallocate(self, allocation, array):
+        """ Replace the vertices of an allocation with those in array. If they fit, they
+        are copied in place and the rest of the allocation is freed. Returns the
+        allocation, or a new one if they didn't fit. """
+        count = array.nbytes // self.stride
+        if allocation not in self.allocations or count > allocation.count:
+            allocation.free()
+            return self.allocate(array)
+
+        self._upload(allocation.first, array)
+        if count < allocation.count:
+            self.verticesUsed -= allocation.count - count
+            self._addFreeRange(allocation.first + count, allocation.count - count)
+            allocation.count = count
+        return allocation
+
+    def _addFreeRange(self, first, count):
+        self.freeRanges.append([first, count])
+        self.freeRanges.sort()
+
+        # merge with neighboring free ranges
+        merged = []
+        for r in self.freeRanges:
+            if merged and merged[-1][0] + merged[-1][1] == r[0]:
+                merged[-1][1] += r[1]
+            else:
+                merged.append(r)
+        self.freeRanges = merged
+
+    def freeAll(self):
+        for allocation in list(self.allocations):
+            allocation.arena = None
+        self.allocations = set()
+        self.verticesUsed = 0
+        self.freeRanges = [[0, self.capacity]] if self.capacity else []
+
+    def _findRange(self, count):
+        for r in self.freeRanges:
+            if r[1] >= count:
+                first = r[0]
+                r[0] += count
+                r[1] -= count
+                if r[1] == 0:
+                    self.freeRanges.remove(r)
+                return first
+
+    def _rebuild(self, extraVertices):
+        """ Move all allocations to the start of the buffer, growing it if the free space
+        would still be too small for extraVertices more. """
+        needed = self.verticesUsed + extraVertices
+        capacity = max(self.capacity, self.minimumVertices)
+        while capacity < needed:
+            capacity *= 2
+
+        if self.buffer is not None:
+            oldData = numpy.empty((self.capacity * self.stride,), dtype='uint8')
+            GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.buffer)
+            GL.glGetBufferSubData(GL.GL_ARRAY_BUFFER, 0, oldData.nbytes, oldData)
+        else:
+            oldData = self.clientData
+
+        stride = self.stride
+        data = numpy.zeros((capacity * stride,), dtype='uint8')
+        first = 0
+        for a in sorted(self.allocations, key=lambda a: a.first):
+            data[first * stride:(first + a.count) * stride] = oldData[a.first * stride:(a.first + a.count) * stride]
+            a.first = first
+            first += a.count
+
+        if self.useBuffers():
+            if self.buffer is None:
+                self.buffer = GL.glGenBuffers(1)
+            GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.buffer)
+            GL.glBufferData(GL.GL_ARRAY_BUFFER, data.nbytes, data, GL.GL_STATIC_DRAW)
+            GL.glBindBuffer(GL.GL_ARRAY_BUFFER, 0)
+        else:
+            self.clientData = data
+
+        self.capacity = capacity
+        self.freeRanges = [[first, capacity - first]] if capacity > first else []
+        self.compactions += 1
+
+    def _upload(self, first, array):
+        data = array.view('uint8').ravel()
+        offset = first * self.stride
+        if self.useBuffers():
+            GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.buffer)
+            GL.glBufferSubData(GL.GL_ARRAY_BUFFER, offset, data.nbytes, data)
+            GL.glBindBuffer(GL.GL_ARRAY_BUFFER, 0)
+        else:
+            self.clientData[offset:offset + data.nbytes] = data
+
+    def bind(self):
+        if self.buffer is not None:
+            GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.buffer)
+
+    def release(self):
+        if self.buffer is not None:
+            GL.glBindBuffer(GL.GL_ARRAY_BUFFER, 0)
+
+    def pointer(self, offset, dtype):
+        """ The pointer argument for gl*Pointer calls, for the attribute of type dtype at
+        offset bytes into each vertex. Call between bind() and release(). """
+        if self.buffer is not None:
+            return ctypes.c_void_p(offset)
+        return self.clientData[offset:].view(dtype)
+
+    def multiDraw(self, mode, firsts, counts):
+        GL.glMultiDrawArrays(mode, firsts, counts, len(firsts))
+
+
+class ShaderProgram(object):
+    """ A GLSL program, compiled the first time it is needed. Check available before
+    drawing anything that depends on it. It is False if the driver has no shaders,
+    if the program doesn't compile, or with -noshaders. """
+
+    def __init__(self, vertexSource, fragmentSource):
+        self.vertexSource = vertexSource
+        self.fragmentSource = fragmentSource
+        self._program = None
+        self._failed = False
+
+    @property
+    def available(self):
+        if self._program is None and not self._failed:
+            self._compile()
+        return self._program is not None
+
+    def _compile(self):
+        if "-noshaders" in sys.argv or not bool(GL.glCreateShader):
+            self._failed = True
+            return
+
+        from OpenGL.GL import shaders
+        try:
+            self._program = shaders.compileProgram(
+                shaders.compileShader(self.vertexSource, GL.GL_VERTEX_SHADER),
+                shaders.compileShader(self.fragmentSource, GL.GL_FRAGMENT_SHADER))
+        except Exception, e:
+            # PyOpenGL puts the driver's info log first, followed by the source
+            infoLog = e.args[0] if e.args else e
+            log.warn(u"Shader program failed to compile, disabling it: {0!r}".format(infoLog))
+            self._failed = True
+
+    def uniform(self, name):
+        return GL.glGetUniformLocation(self._program, name)
+
+    def attribute(self, name):
+        return GL.glGetAttribLocation(self._program, name)
+
+    def bind(self):
+        if self.available:
+            GL.glUseProgram(self._program)
+
+    def release(self):
+        if self._program is not None:
+            GL.glUseProgram(0)
+
+
 class Texture(object):
     allTextures = []
     defaultFilter = GL.GL_NEAREST
@@ -63,9 +63,11 @@ from albow.openglwidgets import GLOrtho, GLViewport
 from pygame import display, event, key, KMOD_ALT, KMOD_CTRL, KMOD_LALT, KMOD_META, KMOD_RALT, KMOD_SHIFT, mouse, MOUSEMOTION
 
 from depths import DepthOffset
+from editortools.clipboard import ClipboardView, captureChunks, copyOnWrite
 from editortools.operation import Operation
 from editortools.chunk import GeneratorPanel
 from glbackground import GLBackground, Panel
+from gltext import GLValueDisplay
 from glutils import gl, Texture
 from mcplatform import askSaveFile
 from pymclevel.minecraft_server import alphanum_key #?????
@@ -99,6 +101,7 @@ Settings.setWindowPlacement = Settings("SetWindowPlacement", True)
 Settings.showHiddenOres = Settings("show hidden ores", False)
 Settings.fastLeaves = Settings("fast leaves", True)
 Settings.roughGraphics = Settings("rough graphics", False)
+Settings.greedyMeshing = Settings("greedy meshing", False)
 Settings.showChunkRedraw = Settings("show chunk redraw", True)
 Settings.drawSky = Settings("draw sky", True)
 Settings.drawFog = Settings("draw fog", True)
@@ -110,12 +113,15 @@ Settings.drawTileEntities = Settings("draw tile entities", True)
 Settings.drawTileTicks = Settings("draw tile ticks", False)
 Settings.drawUnpopulatedChunks = Settings("draw unpopulated chunks", True)
 Settings.vertexBufferLimit = Settings("vertex buffer limit", 384)
+Settings.mesherProcesses = Settings("mesher processes", -1)
+Settings.meshCacheSize = Settings("mesh cache size", 512)
+Settings.occlusionCulling = Settings("occlusion culling", True)
 
 Settings.vsync = Settings("vertical sync", 0)
 Settings.visibilityCheck = Settings("visibility check", False)
 Settings.viewMode = Settings("View Mode", "Camera")
 
-Settings.undoLimit = Settings("Undo Limit", 20)
+Settings.undoBufferSize = Settings("Undo Buffer Size", 512)
 
 ControlSettings = config.Settings("Controls")
 ControlSettings.mouseSpeed = ControlSettings("mouse speed", 5.0)
@@ -165,6 +171,7 @@ class ControlPanel(Panel):
                     (cmd + "G", "Goto", editor.showGotoPanel),
                     (cmd + "-I", "World Info", editor.showWorldInfo),
                     (cmd + "-Z", "Undo", editor.undo),
+                    (cmd + "-Y", "Redo", editor.redo),
                     (cmd + "-A", "Select All", editor.selectAll),
                     (cmd + "-D", "Deselect", editor.deselect),
                     (cmd + "-F", AttrRef(editor, 'viewDistanceLabelText'), editor.swapViewDistance),
@@ -728,6 +735,8 @@ class CameraViewport(GLViewport):
 
     @mceutils.alertException
     def editContainer(self, point, containerID):
+        # the dialog changes the tag in place, so copies of the chest keep its contents first
+        captureChunks(self.editor.level, [(point[0] >> 4, point[2] >> 4)])
         tileEntityTag = self.editor.level.tileEntityAt(*point)
         if tileEntityTag is None:
             tileEntityTag = pymclevel.TileEntity.Create(containerID)
@@ -825,51 +834,54 @@ class CameraViewport(GLViewport):
 
             if d.present() == "OK":
                 def deleteItemsIter():
-                    i = 0
-                    if deleteSameDamage.value:
-                        def matches(t):
-                            return t["id"].value == id and t["Damage"].value == Damage
-                    else:
-                        def matches(t):
-                            return t["id"].value == id
-
-                    def matches_itementity(e):
-                        if e["id"].value != "Item":
-                            return False
-                        if "Item" not in e:
-                            return False
-                        t = e["Item"]
-                        return matches(t)
-                    for player in self.editor.level.players:
-                        tag = self.editor.level.getPlayerTag(player)
-                        l = len(tag["Inventory"])
-                        tag["Inventory"].value = [t for t in tag["Inventory"].value if not matches(t)]
-
-                    for chunk in self.editor.level.getChunks():
-                        if id < 256 and deleteBlocksToo.value:
-                            matchingBlocks = chunk.Blocks == id
-                            if deleteSameDamage.value:
-                                matchingBlocks &= chunk.Data == Damage
-                            if any(matchingBlocks):
-                                chunk.Blocks[matchingBlocks] = 0
-                                chunk.Data[matchingBlocks] = 0
-                                chunk.chunkChanged()
-                                self.editor.invalidateChunks([chunk.chunkPosition])
-
-                        for te in chunk.TileEntities:
-                            if "Items" in te:
-                                l = len(te["Items"])
-
-                                te["Items"].value = [t for t in te["Items"].value if not matches(t)]
-                                if l != len(te["Items"]):
-                                    chunk.dirty = True
-                        entities = [e for e in chunk.Entities if matches_itementity(e)]
-                        if len(entities) != len(chunk.Entities):
-                            chunk.Entities.value = entities
-                            chunk.dirty = True
-
-                        yield (i, self.editor.level.chunkCount)
-                        i += 1
+                    with copyOnWrite(self.editor.level):
+                        i = 0
+                        if deleteSameDamage.value:
+                            def matches(t):
+                                return t["id"].value == id and t["Damage"].value == Damage
+                        else:
+                            def matches(t):
+                                return t["id"].value == id
+
+                        def matches_itementity(e):
+                            if e["id"].value != "Item":
+                                return False
+                            if "Item" not in e:
+                                return False
+                            t = e["Item"]
+                            return matches(t)
+                        for player in self.editor.level.players:
+                            tag = self.editor.level.getPlayerTag(player)
+                            l = len(tag["Inventory"])
+                            tag["Inventory"].value = [t for t in tag["Inventory"].value if not matches(t)]
+
+                        for chunk in self.editor.level.getChunks():
+                            if id < 256 and deleteBlocksToo.value:
+                                matchingBlocks = chunk.Blocks == id
+                                if deleteSameDamage.value:
+                                    matchingBlocks &= chunk.Data == Damage
+                                if any(matchingBlocks):
+                                    chunk.Blocks[matchingBlocks] = 0
+                                    chunk.Data[matchingBlocks] = 0
+                                    chunk.chunkChanged()
+                                    self.editor.invalidateChunks([chunk.chunkPosition])
+
+                            for te in chunk.TileEntities:
+                                if "Items" in te:
+                                    l = len(te["Items"])
+
+                                    te["Items"].value = [t for t in te["Items"].value if not matches(t)]
+                                    if l != len(te["Items"]):
+                                        chunk.dirty = True
+                            entities = [e for e in chunk.Entities if not matches_itementity(e)]
+                            if len(entities) != len(chunk.Entities):
+                                removed = [e for e in chunk.Entities if matches_itementity(e)]
+                                chunk.Entities.value = entities
+                                chunk.dirty = True
+                                self.editor.renderer.updateEntities(removed=removed)
+
+                            yield (i, self.editor.level.chunkCount)
+                            i += 1
 
                 progressInfo = "Deleting the item {0} from the entire world ({1} chunks)".format(itemName(chestWidget.id, 0), self.editor.level.chunkCount)
 
@@ -1430,6 +1442,7 @@ class LevelEditor(GLViewport):
 
         self.unsavedEdits = 0
         self.undoStack = []
+        self.redoStack = []
         self.copyStack = []
 
         self.level = None
@@ -1530,7 +1543,7 @@ class LevelEditor(GLViewport):
         self.add(self.viewportContainer)
 
         Settings.viewMode.addObserver(self)
-        Settings.undoLimit.addObserver(self)
+        Settings.undoBufferSize.addObserver(self)
 
         self.reloadToolbar()
 
@@ -1610,6 +1623,16 @@ class LevelEditor(GLViewport):
         self.copyStack = [s for s in self.copyStack if s is not sch]
         self.updateCopyPanel()
 
+    def extractCopiedSchematics(self):
+        """ Copies of the level are read from it until they are used. Extract them
+        before the level is closed, or forget them if that's canceled. """
+        for sch in list(self.copyStack):
+            if isinstance(sch, ClipboardView) and sch.sourceLevel is self.level:
+                try:
+                    sch.extract()
+                except root.Cancel:
+                    self.deleteCopiedSchematic(sch)
+
     def deleteAllCopiedSchematics(self):
         for s in self.copyStack:
             self._deleteSchematic(s)
@@ -1925,6 +1948,7 @@ class LevelEditor(GLViewport):
 
         self.freezeStatus("Loading " + filename)
         if self.level:
+            self.extractCopiedSchematics()
             self.level.close()
 
         try:
@@ -1965,7 +1989,10 @@ class LevelEditor(GLViewport):
 
         self.removeNetherPanel()
 
+        for op in self.undoStack + self.redoStack:
+            op.discardUndo()
         self.undoStack = []
+        self.redoStack = []
         self.loadLevel(level)
         self.recordUndo = True
         self.clearUnsavedEdits()
@@ -2241,8 +2268,8 @@ class LevelEditor(GLViewport):
 
     def showDebugPanel(self):
         dp = GLBackground()
-        debugLabel = ValueDisplay(width=1100, ref=AttrRef(self, "debugString"))
-        inspectLabel = ValueDisplay(width=1100, ref=AttrRef(self, "inspectionString"))
+        debugLabel = GLValueDisplay(width=1100, ref=AttrRef(self, "debugString"))
+        inspectLabel = GLValueDisplay(width=1100, ref=AttrRef(self, "inspectionString"))
         dp.add(Column((debugLabel, inspectLabel)))
         dp.shrink_wrap()
         dp.bg_color = (0, 0, 0, 0.6)
@@ -2515,6 +2542,8 @@ class LevelEditor(GLViewport):
                 self.askLoadWorld()
             if keyname == 'z':
                 self.undo()
+            if keyname == 'y':
+                self.redo()
             if keyname == 's':
                 self.saveFile()
             if keyname == 'n':
@@ -3124,7 +3153,26 @@ class LevelEditor(GLViewport):
         with mceutils.setWindowCaption("UNDOING - "):
             self.freezeStatus("Undoing the previous operation...")
             op = self.undoStack.pop()
-            op.undo()
+            with copyOnWrite(self.level):
+                op.undo()
+            self.redoStack.append(op)
+            changedBox = op.dirtyBox()
+            if changedBox is not None:
+                self.invalidateBox(changedBox)
+            if op.changedLevel:
+                self.addUnsavedEdit()
+
+    @mceutils.alertException
+    def redo(self):
+        if len(self.redoStack) == 0:
+            return
+        with mceutils.setWindowCaption("REDOING - "):
+            self.freezeStatus("Redoing the previous operation...")
+            op = self.redoStack.pop()
+            with copyOnWrite(self.level):
+                op.redo()
+            self.undoStack.append(op)
+            self.trimUndoStack()
             changedBox = op.dirtyBox()
             if changedBox is not None:
                 self.invalidateBox(changedBox)
@@ -3212,6 +3260,9 @@ class LevelEditor(GLViewport):
                     dl=len(glutils.DisplayList.allLists), dlcount=glutils.gl.listCount,
                     t=len(glutils.Texture.allTextures), g=len(gc.garbage))
 
+            root = self.get_root()
+            self.debugString += "UI: {0}/{1}, ".format(root.surface_redraws, root.surface_draws)
+
             if self.renderer:
                 self.renderer.addDebugInfo(self.addDebugString)
 
@@ -3222,7 +3273,7 @@ class LevelEditor(GLViewport):
         for w in sorted(self.workers):
             if isinstance(w, MCRenderer):
                 label = Label("Rendering chunks" + ((datetime.now().second / 3) % 3) * ".")
-                progress = Label("{0} chunks ({1} pending updates)".format(len(w.chunkRenderers), len(w.invalidChunkQueue)))
+                progress = Label("{0} chunks ({1} pending updates)".format(len(w.chunkRenderers), len(w.chunkQueue)))
                 col = Column((label, progress), align="l", width=200)
                 infos.append(col)
             elif isinstance(w, RunningOperation):  # **FIXME** Where is RunningOperation supposed to come from?  -David Sowder 20120311
@@ -3339,9 +3390,6 @@ class LevelEditor(GLViewport):
 
         GL.glDisable(GL.GL_POLYGON_OFFSET_FILL)
 
-    def drawString(self, x, y, color, string):
-        return
-
     def freezeStatus(self, string):
         return
 
@@ -3374,21 +3422,45 @@ class LevelEditor(GLViewport):
         self.currentTool.selectionChanged()
 
     def addOperation(self, op):
+        for undone in self.redoStack:
+            undone.discardUndo()
+        self.redoStack = []
+
         if self.recordUndo:
             self.undoStack.append(op)
-            if len(self.undoStack) > self.undoLimit:
-                self.undoStack.pop(0)
 
         self.performWithRetry(op)
+        if self.recordUndo:
+            self.trimUndoStack()
 
     recordUndo = True
 
     def performWithRetry(self, op):
-        try:
-            op.perform(self.recordUndo)
-        except MemoryError:
-            self.invalidateAllChunks()
-            op.perform(self.recordUndo)
+        with copyOnWrite(self.level):
+            try:
+                try:
+                    op.perform(self.recordUndo)
+                except MemoryError:
+                    op.discardUndo()
+                    self.invalidateAllChunks()
+                    op.perform(self.recordUndo)
+            finally:
+                op.finishUndo()
+
+    def trimUndoStack(self):
+        """ Forget operations until their undo and redo information fits in the
+        undo buffer, starting with the last redo and then the oldest undo. The
+        newest operation that can be undone is always kept. """
+        limit = self.undoBufferSize * 1048576
+        sizes = [op.undoSize() for op in self.undoStack]
+        redoSizes = [op.undoSize() for op in self.redoStack]
+        total = sum(sizes) + sum(redoSizes)
+        while len(self.redoStack) and total > limit:
+            total -= redoSizes.pop(0)
+            self.redoStack.pop(0).discardUndo()
+        while len(self.undoStack) > 1 and total > limit:
+            total -= sizes.pop(0)
+            self.undoStack.pop(0).discardUndo()
 
     def quit(self):
         self.mouseLookOff()
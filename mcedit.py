@@ -76,6 +76,7 @@ from leveleditor import ControlSettings, Settings
 import mceutils
 import mcplatform
 from mcplatform import platform_open
+import multiprocessing
 import numpy
 
 
@@ -398,23 +399,23 @@ class GraphicsPanel(Panel):
         Panel.__init__(self)
 
         self.mcedit = mcedit
-#
-#        def getPacks():
-#            return ["[Default]", "[Current]"] + mcplatform.getTexturePacks()
-#
-#        def packChanged():
-#            self.texturePack = self.texturePackChoice.selectedChoice
-#            packs = getPacks()
-#            if self.texturePack not in packs:
-#                self.texturePack = "[Default]"
-#            self.texturePackChoice.selectedChoice = self.texturePack
-#            self.texturePackChoice.choices = packs
-#
-#        self.texturePackChoice = texturePackChoice = mceutils.ChoiceButton(getPacks(), choose=packChanged)
-#        if self.texturePack in self.texturePackChoice.choices:
-#            self.texturePackChoice.selectedChoice = self.texturePack
-#
-#        texturePackRow = albow.Row((albow.Label("Skin: "), texturePackChoice))
+
+        def getPacks():
+            return ["[Default]", "[Current]"] + mcplatform.getTexturePacks()
+
+        def packChanged():
+            self.texturePack = self.texturePackChoice.selectedChoice
+            packs = getPacks()
+            if self.texturePack not in packs:
+                self.texturePack = "[Default]"
+            self.texturePackChoice.selectedChoice = self.texturePack
+            self.texturePackChoice.choices = packs
+
+        self.texturePackChoice = texturePackChoice = mceutils.ChoiceButton(getPacks(), choose=packChanged)
+        if self.texturePack in self.texturePackChoice.choices:
+            self.texturePackChoice.selectedChoice = self.texturePack
+
+        texturePackRow = albow.Row((albow.Label("Skin: "), texturePackChoice))
 
         fieldOfViewRow = mceutils.FloatInputRow("Field of View: ",
             ref=Settings.fov.propertyRef(), width=100, min=25, max=120)
@@ -425,6 +426,14 @@ class GraphicsPanel(Panel):
         bufferLimitRow = mceutils.IntInputRow("Vertex Buffer Limit (MB): ",
             ref=Settings.vertexBufferLimit.propertyRef(), width=100, min=0)
 
+        mesherProcessesRow = mceutils.IntInputRow("Mesher Processes: ",
+            ref=Settings.mesherProcesses.propertyRef(), width=100, min=-1, max=64,
+            tooltipText="Worker processes that build chunk geometry. -1 uses one per CPU core, minus one. 0 builds it while drawing.")
+
+        meshCacheRow = mceutils.IntInputRow("Mesh Cache (MB): ",
+            ref=Settings.meshCacheSize.propertyRef(), width=100, min=0,
+            tooltipText="Disk space for chunk geometry saved between sessions. 0 disables the cache.")
+
         fastLeavesRow = mceutils.CheckBoxLabel("Fast Leaves",
             ref=Settings.fastLeaves.propertyRef(),
             tooltipText="Leaves are solid, like Minecraft's 'Fast' graphics")
@@ -433,17 +442,29 @@ class GraphicsPanel(Panel):
             ref=Settings.roughGraphics.propertyRef(),
             tooltipText="All blocks are drawn the same way (overrides 'Fast Leaves')")
 
+        greedyMeshingRow = mceutils.CheckBoxLabel("Merge Faces",
+            ref=Settings.greedyMeshing.propertyRef(),
+            tooltipText="Draw flat areas of the same block with fewer, larger faces. Needs shader support.")
+
+        occlusionCullingRow = mceutils.CheckBoxLabel("Occlusion Culling",
+            ref=Settings.occlusionCulling.propertyRef(),
+            tooltipText="Skip drawing parts of chunks that are hidden behind terrain")
+
         enableMouseLagRow = mceutils.CheckBoxLabel("Enable Mouse Lag",
             ref=Settings.enableMouseLag.propertyRef(),
             tooltipText="Enable choppy mouse movement for faster loading.")
 
         settingsColumn = albow.Column((fastLeavesRow,
                                   roughGraphicsRow,
+                                  greedyMeshingRow,
+                                  occlusionCullingRow,
                                   enableMouseLagRow,
-#                                  texturePackRow,
+                                  texturePackRow,
                                   fieldOfViewRow,
                                   targetFPSRow,
                                   bufferLimitRow,
+                                  mesherProcessesRow,
+                                  meshCacheRow,
                                   ), align='r')
 
         settingsColumn = albow.Column((albow.Label("Settings"),
@@ -493,8 +514,9 @@ class OptionsPanel(Dialog):
         mouseSpeedRow = mceutils.FloatInputRow("Mouse Speed: ",
             ref=ControlSettings.mouseSpeed.propertyRef(), width=100, min=0.1, max=20.0)
 
-        undoLimitRow = mceutils.IntInputRow("Undo Limit: ",
-            ref=Settings.undoLimit.propertyRef(), width=100, min=0)
+        undoBufferRow = mceutils.IntInputRow("Undo Buffer (MB):",
+            ref=Settings.undoBufferSize.propertyRef(), width=100, min=0,
+            tooltipText="Amount of disk space used to keep undo information. The oldest undo steps are forgotten when more than this is needed.")
 
         invertRow = mceutils.CheckBoxLabel("Invert Mouse",
             ref=ControlSettings.invertMousePitch.propertyRef(),
@@ -545,7 +567,7 @@ class OptionsPanel(Dialog):
             cameraBrakeSpeedRow,
             blockBufferRow,
             mouseSpeedRow,
-            undoLimitRow,
+            undoBufferRow,
         )
 
         options = (
@@ -1167,7 +1189,7 @@ class GLDisplayContext(object):
         for mats, matFile in textures:
             try:
                 if mats.name == 'Alpha':
-                    tex = mceutils.loadAlphaTerrainTexture()
+                    tex = mceutils.loadAlphaTerrainTexture(Settings.skin.get())
                 else:
                     tex = mceutils.loadPNGTexture(matFile)
                 self.terrainTextures[mats.name] = tex
@@ -1190,4 +1212,5 @@ def weird_fix():
         pass
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     sys.exit(main(sys.argv))
@@ -31,10 +31,12 @@ from OpenGL import GL, GLU
 import os
 import platform
 import png
+import pngdecode
 from pygame import display, image, Surface
 import pymclevel
 import release
 import sys
+import terrainatlas
 import traceback
 import zipfile
 
@@ -271,20 +273,44 @@ def drawTerrainCuttingWire(box,
 # texturePacksDir = os.path.join(pymclevel.minecraftDir, "texturepacks")
 
 
-def loadAlphaTerrainTexture():
-    pngFile = None
+def loadAlphaTerrainTexture(pack=None):
+    try:
+        levels = terrainatlas.terrainMipmaps(pack)
+    except Exception, e:
+        logging.warning(u"Unable to build terrain mipmaps: {0!r}".format(e))
+        levels = None
+
+    if not levels:
+        texW, texH, terraindata = loadPNGFile(os.path.join(directories.dataDir, "terrain.png"))
+
+        def _loadFunc():
+            loadTextureFunc(texW, texH, terraindata)
 
-    texW, texH, terraindata = loadPNGFile(os.path.join(directories.dataDir, "terrain.png"))
+        tex = glutils.Texture(_loadFunc)
+        tex.data = terraindata
+        return tex
 
-    def _loadFunc():
-        loadTextureFunc(texW, texH, terraindata)
+    def _loadMipmapsFunc():
+        for i, level in enumerate(levels):
+            h, w = level.shape[:2]
+            GL.glTexImage2D(GL.GL_TEXTURE_2D, i, GL.GL_RGBA, w, h, 0, GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, level)
+        GL.glTexParameter(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAX_LEVEL, len(levels) - 1)
 
-    tex = glutils.Texture(_loadFunc)
-    tex.data = terraindata
+    minFilter = GL.GL_NEAREST_MIPMAP_LINEAR if len(levels) > 1 else GL.GL_NEAREST
+    tex = glutils.Texture(_loadMipmapsFunc, minFilter=minFilter)
+    tex.data = levels[0]
     return tex
 
 
 def loadPNGData(filename_or_data):
+    try:
+        return pngdecode.loadPNG(filename_or_data)
+    except NotImplementedError, e:
+        # interlaced images
+        logging.debug(u"Decoding PNG with pypng: {0!r}".format(e))
+    except Exception, e:
+        logging.warn(u"Unable to decode PNG, trying pypng: {0!r}".format(e))
+
     reader = png.Reader(filename_or_data)
     (w, h, data, metadata) = reader.read_flat()
     data = numpy.array(data, dtype='uint8')
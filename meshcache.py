@@ -0,0 +1,170 @@
+"""Copyright (c) 2010-2012 David Rio Vierra
+
+Permission to use, copy, modify, and/or distribute this software for any
+purpose with or without fee is hereby granted, provided that the above
+copyright notice and this permission notice appear in all copies.
+
+THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE."""
+
+"""
+meshcache.py
+
+An on-disk cache of finished high detail chunk geometry.
+
+Entries are keyed by a hash of everything the geometry is computed from: the
+chunk's blocks, data and lighting along with the border blocks of its
+neighbors, and the renderer settings. Vertex positions are relative to the
+chunk, so a key never needs the chunk's position and a stale entry can never be
+found for a changed chunk. The least recently used entries are removed to keep
+the cache under its size limit.
+"""
+
+from collections import OrderedDict
+import cPickle
+import hashlib
+import logging
+import os
+
+import mcplatform
+
+log = logging.getLogger(__name__)
+
+# Change this when the vertex format or the geometry for any block changes
+cacheVersion = 3
+
+
+def cacheDir():
+    return os.path.join(os.path.dirname(mcplatform.configFilePath), u"MCEdit-meshcache")
+
+
+class MeshCache(object):
+    suffix = ".mesh"
+
+    def __init__(self, directory, maxBytes):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.hits = 0
+        self.misses = 0
+
+        # key -> file size, least recently used first
+        self.entries = OrderedDict()
+        self.totalBytes = 0
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        files = []
+        for filename in os.listdir(directory):
+            if not filename.endswith(self.suffix):
+                continue
+            try:
+                st = os.stat(os.path.join(directory, filename))
+            except EnvironmentError:
+                continue
+            files.append((st.st_mtime, filename[:-len(self.suffix)], st.st_size))
+
+        for mtime, key, size in sorted(files):
+            self.entries[key] = size
+            self.totalBytes += size
+
+        self.trim()
+
+    @staticmethod
+    def key(arrays, settings):
+        """ settings is a tuple of the renderer settings that change the geometry """
+        h = hashlib.sha1(repr((cacheVersion,) + tuple(settings)))
+        for a in arrays:
+            h.update(repr((a.dtype.str, a.shape)))
+            h.update(_arrayBuffer(a))
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    def get(self, key):
+        """ Returns the chunk geometry stored for key, or None """
+        if key not in self.entries:
+            self.misses += 1
+            return None
+
+        try:
+            with file(self.path(key), "rb") as f:
+                result = cPickle.load(f)
+            os.utime(self.path(key), None)
+        except Exception, e:
+            log.warn(u"Discarding unreadable mesh cache entry {0}: {1!r}".format(key, e))
+            self.remove(key)
+            self.misses += 1
+            return None
+
+        self.entries[key] = self.entries.pop(key)
+        self.hits += 1
+        return result
+
+    def put(self, key, result):
+        if key in self.entries:
+            return
+
+        path = self.path(key)
+        tempPath = path + ".tmp"
+        try:
+            with file(tempPath, "wb") as f:
+                cPickle.dump(result, f, cPickle.HIGHEST_PROTOCOL)
+            if os.path.exists(path):
+                os.remove(path)
+            os.rename(tempPath, path)
+            size = os.path.getsize(path)
+        except EnvironmentError, e:
+            log.warn(u"Unable to write mesh cache entry {0}: {1!r}".format(key, e))
+            return
+
+        self.entries[key] = size
+        self.totalBytes += size
+        self.trim()
+
+    def remove(self, key):
+        size = self.entries.pop(key, None)
+        if size is None:
+            return
+        self.totalBytes -= size
+        try:
+            os.remove(self.path(key))
+        except EnvironmentError:
+            pass
+
+    def trim(self):
+        while self.entries and self.totalBytes > self.maxBytes:
+            self.remove(next(iter(self.entries)))
+
+
+def _arrayBuffer(a):
+    if not a.flags.c_contiguous:
+        a = a.copy()
+    return buffer(a)
+
+_meshCache = None
+
+
+def getMeshCache(megabytes):
+    """ Returns the shared MeshCache limited to the given size, or None if megabytes is 0 """
+    global _meshCache
+
+    maxBytes = megabytes << 20
+    if maxBytes <= 0:
+        _meshCache = None
+    elif _meshCache is None:
+        try:
+            _meshCache = MeshCache(cacheDir(), maxBytes)
+        except EnvironmentError, e:
+            log.warn(u"Unable to open the mesh cache: {0!r}".format(e))
+    else:
+        _meshCache.maxBytes = maxBytes
+        _meshCache.trim()
+
+    return _meshCache
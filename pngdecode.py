@@ -0,0 +1,301 @@
+"""Copyright (c) 2010-2012 David Rio Vierra
+
+Permission to use, copy, modify, and/or distribute this software for any
+purpose with or without fee is hereby granted, provided that the above
+copyright notice and this permission notice appear in all copies.
+
+THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE."""
+
+"""
+pngdecode.py
+
+PNG decoding with zlib and numpy, and an on-disk cache of decoded images.
+
+The image data is inflated with zlib and the scanline filters are undone on
+whole rows with numpy. Rows using the Average or Paeth filters depend on the
+pixel to their left, so images that use them are unfiltered one anti-diagonal
+of pixels at a time instead. Interlaced images aren't handled here and raise
+NotImplementedError.
+
+Decoded images are stored as .npy files named by a hash of the PNG file's
+contents and memory-mapped when they are loaded again.
+"""
+
+import hashlib
+import logging
+import os
+import struct
+import zlib
+
+import numpy
+
+import mcplatform
+
+log = logging.getLogger(__name__)
+
+# Change this when the decoded output for any image changes
+cacheVersion = 1
+
+signature = "\x89PNG\r\n\x1a\n"
+
+# color type -> samples per pixel
+colorPlanes = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
+
+def readChunks(data):
+    """ Yields the type and contents of each chunk in the PNG data """
+    if not data.startswith(signature):
+        raise ValueError("Not a PNG file")
+
+    offset = len(signature)
+    while offset + 8 <= len(data):
+        length, chunkType = struct.unpack(">I4s", data[offset:offset + 8])
+        offset += 8
+        yield chunkType, data[offset:offset + length]
+        offset += length + 4  # skip the CRC
+        if chunkType == "IEND":
+            return
+
+
+def imageSize(data):
+    """ Returns the width and height from the PNG data's header """
+    for chunkType, contents in readChunks(data):
+        if chunkType == "IHDR":
+            return struct.unpack(">II", contents[:8])
+        break
+    raise ValueError("PNG file has no header")
+
+
+def paethPredictor(a, b, c):
+    p = a + b - c
+    pa = numpy.abs(p - a)
+    pb = numpy.abs(p - b)
+    pc = numpy.abs(p - c)
+    return numpy.where((pa <= pb) & (pa <= pc), a, numpy.where(pb <= pc, b, c))
+
+
+def unfilterRows(filtered, filterTypes):
+    """ Undo the None, Sub and Up filters one row at a time. filtered is (rows,
+    pixels, bytes per pixel) uint8 and is changed in place. """
+    for y, filterType in enumerate(filterTypes):
+        row = filtered[y]
+        if filterType == 1:
+            numpy.cumsum(row, axis=0, dtype='uint8', out=row)
+        elif filterType == 2 and y > 0:
+            row += filtered[y - 1]
+    return filtered
+
+
+def unfilterDiagonals(filtered, filterTypes):
+    """ Undo any of the five filters. A pixel depends only on the pixels to its
+    left, above, and above left, so every pixel on an anti-diagonal can be done
+    at once. """
+    h, w, bpp = filtered.shape
+    recon = numpy.zeros((h + 1, w + 1, bpp), dtype='int16')  # zero row and column for the edges
+    filterTypes = numpy.asarray(filterTypes)
+    for d in xrange(w + h - 1):
+        ys = numpy.arange(max(0, d - w + 1), min(h, d + 1))
+        xs = d - ys
+        types = filterTypes[ys][:, numpy.newaxis]
+        a = recon[ys + 1, xs]
+        b = recon[ys, xs + 1]
+        c = recon[ys, xs]
+
+        predicted = numpy.select([types == 1, types == 2, types == 3, types == 4],
+                                 [a, b, (a + b) >> 1, paethPredictor(a, b, c)], 0)
+        recon[ys + 1, xs + 1] = (filtered[ys, xs] + predicted) & 0xff
+
+    return recon[1:, 1:].astype('uint8')
+
+
+def decodePNG(data):
+    """ Returns the width, height and an (h, w, 4) uint8 RGBA array for the PNG data """
+    header = None
+    palette = None
+    transparency = None
+    compressed = []
+    for chunkType, contents in readChunks(data):
+        if chunkType == "IHDR":
+            header = struct.unpack(">IIBBBBB", contents)
+        elif chunkType == "PLTE":
+            palette = numpy.fromstring(contents, dtype='uint8').reshape(-1, 3)
+        elif chunkType == "tRNS":
+            transparency = contents
+        elif chunkType == "IDAT":
+            compressed.append(contents)
+
+    if header is None:
+        raise ValueError("PNG file has no header")
+    w, h, bitDepth, colorType, compression, filterMethod, interlace = header
+    if interlace:
+        raise NotImplementedError("Interlaced PNG files are not supported")
+    if colorType not in colorPlanes or bitDepth not in (1, 2, 4, 8, 16):
+        raise ValueError("Unknown PNG format: color type {0}, bit depth {1}".format(colorType, bitDepth))
+
+    planes = colorPlanes[colorType]
+    bitsPerPixel = planes * bitDepth
+    bpp = max(1, bitsPerPixel >> 3)
+    rowBytes = (w * bitsPerPixel + 7) >> 3
+
+    raw = numpy.fromstring(zlib.decompress("".join(compressed)), dtype='uint8')
+    raw = raw[:h * (rowBytes + 1)].reshape(h, rowBytes + 1)
+    filterTypes = raw[:, 0]
+    filtered = raw[:, 1:].reshape(h, rowBytes // bpp, bpp)
+
+    if (filterTypes > 2).any():
+        pixels = unfilterDiagonals(filtered, filterTypes)
+    else:
+        pixels = unfilterRows(filtered.copy(), filterTypes)
+    pixels = pixels.reshape(h, rowBytes)
+
+    if bitDepth == 16:
+        values = pixels.view('>u2').reshape(h, w, planes)
+    elif bitDepth == 8:
+        values = pixels.reshape(h, w, planes)
+    else:
+        bits = numpy.unpackbits(pixels, axis=1).reshape(h, -1, bitDepth)
+        values = numpy.dot(bits, 1 << numpy.arange(bitDepth - 1, -1, -1))[:, :w].reshape(h, w, 1)
+
+    transparent = None
+    if transparency is not None and colorType in (0, 2):
+        transparent = (values == numpy.fromstring(transparency, dtype='>u2')[:planes]).all(2)
+
+    if bitDepth == 16:
+        samples = (values >> 8).astype('uint8')
+    elif bitDepth < 8 and colorType != 3:
+        samples = (values * (255 // ((1 << bitDepth) - 1))).astype('uint8')
+    else:
+        samples = values.astype('uint8')
+
+    rgba = numpy.empty((h, w, 4), dtype='uint8')
+    rgba[..., 3] = 255
+    if colorType == 3:
+        if palette is None:
+            raise ValueError("Indexed PNG file has no palette")
+        colors = numpy.empty((256, 4), dtype='uint8')
+        colors[:] = 255
+        colors[:len(palette), :3] = palette
+        if transparency is not None:
+            alpha = numpy.fromstring(transparency, dtype='uint8')
+            colors[:len(alpha), 3] = alpha
+        rgba[:] = colors[samples[..., 0]]
+        return w, h, rgba
+
+    if colorType in (0, 4):
+        rgba[..., :3] = samples[..., :1]
+    else:
+        rgba[..., :3] = samples[..., :3]
+    if colorType in (4, 6):
+        rgba[..., 3] = samples[..., -1]
+    elif transparent is not None:
+        rgba[..., 3][transparent] = 0
+
+    return w, h, rgba
+
+
+def cacheDir():
+    return os.path.join(os.path.dirname(mcplatform.configFilePath), u"MCEdit-texturecache")
+
+
+class DecodedPNGCache(object):
+    """ Decoded images as .npy files, keyed by a hash of the PNG data. Only the
+    most recently used maxEntries files are kept. """
+    suffix = ".npy"
+    maxEntries = 64
+
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    @staticmethod
+    def key(data, variant=""):
+        """ variant names something other than the decoded image made from the same PNG data """
+        return hashlib.sha1(repr((cacheVersion, variant)) + data).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    def get(self, key):
+        """ Returns the memory-mapped array stored for key, or None """
+        path = self.path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            rgba = numpy.load(path, mmap_mode='c')
+            os.utime(path, None)
+        except Exception, e:
+            log.warn(u"Discarding unreadable texture cache entry {0}: {1!r}".format(key, e))
+            try:
+                os.remove(path)
+            except EnvironmentError:
+                pass
+            return None
+        return rgba
+
+    def put(self, key, array):
+        path = self.path(key)
+        tempPath = path + ".tmp"
+        try:
+            with file(tempPath, "wb") as f:
+                numpy.save(f, array)
+            if os.path.exists(path):
+                os.remove(path)
+            os.rename(tempPath, path)
+        except EnvironmentError, e:
+            log.warn(u"Unable to write texture cache entry {0}: {1!r}".format(key, e))
+            return
+        self.trim()
+
+    def trim(self):
+        try:
+            files = [os.path.join(self.directory, f) for f in os.listdir(self.directory) if f.endswith(self.suffix)]
+            files.sort(key=os.path.getmtime)
+            for f in files[:-self.maxEntries]:
+                os.remove(f)
+        except EnvironmentError, e:
+            log.warn(u"Unable to trim the texture cache: {0!r}".format(e))
+
+
+_pngCache = None
+
+
+def getDecodedPNGCache():
+    """ Returns the shared DecodedPNGCache, or None if it can't be opened """
+    global _pngCache
+    if _pngCache is None:
+        try:
+            _pngCache = DecodedPNGCache(cacheDir())
+        except EnvironmentError, e:
+            log.warn(u"Unable to open the texture cache: {0!r}".format(e))
+            _pngCache = False
+    return _pngCache or None
+
+
+def loadPNG(filename_or_data):
+    """ Returns the width, height and RGBA array of a PNG file, given its name or
+    contents, from the cache if it was decoded before. """
+    if isinstance(filename_or_data, str) and filename_or_data.startswith(signature):
+        data = filename_or_data
+    else:
+        with file(filename_or_data, "rb") as f:
+            data = f.read()
+
+    cache = getDecodedPNGCache()
+    if cache:
+        key = cache.key(data)
+        rgba = cache.get(key)
+        if rgba is not None:
+            h, w = rgba.shape[:2]
+            return w, h, rgba
+
+    w, h, rgba = decodePNG(data)
+    if cache:
+        cache.put(key, rgba)
+    return w, h, rgba
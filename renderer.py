@@ -38,10 +38,15 @@ MCRenderer:
 
 """
 
-from collections import defaultdict, deque
+from collections import defaultdict, deque, OrderedDict
 from datetime import datetime, timedelta
 from depths import DepthOffset
-from glutils import gl, Texture
+from glutils import gl, Texture, ShaderProgram
+import chunkmesher
+import chunkprefetch
+import heapq
+import itertools
+import meshcache
 import logging
 import numpy
 from OpenGL import GL
@@ -101,28 +106,34 @@ class ChunkRenderer(object):
         self.detailLevel = 0
         self.invalidLayers = set(Layer.AllLayers)
 
+        # The bottom y of each 16-block section whose high detail blocks need
+        # remeshing, or None for all of them. Only used while Blocks is invalid.
+        self.invalidSections = None
+
         self.chunkPosition = chunkPosition
         self.bufferSize = 0
-        self.renderstateLists = None
+        self.quadCount = self.sourceFaces = 0
+        self.renderstateAllocations = None
+        self.rendererAllocations = {}  # block renderer -> [(allocation, y), ...]
+
+        # For each 16-block section, the faces that can be seen from each of its faces.
+        # See ChunkCalculator.calcSectionConnectivity
+        self.sectionConnectivity = None
 
     @property
     def visibleLayers(self):
         return self.renderer.visibleLayers
 
-    def forgetDisplayLists(self, states=None):
-        if self.renderstateLists is not None:
+    def forgetVertexBuffers(self):
+        if self.renderstateAllocations is not None:
             # print "Discarded {0}, gained {1} bytes".format(self.chunkPosition,self.bufferSize)
 
-            for k in states or self.renderstateLists.iterkeys():
-                a = self.renderstateLists.get(k, [])
-                # print a
-                for i in a:
-                    gl.glDeleteLists(i, 1)
+            for allocations in self.rendererAllocations.itervalues():
+                for allocation, y in allocations:
+                    allocation.free()
 
-            if states:
-                del self.renderstateLists[states]
-            else:
-                self.renderstateLists = None
+            self.rendererAllocations = {}
+            self.renderstateAllocations = None
 
             self.needsRedisplay = True
             self.renderer.discardMasterList()
@@ -131,53 +142,131 @@ class ChunkRenderer(object):
         for blockRenderer in self.blockRenderers:
             blockRenderer.drawArrays(self.chunkPosition, False)
 
-    def makeDisplayLists(self):
+    # Whether the vertices in the arenas were colored to show a redraw
+    redrawColored = False
+
+    def makeVertexBuffers(self):
+        """ Copy the block renderers' vertices into the renderer's vertex arenas. Each
+        block renderer adds one (blockRendererClass, allocation, y) per vertex array to
+        renderstateAllocations. y is None for renderers that cover the whole chunk.
+
+        Block renderers copied by an earlier call keep their allocations, so when only
+        an entity layer was recalculated, the block vertices aren't copied again. """
         if not self.needsRedisplay:
             return
-        self.forgetDisplayLists()
+
+        showRedraw = self.renderer.showRedraw and self.needsBlockRedraw
+        if showRedraw or self.redrawColored or not self.blockRenderers:
+            self.forgetVertexBuffers()
+        self.redrawColored = showRedraw
         if not self.blockRenderers:
             return
 
-        lists = defaultdict(list)
+        previousAllocations = self.rendererAllocations
+        self.rendererAllocations = {}
+        allocations = defaultdict(list)
 
-        showRedraw = self.renderer.showRedraw
+        offset = self.renderer.arenaOffset(self.chunkPosition)
 
-        if not (showRedraw and self.needsBlockRedraw):
-            GL.glEnableClientState(GL.GL_COLOR_ARRAY)
-
-        renderers = self.blockRenderers
-
-        for blockRenderer in renderers:
+        for blockRenderer in self.blockRenderers:
             if self.detailLevel not in blockRenderer.detailLevels:
                 continue
             if blockRenderer.layer not in self.visibleLayers:
                 continue
 
-            l = blockRenderer.makeArrayList(self.chunkPosition, self.needsBlockRedraw and showRedraw)
-            lists[blockRenderer.renderstate].append(l)
+            rendererAllocations = previousAllocations.pop(blockRenderer, None)
+            if rendererAllocations is None:
+                arena = self.renderer.vertexArena(blockRenderer.arenaStride())
+                y = getattr(blockRenderer, 'y', None)
+                rendererAllocations = [(arena.allocate(buf), y) for buf in blockRenderer.arenaVertices(offset, showRedraw)]
+
+            self.rendererAllocations[blockRenderer] = rendererAllocations
 
-        if not (showRedraw and self.needsBlockRedraw):
-            GL.glDisableClientState(GL.GL_COLOR_ARRAY)
+        for rendererAllocations in previousAllocations.itervalues():
+            for allocation, y in rendererAllocations:
+                allocation.free()
 
         self.needsRedisplay = False
-        self.renderstateLists = lists
+        self.gatherAllocations()
+
+    def gatherAllocations(self):
+        allocations = defaultdict(list)
+        for blockRenderer, rendererAllocations in self.rendererAllocations.iteritems():
+            for allocation, y in rendererAllocations:
+                allocations[blockRenderer.renderstate].append((type(blockRenderer), allocation, y))
+
+        self.renderstateAllocations = allocations
+        self.renderer.discardMasterList()
+
+    def updateVertexBuffers(self, blockRenderer):
+        """ Copy one block renderer's vertices to the vertex arenas again after they
+        changed, in place of its old ones where they fit. """
+        previousAllocations = self.rendererAllocations.get(blockRenderer)
+        if previousAllocations is None or self.needsRedisplay or self.redrawColored:
+            self.needsRedisplay = True
+            self.renderer.discardMasterList()
+            return
+
+        arena = self.renderer.vertexArena(blockRenderer.arenaStride())
+        offset = self.renderer.arenaOffset(self.chunkPosition)
+        y = getattr(blockRenderer, 'y', None)
+
+        rendererAllocations = []
+        for buf in blockRenderer.arenaVertices(offset, False):
+            if previousAllocations:
+                allocation, y = previousAllocations.pop(0)
+                rendererAllocations.append((arena.reallocate(allocation, buf), y))
+            else:
+                rendererAllocations.append((arena.allocate(buf), y))
+
+        for allocation, y in previousAllocations:
+            allocation.free()
+
+        self.rendererAllocations[blockRenderer] = rendererAllocations
+        self.gatherAllocations()
+
+    def updateEntities(self, tagList, removed, added):
+        """ Patch the markers made from tagList for tags removed from or added to
+        this chunk. Layers waiting to be recalculated are left alone. """
+        for blockRenderer in self.blockRenderers:
+            if not isinstance(blockRenderer, EntityMarkerRenderer) or blockRenderer.tagList != tagList:
+                continue
+            if blockRenderer.layer in self.invalidLayers:
+                continue
+
+            if blockRenderer.patchInstances(removed, added):
+                if self.renderer.alpha != 0xff:
+                    blockRenderer.setAlpha(self.renderer.alpha)
+                self.updateVertexBuffers(blockRenderer)
 
     @property
     def needsBlockRedraw(self):
         return Layer.Blocks in self.invalidLayers
 
-    def invalidate(self, layers=None):
+    def invalidate(self, layers=None, sections=None):
+        """ sections is a list of the bottom y of each section that changed, if
+        only part of the chunk's blocks changed """
         if layers is None:
             layers = Layer.AllLayers
 
         if layers:
             layers = set(layers)
+            if Layer.Blocks in layers:
+                if sections is None:
+                    self.invalidSections = None
+                elif Layer.Blocks not in self.invalidLayers:
+                    self.invalidSections = set(sections)
+                elif self.invalidSections is not None:
+                    self.invalidSections.update(sections)
+
             self.invalidLayers.update(layers)
             blockRenderers = [br for br in self.blockRenderers
                               if br.layer is Layer.Blocks
                               or br.layer not in layers]
             if len(blockRenderers) < len(self.blockRenderers):
-                self.forgetDisplayLists()
+                # the dropped renderers' allocations are freed by makeVertexBuffers
+                self.needsRedisplay = True
+                self.renderer.discardMasterList()
             self.blockRenderers = blockRenderers
 
             if self.renderer.showRedraw and Layer.Blocks in layers:
@@ -188,12 +277,14 @@ class ChunkRenderer(object):
 
         minlod = min(minlod, self.maxlod)
         if self.detailLevel != minlod:
-            self.forgetDisplayLists()
+            self.forgetVertexBuffers()
             self.detailLevel = minlod
             self.invalidLayers.add(Layer.Blocks)
+            self.invalidSections = None
 
             # discard the standard detail renderers
             if minlod > 0:
+                self.sectionConnectivity = None
                 blockRenderers = []
                 for br in self.blockRenderers:
                     if br.detailLevels != (0,):
@@ -211,12 +302,19 @@ class ChunkRenderer(object):
 
     def vertexArraysDone(self):
         bufferSize = 0
+        quadCount = sourceFaces = 0
         for br in self.blockRenderers:
             bufferSize += br.bufferSize()
+            quads = br.quadCount()
+            quadCount += quads
+            sourceFaces += quads if br.sourceFaces is None else br.sourceFaces
             if self.renderer.alpha != 0xff:
                 br.setAlpha(self.renderer.alpha)
         self.bufferSize = bufferSize
+        self.quadCount = quadCount
+        self.sourceFaces = sourceFaces
         self.invalidLayers = set()
+        self.invalidSections = None
         self.needsRedisplay = True
         self.renderer.invalidateMasterList()
 
@@ -305,6 +403,22 @@ def createPrecomputedVertices():
 faceVertexTemplates = makeVertexTemplates()
 
 
+class ChunkEdges(object):
+    """ Copies of the one-block-thick slabs on each horizontal side of a chunk, which
+    is all that meshing its neighbors needs. Blocks and Light are indexed by
+    XDecreasing, XIncreasing, ZDecreasing and ZIncreasing. Light holds the greater
+    of SkyLight and BlockLight. """
+
+    XDecreasing, XIncreasing, ZDecreasing, ZIncreasing = range(4)
+    sides = (numpy.s_[:1], numpy.s_[-1:], numpy.s_[:, :1], numpy.s_[:, -1:])
+
+    def __init__(self, chunk):
+        self.height = chunk.Blocks.shape[2]
+        self.Blocks = [numpy.array(chunk.Blocks[side]) for side in self.sides]
+        self.Light = [numpy.maximum(chunk.SkyLight[side], chunk.BlockLight[side]) for side in self.sides]
+        self.TerrainPopulated = getattr(chunk, "TerrainPopulated", True)
+
+
 class ChunkCalculator (object):
     cachedTemplate = None
     cachedTemplateHeight = 0
@@ -321,6 +435,29 @@ class ChunkCalculator (object):
 
         Settings.fastLeaves.addObserver(self)
         Settings.roughGraphics.addObserver(self)
+        Settings.greedyMeshing.addObserver(self)
+
+    @classmethod
+    def forMaterials(cls, materials, fastLeaves, roughGraphics, greedyMeshing):
+        """ Create a calculator that doesn't observe the Settings. Used by the
+        mesher processes, which receive the settings along with each chunk. """
+        calc = cls.__new__(cls)
+        calc.makeRenderstates(materials)
+        calc.fastLeaves = fastLeaves
+        calc.roughGraphics = roughGraphics
+        calc._greedyMeshing = greedyMeshing
+        return calc
+
+    _greedyMeshing = False
+
+    @property
+    def greedyMeshing(self):
+        return self._greedyMeshing
+
+    @greedyMeshing.setter
+    def greedyMeshing(self, val):
+        # merged faces can only be drawn with the tiled texture shader
+        self._greedyMeshing = bool(val) and self.renderstateTiled.program.available
 
     class renderstatePlain(object):
         @classmethod
@@ -377,6 +514,62 @@ class ChunkCalculator (object):
     class renderstateIce(_renderstateAlphaBlend):
         pass
 
+    class renderstateTiled(renderstateAlphaTest):
+        """ Draws faces whose texture coordinates were packed by GreedyBlockRenderer,
+        repeating the texture's tile across each face. """
+        program = ShaderProgram("""
+            varying vec2 tiledCoord;
+
+            void main() {
+                gl_Position = ftransform();
+                gl_FrontColor = gl_Color;
+                tiledCoord = gl_MultiTexCoord0.st;
+                gl_FogFragCoord = abs((gl_ModelViewMatrix * gl_Vertex).z);
+            }
+            """, """
+            #extension GL_ARB_shader_texture_lod : enable
+            uniform sampler2D terrain;
+            uniform bool fog;
+            varying vec2 tiledCoord;
+
+            void main() {
+                vec2 tile = floor(tiledCoord / 1024.0);
+                vec2 local = tiledCoord - tile * 1024.0 - 512.0;
+                vec2 st = (gl_TextureMatrix[0] * vec4(tile + mod(local, 16.0), 0.0, 1.0)).st;
+
+                // st jumps back across the tile where it repeats, which would select the
+                // smallest mipmap there. Take the derivatives from the unwrapped coordinate.
+                vec2 dx = (gl_TextureMatrix[0] * vec4(dFdx(tiledCoord), 0.0, 0.0)).st;
+                vec2 dy = (gl_TextureMatrix[0] * vec4(dFdy(tiledCoord), 0.0, 0.0)).st;
+            #ifdef GL_ARB_shader_texture_lod
+                vec4 color = texture2DGradARB(terrain, st, dx, dy) * gl_Color;
+            #else
+                // bias the implicit level of detail by the difference between the two
+                float rho = max(max(length(dx), length(dy)), 1e-8);
+                float rhoWrapped = max(max(length(dFdx(st)), length(dFdy(st))), 1e-8);
+                vec4 color = texture2D(terrain, st, log2(rho / rhoWrapped)) * gl_Color;
+            #endif
+                if (fog) {
+                    float f = clamp(exp(-gl_Fog.density * gl_FogFragCoord), 0.0, 1.0);
+                    color.rgb = mix(gl_Fog.color.rgb, color.rgb, f);
+                }
+                gl_FragColor = color;
+            }
+            """)
+
+        @classmethod
+        def bind(self):
+            super(ChunkCalculator.renderstateTiled, self).bind()
+            fog = GL.glIsEnabled(GL.GL_FOG)
+            self.program.bind()
+            GL.glUniform1i(self.program.uniform("terrain"), 0)
+            GL.glUniform1i(self.program.uniform("fog"), bool(fog))
+
+        @classmethod
+        def release(self):
+            self.program.release()
+            super(ChunkCalculator.renderstateTiled, self).release()
+
     class renderstateEntity(object):
         @classmethod
         def bind(self):
@@ -397,6 +590,7 @@ class ChunkCalculator (object):
         renderstateVines,
         renderstateLowDetail,
         renderstateAlphaTest,
+        renderstateTiled,
         renderstateIce,
         renderstateWater,
         renderstateEntity,
@@ -536,35 +730,71 @@ class ChunkCalculator (object):
         cr.vertexArraysDone()
         raise StopIteration
 
-    def getNeighboringChunks(self, chunk):
+    maxCachedEdges = 4096
+
+    def getChunkEdges(self, level, cx, cz):
+        """ Returns the ChunkEdges for a chunk, reading the chunk only if its edges
+        aren't cached. Missing and unreadable chunks have empty edges. """
+        edgeCache = self.edgeCache
+        edges = edgeCache.pop((cx, cz), None)
+        if edges is None:
+            if not level.containsChunk(cx, cz):
+                return self.zeroEdges(level.Height)
+            try:
+                edges = ChunkEdges(level.getChunk(cx, cz))
+            except (EnvironmentError, pymclevel.mclevelbase.ChunkNotPresent, pymclevel.mclevelbase.ChunkMalformed):
+                return self.zeroEdges(level.Height)
+
+            while len(edgeCache) >= self.maxCachedEdges:
+                edgeCache.popitem(last=False)
+
+        edgeCache[cx, cz] = edges
+        return edges
+
+    @property
+    def edgeCache(self):
+        """ ChunkEdges of recently meshed chunks and their neighbors, least recently used first """
+        if not hasattr(self, "_edgeCache"):
+            self._edgeCache = OrderedDict()
+        return self._edgeCache
+
+    def zeroEdges(self, height):
+        if not hasattr(self, "_zeroEdges") or self._zeroEdges.height != height:
+            self._zeroEdges = ChunkEdges(pymclevel.infiniteworld.ZeroChunk(height))
+        return self._zeroEdges
+
+    def cacheChunkEdges(self, chunk):
+        """ Save the edges of a chunk that was loaded for meshing, so its neighbors don't load it again. """
+        key = chunk.chunkPosition
+        if key not in self.edgeCache:
+            self.getChunkEdges(chunk.world, *key)
+
+    def forgetChunkEdges(self, cx, cz):
+        self.edgeCache.pop((cx, cz), None)
+
+    def getNeighboringEdges(self, chunk):
+        """ Returns a dict mapping each horizontal face to the ChunkEdges of the chunk on that side """
         cx, cz = chunk.chunkPosition
         level = chunk.world
 
-        neighboringChunks = {}
+        neighboringEdges = {}
         for dir, dx, dz in ((pymclevel.faces.FaceXDecreasing, -1, 0),
                            (pymclevel.faces.FaceXIncreasing, 1, 0),
                            (pymclevel.faces.FaceZDecreasing, 0, -1),
                            (pymclevel.faces.FaceZIncreasing, 0, 1)):
-            if not level.containsChunk(cx + dx, cz + dz):
-                neighboringChunks[dir] = pymclevel.infiniteworld.ZeroChunk(level.Height)
-            else:
-                # if not level.chunkIsLoaded(cx+dx,cz+dz):
-                #    raise StopIteration
-                try:
-                    neighboringChunks[dir] = level.getChunk(cx + dx, cz + dz)
-                except (EnvironmentError, pymclevel.mclevelbase.ChunkNotPresent, pymclevel.mclevelbase.ChunkMalformed):
-                    neighboringChunks[dir] = pymclevel.infiniteworld.ZeroChunk(level.Height)
-        return neighboringChunks
+            neighboringEdges[dir] = self.getChunkEdges(level, cx + dx, cz + dz)
+
+        return neighboringEdges
 
-    def getAreaBlocks(self, chunk, neighboringChunks):
+    def getAreaBlocks(self, chunk, neighboringEdges):
         chunkWidth, chunkLength, chunkHeight = chunk.Blocks.shape
 
         areaBlocks = numpy.zeros((chunkWidth + 2, chunkLength + 2, chunkHeight + 2), numpy.uint16)
         areaBlocks[1:-1, 1:-1, 1:-1] = chunk.Blocks
-        areaBlocks[:1, 1:-1, 1:-1] = neighboringChunks[pymclevel.faces.FaceXDecreasing].Blocks[-1:, :chunkLength, :chunkHeight]
-        areaBlocks[-1:, 1:-1, 1:-1] = neighboringChunks[pymclevel.faces.FaceXIncreasing].Blocks[:1, :chunkLength, :chunkHeight]
-        areaBlocks[1:-1, :1, 1:-1] = neighboringChunks[pymclevel.faces.FaceZDecreasing].Blocks[:chunkWidth, -1:, :chunkHeight]
-        areaBlocks[1:-1, -1:, 1:-1] = neighboringChunks[pymclevel.faces.FaceZIncreasing].Blocks[:chunkWidth, :1, :chunkHeight]
+        areaBlocks[:1, 1:-1, 1:-1] = neighboringEdges[pymclevel.faces.FaceXDecreasing].Blocks[ChunkEdges.XIncreasing][:, :chunkLength, :chunkHeight]
+        areaBlocks[-1:, 1:-1, 1:-1] = neighboringEdges[pymclevel.faces.FaceXIncreasing].Blocks[ChunkEdges.XDecreasing][:, :chunkLength, :chunkHeight]
+        areaBlocks[1:-1, :1, 1:-1] = neighboringEdges[pymclevel.faces.FaceZDecreasing].Blocks[ChunkEdges.ZIncreasing][:chunkWidth, :, :chunkHeight]
+        areaBlocks[1:-1, -1:, 1:-1] = neighboringEdges[pymclevel.faces.FaceZIncreasing].Blocks[ChunkEdges.ZDecreasing][:chunkWidth, :, :chunkHeight]
         return areaBlocks
 
     def getFacingBlockIndices(self, areaBlocks, areaBlockMats):
@@ -586,7 +816,7 @@ class ChunkCalculator (object):
         facingBlockIndices[pymclevel.faces.FaceYIncreasing] = exposedFacesY[:, :, 1:]
         return facingBlockIndices
 
-    def getAreaBlockLights(self, chunk, neighboringChunks):
+    def getAreaBlockLights(self, chunk, neighboringEdges):
         chunkWidth, chunkLength, chunkHeight = chunk.Blocks.shape
         lights = chunk.BlockLight
         skyLight = chunk.SkyLight
@@ -602,25 +832,17 @@ class ChunkCalculator (object):
 
         areaBlockLights[1:-1, 1:-1, 1:-1] = finalLight
 
-        nc = neighboringChunks[pymclevel.faces.FaceXDecreasing]
-        numpy.maximum(nc.SkyLight[-1:, :chunkLength, :chunkHeight],
-                nc.BlockLight[-1:, :chunkLength, :chunkHeight],
-                areaBlockLights[0:1, 1:-1, 1:-1])
+        ne = neighboringEdges[pymclevel.faces.FaceXDecreasing]
+        areaBlockLights[0:1, 1:-1, 1:-1] = ne.Light[ChunkEdges.XIncreasing][:, :chunkLength, :chunkHeight]
 
-        nc = neighboringChunks[pymclevel.faces.FaceXIncreasing]
-        numpy.maximum(nc.SkyLight[:1, :chunkLength, :chunkHeight],
-                nc.BlockLight[:1, :chunkLength, :chunkHeight],
-                areaBlockLights[-1:, 1:-1, 1:-1])
+        ne = neighboringEdges[pymclevel.faces.FaceXIncreasing]
+        areaBlockLights[-1:, 1:-1, 1:-1] = ne.Light[ChunkEdges.XDecreasing][:, :chunkLength, :chunkHeight]
 
-        nc = neighboringChunks[pymclevel.faces.FaceZDecreasing]
-        numpy.maximum(nc.SkyLight[:chunkWidth, -1:, :chunkHeight],
-                nc.BlockLight[:chunkWidth, -1:, :chunkHeight],
-                areaBlockLights[1:-1, 0:1, 1:-1])
+        ne = neighboringEdges[pymclevel.faces.FaceZDecreasing]
+        areaBlockLights[1:-1, 0:1, 1:-1] = ne.Light[ChunkEdges.ZIncreasing][:chunkWidth, :, :chunkHeight]
 
-        nc = neighboringChunks[pymclevel.faces.FaceZIncreasing]
-        numpy.maximum(nc.SkyLight[:chunkWidth, :1, :chunkHeight],
-                nc.BlockLight[:chunkWidth, :1, :chunkHeight],
-                areaBlockLights[1:-1, -1:, 1:-1])
+        ne = neighboringEdges[pymclevel.faces.FaceZIncreasing]
+        areaBlockLights[1:-1, -1:, 1:-1] = ne.Light[ChunkEdges.ZDecreasing][:chunkWidth, :, :chunkHeight]
 
         minimumLight = 4
         # areaBlockLights[areaBlockLights<minimumLight]=minimumLight
@@ -638,20 +860,157 @@ class ChunkCalculator (object):
         level = cr.renderer.level
 
         chunk = level.getChunk(cx, cz)
-        neighboringChunks = self.getNeighboringChunks(chunk)
+        self.cacheChunkEdges(chunk)
+        neighboringEdges = self.getNeighboringEdges(chunk)
 
-        areaBlocks = self.getAreaBlocks(chunk, neighboringChunks)
+        areaBlocks = self.getAreaBlocks(chunk, neighboringEdges)
         yield
 
-        areaBlockLights = self.getAreaBlockLights(chunk, neighboringChunks)
+        areaBlockLights = self.getAreaBlockLights(chunk, neighboringEdges)
         yield
 
+        showHiddenOres = cr.renderer.showHiddenOres
+
+        # Keep the geometry of the sections that didn't change, if there is any
+        sections = cr.invalidSections
+        if sections is not None and cr.sectionConnectivity is not None:
+            sections = sorted(sections)
+            keptRenderers = [br for br in cr.blockRenderers if br.detailLevels == (0,) and br.y not in sections]
+        else:
+            sections = None
+            keptRenderers = []
+
+        meshCache = cr.renderer.meshCache
+        if meshCache:
+            settings = (chunk.materials.name, self.fastLeaves, self.roughGraphics, self.greedyMeshing, showHiddenOres, cr.renderer.texturePack)
+            cacheKey = meshCache.key((areaBlocks, chunk.Data, areaBlockLights), settings)
+            cached = meshCache.get(cacheKey)
+            if cached is not None:
+                geometry, connectivity = cached
+                cr.sectionConnectivity = connectivity
+                self.addBlockRenderers(geometry, chunk.materials, blockRenderers)
+                return
+            yield
+
+        mesherPool = cr.renderer.mesherPool
+        if mesherPool and mesherPool.canMesh(chunk.materials):
+            job = mesherPool.submit(chunk.materials, self.fastLeaves, self.roughGraphics, self.greedyMeshing, showHiddenOres,
+                                    areaBlocks, chunk.Data, areaBlockLights, sections)
+            while not job.ready():
+                yield
+
+            geometry, connectivity = job.get()
+            blockRenderers.extend(keptRenderers)
+            self.addBlockRenderers(geometry, chunk.materials, blockRenderers)
+
+        else:
+            connectivity = self.calcSectionConnectivity(areaBlocks)
+            yield
+            blockRenderers.extend(keptRenderers)
+            for i in self.calcHighDetailGeometry(areaBlocks, chunk.Data, areaBlockLights, chunk.materials, showHiddenOres, cr, blockRenderers, sections):
+                yield
+
+        geometry = [(type(br).__name__, br.y, br.vertexArrays, br.sourceFaces) for br in blockRenderers]
+
+        cr.sectionConnectivity = connectivity
+        if meshCache:
+            meshCache.put(cacheKey, (geometry, connectivity))
+
+    def addBlockRenderers(self, geometry, materials, blockRenderers):
+        """ Recreate the block renderers from a list of (blockRendererClassName, y, vertexArrays, sourceFaces)
+        returned by a mesher process or found in the mesh cache """
+        for name, y, vertexArrays, sourceFaces in geometry:
+            blockRenderer = globals()[name](self)
+            blockRenderer.y = y
+            blockRenderer.materials = materials
+            blockRenderer.vertexArrays = vertexArrays
+            blockRenderer.sourceFaces = sourceFaces
+            blockRenderers.append(blockRenderer)
+
+    # Faces of a section as slices of a (sections, x, z, y) array
+    sectionFaceSlices = {
+        pymclevel.faces.FaceXDecreasing: numpy.s_[:, 0],
+        pymclevel.faces.FaceXIncreasing: numpy.s_[:, -1],
+        pymclevel.faces.FaceZDecreasing: numpy.s_[:, :, 0],
+        pymclevel.faces.FaceZIncreasing: numpy.s_[:, :, -1],
+        pymclevel.faces.FaceYDecreasing: numpy.s_[:, :, :, 0],
+        pymclevel.faces.FaceYIncreasing: numpy.s_[:, :, :, -1],
+    }
+    maxConnectivityPasses = 8
+
+    def calcSectionConnectivity(self, areaBlocks):
+        """ Find which faces of each 16-block section of the chunk can see each other
+        through blocks that aren't opaque cubes. Returns a (sections, 6) uint8 array
+        where bit f of [section, e] is set if face f can be reached from face e.
+
+        Labels each open block with the lowest index in its connected region, by
+        sweeping the minimum label along each axis until nothing changes. Sections
+        that haven't settled after maxConnectivityPasses are treated as fully open. """
+        blocks = areaBlocks[1:-1, 1:-1, 1:-1]
+        opaque = self.exposedMaterialMap[blocks] == GenericBlockRenderer.materialIndex
+
+        w, l, h = opaque.shape
+        sectionCount = (h + 15) >> 4
+        if h & 0xf:
+            padded = numpy.zeros((w, l, sectionCount << 4), dtype='bool')
+            padded[..., :h] = opaque
+            opaque = padded
+
+        sections = opaque.reshape(w, l, sectionCount, 16).transpose(2, 0, 1, 3)
+        connectivity = numpy.zeros((sectionCount, 6), dtype='uint8')
+
+        closedCounts = sections.reshape(sectionCount, -1).sum(1)
+        connectivity[closedCounts == 0] = 0x3f
+        mixed = ((closedCounts > 0) & (closedCounts < sections[0].size)).nonzero()[0]
+        if not len(mixed):
+            return connectivity
+
+        isOpen = ~sections[mixed]
+        sectionSize = isOpen[0].size
+        unlabeled = sectionSize
+        labels = numpy.arange(isOpen.size, dtype='int32').reshape(isOpen.shape) % sectionSize
+        labels[~isOpen] = unlabeled
+
+        for _ in range(self.maxConnectivityPasses):
+            previous = labels.copy()
+            for axis in (1, 2, 3):
+                lab = numpy.rollaxis(labels, axis)
+                op = numpy.rollaxis(isOpen, axis)
+                for i in range(1, len(lab)):
+                    numpy.minimum(lab[i], lab[i - 1], out=lab[i], where=op[i])
+                for i in range(len(lab) - 2, -1, -1):
+                    numpy.minimum(lab[i], lab[i + 1], out=lab[i], where=op[i])
+            settled = (labels == previous).reshape(len(mixed), -1).all(1)
+            if settled.all():
+                break
+        else:
+            connectivity[mixed[~settled]] = 0x3f
+            mixed = mixed[settled]
+            labels = labels[settled]
+
+        for index, sectionLabels in zip(mixed, labels):
+            touched = numpy.zeros((6, sectionSize + 1), dtype='int32')
+            for face, faceSlice in self.sectionFaceSlices.iteritems():
+                touched[face, sectionLabels[numpy.newaxis][faceSlice].ravel()] = 1
+            touched[:, unlabeled] = 0
+
+            connected = numpy.dot(touched, touched.T) > 0
+            connectivity[index] = (connected << numpy.arange(6)).sum(1)
+
+        return connectivity
+
+    def calcHighDetailGeometry(self, areaBlocks, blockData, areaBlockLights, materials, showHiddenOres, cr, blockRenderers, sections=None):
+        """ compute the high detail geometry from the chunk's blocks, data and
+        lighting, given with a one-block border taken from the neighboring chunks.
+        Needs no level or chunk, so it can run in a mesher process.
+
+        sections is a list of the bottom y of each 16-block section to mesh, or None for all of them. """
+
         slabs = areaBlocks == pymclevel.materials.alphaMaterials.StoneSlab.ID
         if slabs.any():
             areaBlockLights[slabs] = areaBlockLights[:, :, 1:][slabs[:, :, :-1]]
         yield
 
-        showHiddenOres = cr.renderer.showHiddenOres
         if showHiddenOres:
             facingMats = self.hiddenOreMaterials[areaBlocks]
         else:
@@ -667,11 +1026,10 @@ class ChunkCalculator (object):
         facingBlockIndices = self.getFacingBlockIndices(areaBlocks, facingMats)
         yield
 
-        for i in self.computeGeometry(chunk, areaBlockMats, facingBlockIndices, areaBlockLights, cr, blockRenderers):
+        for i in self.computeGeometry(areaBlocks[1:-1, 1:-1, 1:-1], blockData, materials, areaBlockMats, facingBlockIndices, areaBlockLights, cr, blockRenderers, sections):
             yield
 
-    def computeGeometry(self, chunk, areaBlockMats, facingBlockIndices, areaBlockLights, chunkRenderer, blockRenderers):
-        blocks, blockData = chunk.Blocks, chunk.Data
+    def computeGeometry(self, blocks, blockData, materials, areaBlockMats, facingBlockIndices, areaBlockLights, chunkRenderer, blockRenderers, sections=None):
         blockData = blockData & 0xf
         blockMaterials = areaBlockMats[1:-1, 1:-1, 1:-1]
         if self.roughGraphics:
@@ -680,7 +1038,10 @@ class ChunkCalculator (object):
         sx = sz = slice(0, 16)
         asx = asz = slice(0, 18)
 
-        for y in range(0, chunk.world.Height, 16):
+        if sections is None:
+            sections = range(0, blocks.shape[2], 16)
+
+        for y in sections:
             sy = slice(y, y + 16)
             asy = slice(y, y + 18)
 
@@ -689,7 +1050,7 @@ class ChunkCalculator (object):
                     blockRenderers,
                     blocks[sx, sz, sy],
                     blockData[sx, sz, sy],
-                    chunk.materials,
+                    materials,
                     blockMaterials[sx, sz, sy],
                     [f[sx, sz, sy] for f in facingBlockIndices],
                     areaBlockLights[asx, asz, asy],
@@ -707,6 +1068,9 @@ class ChunkCalculator (object):
             if mi >= len(materialCounts) or materialCounts[mi] == 0:
                 continue
 
+            if blockRendererClass is GenericBlockRenderer and self.greedyMeshing:
+                blockRendererClass = GreedyBlockRenderer
+
             blockRenderer = blockRendererClass(self)
             blockRenderer.y = y
             blockRenderer.materials = materials
@@ -764,6 +1128,12 @@ class BlockRenderer(object):
     def bufferSize(self):
         return sum(a.size for a in self.vertexArrays) * 4
 
+    # Number of block faces the quads were made from, if they were merged
+    sourceFaces = None
+
+    def quadCount(self):
+        return sum(len(a) for a in self.vertexArrays)
+
     def getMaterialIndices(self, blockMaterials):
         return blockMaterials == self.materialIndex
 
@@ -782,12 +1152,52 @@ class BlockRenderer(object):
                 arrays.append(vertexArray)
         self.vertexArrays = arrays
 
-    def makeArrayList(self, chunkPosition, showRedraw):
-        l = gl.glGenLists(1)
-        GL.glNewList(l, GL.GL_COMPILE)
-        self.drawArrays(chunkPosition, showRedraw)
-        GL.glEndList()
-        return l
+    vertexStride = elementByteLength
+    redrawColor = (0xff, 0x40, 0x40, 0xff)
+
+    def arenaVertices(self, offset, showRedraw):
+        """ Yields copies of the vertex arrays moved to offset, an (x, z) position in the
+        renderer's vertex arenas. If showRedraw, the copies are colored with redrawColor. """
+        x, z = offset
+        y = getattr(self, 'y', 0)
+        for buf in self.vertexArrays:
+            if not len(buf):
+                continue
+            buf = numpy.array(buf)
+            buf[_XYZ] += (x, y, z)
+            if showRedraw:
+                self.setColor(buf, self.redrawColor)
+            yield buf
+
+    @classmethod
+    def setColor(cls, buf, color):
+        buf.view('uint8')[_RGBA] = color
+
+    @classmethod
+    def setPointers(cls, pointer):
+        """ pointer(offset, dtype) returns the pointer argument for the attribute at offset bytes
+        into each vertex, either into a vertex array or into a vertex arena. """
+        stride = cls.vertexStride
+        GL.glVertexPointer(3, GL.GL_FLOAT, stride, pointer(0, 'float32'))
+        GL.glTexCoordPointer(2, GL.GL_FLOAT, stride, pointer(12, 'float32'))
+        GL.glColorPointer(4, GL.GL_UNSIGNED_BYTE, stride, pointer(20, 'uint8'))
+
+    @classmethod
+    def drawPasses(cls, draw):
+        """ Calls draw() once for each pass needed to draw this renderer's quads. """
+        draw()
+
+    @classmethod
+    def arenaStride(cls):
+        """ The stride of the vertex arena that holds the arrays from arenaVertices """
+        return cls.vertexStride
+
+    @classmethod
+    def drawRanges(cls, arena, firsts, counts):
+        """ Draws the given ranges of vertices from arena. Call between arena.bind() and
+        arena.release(). """
+        cls.setPointers(arena.pointer)
+        cls.drawPasses(lambda: arena.multiDraw(GL.GL_QUADS, firsts, counts))
 
     def drawArrays(self, chunkPosition, showRedraw):
         cx, cz = chunkPosition
@@ -810,156 +1220,312 @@ class BlockRenderer(object):
     def drawFaceVertices(self, buf):
         if 0 == len(buf):
             return
-        stride = elementByteLength
 
-        GL.glVertexPointer(3, GL.GL_FLOAT, stride, (buf.ravel()))
-        GL.glTexCoordPointer(2, GL.GL_FLOAT, stride, (buf.ravel()[3:]))
-        GL.glColorPointer(4, GL.GL_UNSIGNED_BYTE, stride, (buf.view(dtype=numpy.uint8).ravel()[20:]))
-
-        GL.glDrawArrays(GL.GL_QUADS, 0, len(buf) * 4)
+        data = buf.view('uint8').ravel()
+        self.setPointers(lambda offset, dtype: data[offset:].view(dtype))
+        self.drawPasses(lambda: GL.glDrawArrays(GL.GL_QUADS, 0, len(buf) * 4))
 
 
 class EntityRendererGeneric(BlockRenderer):
     renderstate = ChunkCalculator.renderstateEntity
     detailLevels = (0, 1, 2)
 
-    def drawFaceVertices(self, buf):
-        if 0 == len(buf):
-            return
-        stride = elementByteLength
-
-        GL.glVertexPointer(3, GL.GL_FLOAT, stride, (buf.ravel()))
-        GL.glTexCoordPointer(2, GL.GL_FLOAT, stride, (buf.ravel()[3:]))
-        GL.glColorPointer(4, GL.GL_UNSIGNED_BYTE, stride, (buf.view(dtype=numpy.uint8).ravel()[20:]))
-
+    @classmethod
+    def drawPasses(cls, draw):
         GL.glDepthMask(False)
 
         GL.glPolygonMode(GL.GL_FRONT_AND_BACK, GL.GL_LINE)
 
         GL.glLineWidth(2.0)
-        GL.glDrawArrays(GL.GL_QUADS, 0, len(buf) * 4)
+        draw()
 
         GL.glPolygonMode(GL.GL_FRONT_AND_BACK, GL.GL_FILL)
 
         GL.glPolygonOffset(DepthOffset.TerrainWire, DepthOffset.TerrainWire)
         with gl.glEnable(GL.GL_POLYGON_OFFSET_FILL, GL.GL_DEPTH_TEST):
-            GL.glDrawArrays(GL.GL_QUADS, 0, len(buf) * 4)
+            draw()
         GL.glDepthMask(True)
 
-    def _computeVertices(self, positions, colors, offset=False, chunkPosition=(0, 0)):
-        cx, cz = chunkPosition
-        x = cx << 4
-        z = cz << 4
-
-        vertexArray = numpy.zeros(shape=(len(positions), 6, 4, 6), dtype='float32')
-        if len(positions):
-            positions = numpy.array(positions)
-            positions[:, (0, 2)] -= (x, z)
-            if offset:
-                positions -= 0.5
 
-            vertexArray.view('uint8')[_RGBA] = colors
-            vertexArray[_XYZ] = positions[:, numpy.newaxis, numpy.newaxis, :]
-            vertexArray[_XYZ] += faceVertexTemplates[_XYZ]
-            vertexArray.shape = (len(positions) * 6, 4, 6)
-        return vertexArray
+class EntityMarkerRenderer(EntityRendererGeneric):
+    """ Draws a colored cube at each entity. The cubes are kept as instances, the
+    position of each cube's corner followed by its color, and drawn as copies of one
+    cube mesh with glDrawArraysInstanced. Without instanced drawing or shaders, the
+    instances are expanded to the cube's 24 vertices when they are copied to the
+    vertex arenas. """
+    instanceStride = 16
+    cubeVertices = numpy.array(faceVertexTemplates[_XYZ].reshape(24, 3), dtype='float32')
+
+    program = ShaderProgram("""
+        attribute vec3 instancePosition;
+        attribute vec4 instanceColor;
+
+        void main() {
+            vec4 vertex = vec4(gl_Vertex.xyz + instancePosition, 1.0);
+            gl_Position = gl_ModelViewProjectionMatrix * vertex;
+            gl_FrontColor = instanceColor;
+            gl_FogFragCoord = abs((gl_ModelViewMatrix * vertex).z);
+        }
+        """, """
+        uniform bool fog;
+
+        void main() {
+            vec4 color = gl_Color;
+            if (fog) {
+                float f = clamp(exp(-gl_Fog.density * gl_FogFragCoord), 0.0, 1.0);
+                color.rgb = mix(gl_Fog.color.rgb, color.rgb, f);
+            }
+            gl_FragColor = color;
+        }
+        """)
 
+    _instanced = None
 
-class TileEntityRenderer(EntityRendererGeneric):
-    layer = Layer.TileEntities
+    # The list of tags in the chunk the markers are made from
+    tagList = "Entities"
+    color = (0xff, 0xff, 0xff, 0x44)
+    # Whether the cubes are centered on the tags' positions
+    centered = False
+
+    def __init__(self, cc):
+        super(EntityMarkerRenderer, self).__init__(cc)
+        self.chunkPosition = (0, 0)
+        self.instances = numpy.zeros((0, 4), dtype='float32')
+        self.keys = numpy.zeros((0,), dtype='int64')
+
+    @classmethod
+    def instanced(cls):
+        if EntityMarkerRenderer._instanced is None:
+            EntityMarkerRenderer._instanced = (bool(GL.glDrawArraysInstanced)
+                                               and bool(GL.glVertexAttribDivisor)
+                                               and cls.program.available)
+        return EntityMarkerRenderer._instanced
+
+    @classmethod
+    def arenaStride(cls):
+        return cls.instanceStride if cls.instanced() else cls.vertexStride
+
+    @classmethod
+    def chunkTags(cls, chunk):
+        return getattr(chunk, cls.tagList)
+
+    @classmethod
+    def tagPosition(cls, tag):
+        return pymclevel.Entity.pos(tag)
+
+    def markerColor(self, tag):
+        """ The color of the tag's marker, or None if it has no marker in this layer """
+        return self.color
+
+    @classmethod
+    def tagKey(cls, tag):
+        """ Identifies the tag's marker: the entity's UUID, or its id and position """
+        if "UUIDMost" in tag and "UUIDLeast" in tag:
+            return hash((tag["UUIDMost"].value, tag["UUIDLeast"].value))
+        return hash((tag["id"].value if "id" in tag else None, tuple(cls.tagPosition(tag))))
+
+    def markers(self, tags):
+        """ Yields the position, color and key of each tag's marker """
+        for tag in tags:
+            color = self.markerColor(tag)
+            if color is not None:
+                yield self.tagPosition(tag), color, self.tagKey(tag)
+
+    def makeInstances(self, markers):
+        """ Returns the instances and keys for a list of markers """
+        cx, cz = self.chunkPosition
+
+        instances = numpy.zeros((len(markers), 4), dtype='float32')
+        keys = numpy.zeros((len(markers),), dtype='int64')
+        if len(markers):
+            positions, colors, markerKeys = zip(*markers)
+            keys[:] = markerKeys
+            positions = numpy.array(positions, dtype='float64')
+            positions[:, (0, 2)] -= (cx << 4, cz << 4)
+            if self.centered:
+                positions -= 0.5
+
+            instances[:, :3] = positions
+            instances.view('uint8')[:, 12:16] = numpy.array(colors, dtype='uint8')
+        return instances, keys
 
     def makeChunkVertices(self, chunk):
-        tilePositions = []
-        for i, ent in enumerate(chunk.TileEntities):
+        self.chunkPosition = chunk.chunkPosition
+        markers = []
+        for i, marker in enumerate(self.markers(self.chunkTags(chunk))):
             if i % 10 == 0:
                 yield
-            if not 'x' in ent:
-                continue
-            tilePositions.append(pymclevel.TileEntity.pos(ent))
-        tiles = self._computeVertices(tilePositions, (0xff, 0xff, 0x33, 0x44), chunkPosition=chunk.chunkPosition)
+            markers.append(marker)
         yield
-        self.vertexArrays = [tiles]
+        self.instances, self.keys = self.makeInstances(markers)
+
+    def patchInstances(self, removed, added):
+        """ Drop the markers of the tags in removed and add markers for the tags in
+        added. Markers are matched to removed tags by tagKey. Returns False if no
+        markers changed. """
+        keep = numpy.ones(len(self.keys), dtype='bool')
+        removedCounts = defaultdict(int)
+        for position, color, key in self.markers(removed):
+            removedCounts[key] += 1
+
+        if removedCounts:
+            for i in numpy.flatnonzero(numpy.in1d(self.keys, removedCounts.keys())).tolist():
+                key = int(self.keys[i])
+                if removedCounts[key]:
+                    removedCounts[key] -= 1
+                    keep[i] = False
+
+        instances, keys = self.makeInstances(list(self.markers(added)))
+        if keep.all() and not len(keys):
+            return False
 
+        self.instances = numpy.concatenate((self.instances[keep], instances))
+        self.keys = numpy.concatenate((self.keys[keep], keys))
+        return True
+
+    @staticmethod
+    def expandInstances(instances):
+        """ Returns the vertices of the cubes for an array of instances """
+        vertexArray = numpy.zeros(shape=(len(instances), 6, 4, 6), dtype='float32')
+        vertexArray[_XYZ] = instances[:, numpy.newaxis, numpy.newaxis, :3]
+        vertexArray[_XYZ] += faceVertexTemplates[_XYZ]
+        vertexArray.view('uint8')[_RGBA] = instances.view('uint8')[:, numpy.newaxis, numpy.newaxis, 12:16]
+        vertexArray.shape = (len(instances) * 6, 4, 6)
+        return vertexArray
 
-class BaseEntityRenderer(EntityRendererGeneric):
-    pass
+    def setAlpha(self, alpha):
+        self.instances.view('uint8')[:, 15] = alpha
+
+    def bufferSize(self):
+        if self.instanced():
+            return self.instances.nbytes
+        return len(self.instances) * len(self.cubeVertices) * self.vertexStride
+
+    def quadCount(self):
+        return len(self.instances) * 6
+
+    def arenaVertices(self, offset, showRedraw):
+        if not len(self.instances):
+            return
+
+        x, z = offset
+        instances = numpy.array(self.instances)
+        instances[:, :3] += (x, 0, z)
+        if showRedraw:
+            instances.view('uint8')[:, 12:16] = self.redrawColor
+
+        if self.instanced():
+            yield instances
+        else:
+            yield self.expandInstances(instances)
+
+    def drawVertices(self):
+        self.drawFaceVertices(self.expandInstances(self.instances))
+
+    @classmethod
+    def drawRanges(cls, arena, firsts, counts):
+        if not cls.instanced():
+            super(EntityMarkerRenderer, cls).drawRanges(arena, firsts, counts)
+            return
+
+        program = cls.program
+        attributes = position, color = program.attribute("instancePosition"), program.attribute("instanceColor")
+        stride = cls.instanceStride
+
+        def draw():
+            for first, count in zip(firsts.tolist(), counts.tolist()):
+                GL.glVertexAttribPointer(position, 3, GL.GL_FLOAT, False, stride, arena.pointer(first * stride, 'float32'))
+                GL.glVertexAttribPointer(color, 4, GL.GL_UNSIGNED_BYTE, True, stride, arena.pointer(first * stride + 12, 'uint8'))
+                GL.glDrawArraysInstanced(GL.GL_QUADS, 0, len(cls.cubeVertices), count)
+
+        # The cube mesh is in client memory, so it is pointed to while no buffer is bound
+        arena.release()
+        GL.glVertexPointer(3, GL.GL_FLOAT, 0, cls.cubeVertices)
+        arena.bind()
+
+        fog = GL.glIsEnabled(GL.GL_FOG)
+        program.bind()
+        GL.glUniform1i(program.uniform("fog"), bool(fog))
+        GL.glDisableClientState(GL.GL_TEXTURE_COORD_ARRAY)
+        GL.glDisableClientState(GL.GL_COLOR_ARRAY)
+        for attribute in attributes:
+            GL.glEnableVertexAttribArray(attribute)
+            GL.glVertexAttribDivisor(attribute, 1)
+        try:
+            cls.drawPasses(draw)
+        finally:
+            for attribute in attributes:
+                GL.glVertexAttribDivisor(attribute, 0)
+                GL.glDisableVertexAttribArray(attribute)
+            GL.glEnableClientState(GL.GL_TEXTURE_COORD_ARRAY)
+            GL.glEnableClientState(GL.GL_COLOR_ARRAY)
+            program.release()
+
+
+class TileEntityRenderer(EntityMarkerRenderer):
+    layer = Layer.TileEntities
+    tagList = "TileEntities"
+    color = (0xff, 0xff, 0x33, 0x44)
+
+    @classmethod
+    def tagPosition(cls, tag):
+        return pymclevel.TileEntity.pos(tag)
+
+    def markerColor(self, tag):
+        if not 'x' in tag:
+            return None
+        return self.color
+
+
+class BaseEntityRenderer(EntityMarkerRenderer):
+    centered = True
 
 
 class MonsterRenderer(BaseEntityRenderer):
     layer = Layer.Entities  # xxx Monsters
     notMonsters = set(["Item", "XPOrb", "Painting"])
+    color = (0xff, 0x22, 0x22, 0x44)
 
-    def makeChunkVertices(self, chunk):
-        monsterPositions = []
-        for i, ent in enumerate(chunk.Entities):
-            if i % 10 == 0:
-                yield
-            id = ent["id"].value
-            if id in self.notMonsters:
-                continue
-
-            monsterPositions.append(pymclevel.Entity.pos(ent))
-
-        monsters = self._computeVertices(monsterPositions,
-                                         (0xff, 0x22, 0x22, 0x44),
-                                         offset=True,
-                                         chunkPosition=chunk.chunkPosition)
-        yield
-        self.vertexArrays = [monsters]
+    def markerColor(self, tag):
+        if tag["id"].value in self.notMonsters:
+            return None
+        return self.color
 
 
 class EntityRenderer(BaseEntityRenderer):
+    color = (0x88, 0x00, 0x00, 0x66)
+
     def makeChunkVertices(self, chunk):
         yield
-#        entityPositions = []
-#        for i, ent in enumerate(chunk.Entities):
-#            if i % 10 == 0:
-#                yield
-#            entityPositions.append(pymclevel.Entity.pos(ent))
-#
-#        entities = self._computeVertices(entityPositions, (0x88, 0x00, 0x00, 0x66), offset=True, chunkPosition=chunk.chunkPosition)
-#        yield
-#        self.vertexArrays = [entities]
+#        for _ in super(EntityRenderer, self).makeChunkVertices(chunk):
+#            yield
 
 
 class ItemRenderer(BaseEntityRenderer):
     layer = Layer.Items
+    colorMap = {
+        "Item": (0x22, 0xff, 0x22, 0x5f),
+        "XPOrb": (0x88, 0xff, 0x88, 0x5f),
+        "Painting": (134, 96, 67, 0x5f),
+    }
 
-    def makeChunkVertices(self, chunk):
-        entityPositions = []
-        entityColors = []
-        colorMap = {
-            "Item": (0x22, 0xff, 0x22, 0x5f),
-            "XPOrb": (0x88, 0xff, 0x88, 0x5f),
-            "Painting": (134, 96, 67, 0x5f),
-        }
-        for i, ent in enumerate(chunk.Entities):
-            if i % 10 == 0:
-                yield
-            color = colorMap.get(ent["id"].value)
-            if color is None:
-                continue
-
-            entityPositions.append(pymclevel.Entity.pos(ent))
-            entityColors.append(color)
-
-        entities = self._computeVertices(entityPositions, numpy.array(entityColors, dtype='uint8')[:, numpy.newaxis, numpy.newaxis], offset=True, chunkPosition=chunk.chunkPosition)
-        yield
-        self.vertexArrays = [entities]
+    def markerColor(self, tag):
+        return self.colorMap.get(tag["id"].value)
 
 
-class TileTicksRenderer(EntityRendererGeneric):
+class TileTicksRenderer(EntityMarkerRenderer):
     layer = Layer.TileTicks
+    tagList = "TileTicks"
 
-    def makeChunkVertices(self, chunk):
+    @classmethod
+    def chunkTags(cls, chunk):
         if chunk.root_tag and "Level" in chunk.root_tag and "TileTicks" in chunk.root_tag["Level"]:
-            ticks = chunk.root_tag["Level"]["TileTicks"]
-            if len(ticks):
-                self.vertexArrays.append(self._computeVertices([[t[i].value for i in "xyz"] for t in ticks],
-                                                               (0xff, 0xff, 0xff, 0x44),
-                                                               chunkPosition=chunk.chunkPosition))
+            return chunk.root_tag["Level"]["TileTicks"]
+        return ()
 
-        yield
+    @classmethod
+    def tagPosition(cls, tag):
+        return [tag[i].value for i in "xyz"]
 
 
 class TerrainPopulatedRenderer(EntityRendererGeneric):
@@ -970,32 +1536,25 @@ class TerrainPopulatedRenderer(EntityRendererGeneric):
     color = (255, 200, 155)
     vertexTemplate.view('uint8')[_RGBA] = color + (72,)
 
-    def drawFaceVertices(self, buf):
-        if 0 == len(buf):
-            return
-        stride = elementByteLength
-
-        GL.glVertexPointer(3, GL.GL_FLOAT, stride, (buf.ravel()))
-        GL.glTexCoordPointer(2, GL.GL_FLOAT, stride, (buf.ravel()[3:]))
-        GL.glColorPointer(4, GL.GL_UNSIGNED_BYTE, stride, (buf.view(dtype=numpy.uint8).ravel()[20:]))
-
+    @classmethod
+    def drawPasses(cls, draw):
         GL.glDepthMask(False)
 
-        # GL.glDrawArrays(GL.GL_QUADS, 0, len(buf) * 4)
+        # draw()
         GL.glDisable(GL.GL_CULL_FACE)
 
         with gl.glEnable(GL.GL_DEPTH_TEST):
-            GL.glDrawArrays(GL.GL_QUADS, 0, len(buf) * 4)
+            draw()
 
         GL.glEnable(GL.GL_CULL_FACE)
 
         GL.glPolygonMode(GL.GL_FRONT_AND_BACK, GL.GL_LINE)
 
         GL.glLineWidth(1.0)
-        GL.glDrawArrays(GL.GL_QUADS, 0, len(buf) * 4)
+        draw()
         GL.glLineWidth(2.0)
         with gl.glEnable(GL.GL_DEPTH_TEST):
-            GL.glDrawArrays(GL.GL_QUADS, 0, len(buf) * 4)
+            draw()
         GL.glLineWidth(1.0)
 
         GL.glPolygonMode(GL.GL_FRONT_AND_BACK, GL.GL_FILL)
@@ -1007,8 +1566,6 @@ class TerrainPopulatedRenderer(EntityRendererGeneric):
 #
 
     def makeChunkVertices(self, chunk):
-        neighbors = self.chunkCalculator.getNeighboringChunks(chunk)
-
         def getpop(ch):
             return getattr(ch, "TerrainPopulated", True)
 
@@ -1017,6 +1574,8 @@ class TerrainPopulatedRenderer(EntityRendererGeneric):
         if pop:
             return
 
+        neighbors = self.chunkCalculator.getNeighboringEdges(chunk)
+
         visibleFaces = [
             getpop(neighbors[pymclevel.faces.FaceXIncreasing]),
             getpop(neighbors[pymclevel.faces.FaceXDecreasing]),
@@ -1036,16 +1595,22 @@ class LowDetailBlockRenderer(BlockRenderer):
     renderstate = ChunkCalculator.renderstateLowDetail
     detailLevels = (1,)
 
-    def drawFaceVertices(self, buf):
-        if not len(buf):
-            return
-        stride = 16
+    vertexStride = 16
 
-        GL.glVertexPointer(3, GL.GL_FLOAT, stride, numpy.ravel(buf.ravel()))
-        GL.glColorPointer(4, GL.GL_UNSIGNED_BYTE, stride, (buf.view(dtype='uint8').ravel()[12:]))
+    @classmethod
+    def setColor(cls, buf, color):
+        buf.view('uint8')[..., 12:16] = color
 
+    @classmethod
+    def setPointers(cls, pointer):
+        stride = cls.vertexStride
+        GL.glVertexPointer(3, GL.GL_FLOAT, stride, pointer(0, 'float32'))
+        GL.glColorPointer(4, GL.GL_UNSIGNED_BYTE, stride, pointer(12, 'uint8'))
+
+    @classmethod
+    def drawPasses(cls, draw):
         GL.glDisableClientState(GL.GL_TEXTURE_COORD_ARRAY)
-        GL.glDrawArrays(GL.GL_QUADS, 0, len(buf) * 4)
+        draw()
         GL.glEnableClientState(GL.GL_TEXTURE_COORD_ARRAY)
 
     def setAlpha(self, alpha):
@@ -1214,6 +1779,125 @@ class GenericBlockRenderer(BlockRenderer):
     makeVertices = makeGenericVertices
 
 
+class GreedyBlockRenderer(GenericBlockRenderer):
+    """ Merges the exposed faces of generic blocks into larger quads, within one section.
+    Faces are merged when they face the same way, have the same texture and light,
+    and are all grass tops or all not. The texture of a merged quad has to repeat
+    across it, which is done by renderstateTiled. Its texture coordinates are packed as
+    tileOrigin * 1024 + 512 + offset, where offset runs from 0 to 16 times the length of
+    the quad. """
+    renderstate = ChunkCalculator.renderstateTiled
+
+    # For each face direction, the axes of the (x, z, y) block arrays that are normal
+    # to the face and that the face's s and t texture coordinates run along
+    faceAxes = {
+        pymclevel.faces.FaceXIncreasing: (0, 1, 2),
+        pymclevel.faces.FaceXDecreasing: (0, 1, 2),
+        pymclevel.faces.FaceYIncreasing: (2, 0, 1),
+        pymclevel.faces.FaceYDecreasing: (2, 0, 1),
+        pymclevel.faces.FaceZIncreasing: (1, 0, 2),
+        pymclevel.faces.FaceZDecreasing: (1, 0, 2),
+    }
+
+    def makeGreedyVertices(self, facingBlockIndices, blocks, blockMaterials, blockData, areaBlockLights, texMap):
+        vertexArrays = []
+        sourceFaces = 0
+        materialIndices = self.getMaterialIndices(blockMaterials)
+        yield
+
+        for (direction, exposedFaceIndices) in enumerate(facingBlockIndices):
+            facingBlockLight = areaBlockLights[self.directionOffsets[direction]]
+            blockIndices = materialIndices & exposedFaceIndices
+            if not blockIndices.any():
+                continue
+
+            theseBlocks = blocks[blockIndices]
+            bdata = blockData[blockIndices]
+            sourceFaces += len(theseBlocks)
+
+            tex = texMap(theseBlocks, bdata, direction)[:, 0:2].astype('int64')
+            grass = numpy.zeros(len(theseBlocks), 'int64')
+            if direction == pymclevel.faces.FaceYIncreasing and self.materials.name in ("Alpha", "Pocket"):
+                grass[:] = theseBlocks == pymclevel.materials.alphaMaterials.Grass.ID
+
+            faceKeys = numpy.empty(blocks.shape, 'int64')
+            faceKeys[:] = -1
+            faceKeys[blockIndices] = (((tex[:, 0] << 10) + tex[:, 1]) << 6) + (facingBlockLight[blockIndices] << 1) + grass
+
+            vertexArray = self.mergeFaces(direction, faceKeys)
+            yield
+
+            vertexArrays.append(vertexArray)
+
+        self.vertexArrays = vertexArrays
+        self.sourceFaces = sourceFaces
+
+    makeVertices = makeGreedyVertices
+
+    @staticmethod
+    def runLengths(keys, axis):
+        """ For each element, the number of equal elements that follow it along axis, plus one """
+        keys = numpy.rollaxis(keys, axis)
+        lengths = numpy.ones(keys.shape, 'int64')
+        for i in range(len(keys) - 2, -1, -1):
+            same = keys[i] == keys[i + 1]
+            lengths[i][same] += lengths[i + 1][same]
+        return numpy.rollaxis(lengths, 0, axis + 1)
+
+    @staticmethod
+    def runStarts(keys, axis):
+        keys = numpy.rollaxis(keys, axis)
+        starts = numpy.ones(keys.shape, 'bool')
+        starts[1:] = keys[1:] != keys[:-1]
+        starts &= keys != -1
+        return numpy.rollaxis(starts, 0, axis + 1)
+
+    def mergeFaces(self, direction, faceKeys):
+        """ Merge runs of equal faces along the s axis, then runs of equal s-runs along the t axis.
+        faceKeys holds -1 where no face is drawn. """
+        normalAxis, sAxis, tAxis = self.faceAxes[direction]
+
+        widths = self.runLengths(faceKeys, sAxis)
+        runKeys = numpy.where(self.runStarts(faceKeys, sAxis), (faceKeys << 5) + widths, -1)
+
+        heights = self.runLengths(runKeys, tAxis)
+        quadIndices = self.runStarts(runKeys, tAxis)
+
+        positions = numpy.transpose(quadIndices.nonzero())  # x, z, y
+        keys = faceKeys[quadIndices]
+
+        extents = numpy.ones((len(positions), 3), 'int64')
+        extents[:, sAxis] = widths[quadIndices]
+        extents[:, tAxis] = heights[quadIndices]
+
+        # reorder to x, y, z
+        positions = positions[:, (0, 2, 1)]
+        extents = extents[:, (0, 2, 1)]
+        xyzAxes = (0, 2, 1)
+        sExtent = extents[:, xyzAxes[sAxis], numpy.newaxis]
+        tExtent = extents[:, xyzAxes[tAxis], numpy.newaxis]
+
+        template = faceVertexTemplates[direction]
+        vertexArray = numpy.zeros((len(positions), 4, 6), dtype='float32')
+        vertexArray[_XYZ] = positions[:, numpy.newaxis, :] + template[numpy.newaxis, :, 0:3] * extents[:, numpy.newaxis, :]
+
+        texOrigin = numpy.transpose([keys >> 16, (keys >> 6) & 0x3ff])
+        vertexArray[..., 3] = template[:, 3] * sExtent
+        vertexArray[..., 4] = template[:, 4] * tExtent
+        vertexArray[_ST] += (texOrigin[:, numpy.newaxis, :] << 10) + 512
+
+        light = (keys >> 1) & 0x1f
+        rgb = template[numpy.newaxis, :, 5, numpy.newaxis] * light[:, numpy.newaxis, numpy.newaxis]
+        rgb = numpy.repeat(rgb, 3, -1)
+        grass = (keys & 1).astype('bool')
+        rgb[grass] = rgb[grass] * self.grassColor
+
+        colors = vertexArray.view('uint8')[_RGBA]
+        colors[..., :3] = rgb
+        colors[..., 3] = 0xff
+        return vertexArray
+
+
 class LeafBlockRenderer(BlockRenderer):
     blocktypes = [18]
 
@@ -1977,7 +2661,248 @@ class IceBlockRenderer(BlockRenderer):
 
     makeFaceVertices = iceFaceVertices
 
-from glutils import DisplayList
+from glutils import DisplayList, VertexArena
+
+
+class ChunkCenterArray(object):
+    """ The centers of a set of chunks, at height 0, as the rows of an N x 4 array so
+    they can be tested against the viewing frustum with one call. A removed chunk's
+    row is filled with the last row. The visible array from the last test is kept
+    along with the frustum it was for, until the set changes. """
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.rows = {}
+        self.positions = []
+        self._centers = numpy.zeros((64, 4), dtype='float64')
+        self.setVisible(None, None)
+
+    def __contains__(self, c):
+        return c in self.rows
+
+    def __len__(self):
+        return len(self.positions)
+
+    @property
+    def centers(self):
+        return self._centers[:len(self.positions)]
+
+    @staticmethod
+    def chunkCenters(chunks):
+        centers = numpy.zeros((len(chunks), 4), dtype='float64')
+        if len(chunks):
+            centers[:, (0, 2)] = numpy.array(chunks) * 16 + 8
+            centers[:, 3] = 1.0
+        return centers
+
+    def add(self, c):
+        if c in self.rows:
+            return
+        row = len(self.positions)
+        if row == len(self._centers):
+            self._centers = numpy.concatenate((self._centers, numpy.zeros_like(self._centers)))
+
+        self._centers[row] = self.chunkCenters([c])[0]
+        self.rows[c] = row
+        self.positions.append(c)
+        self.setVisible(None, None)
+
+    def remove(self, c):
+        row = self.rows.pop(c, None)
+        if row is None:
+            return
+        last = self.positions.pop()
+        if last != c:
+            self._centers[row] = self._centers[len(self.positions)]
+            self.positions[row] = last
+            self.rows[last] = row
+        self.setVisible(None, None)
+
+    def setVisible(self, frustum, visible):
+        self.frustum = frustum
+        self.visible = visible
+
+
+class ChunkScheduler(object):
+    """ The chunks waiting to be meshed, in a heap ordered by the ranks returned by
+    priorities(chunks), lowest first. Call reprioritize to rank them again after the
+    camera moves. """
+    def __init__(self, priorities):
+        self.priorities = priorities
+        self.clear()
+
+    def clear(self):
+        self.heap = []
+        self.pending = set()
+
+    def __len__(self):
+        return len(self.pending)
+
+    def __contains__(self, c):
+        return c in self.pending
+
+    def add(self, c):
+        self.update([c])
+
+    def update(self, chunks):
+        chunks = [c for c in set(chunks) if c not in self.pending]
+        if not chunks:
+            return
+        self.pending.update(chunks)
+        for entry in zip(self.priorities(chunks).tolist(), chunks):
+            heapq.heappush(self.heap, entry)
+
+    def pop(self, skip=()):
+        """ Removes and returns the pending chunk with the lowest rank that isn't in
+        skip, or None """
+        skipped = []
+        c = None
+        while len(self.heap):
+            entry = heapq.heappop(self.heap)
+            if entry[1] in skip:
+                skipped.append(entry)
+                continue
+            c = entry[1]
+            self.pending.discard(c)
+            break
+
+        for entry in skipped:
+            heapq.heappush(self.heap, entry)
+        return c
+
+    def lookahead(self, count):
+        """ Returns the next count chunks pop would return, in order """
+        return [c for priority, c in heapq.nsmallest(count, self.heap)]
+
+    def retain(self, keep):
+        """ Forget the pending chunks for which keep(c) is False """
+        self.pending = set(c for c in self.pending if keep(c))
+        self.heap = [entry for entry in self.heap if entry[1] in self.pending]
+        heapq.heapify(self.heap)
+
+    def reprioritize(self):
+        chunks = list(self.pending)
+        if chunks:
+            self.heap = zip(self.priorities(chunks).tolist(), chunks)
+            heapq.heapify(self.heap)
+
+
+def sectionCodes(cx, sy, cz):
+    """ Pack section positions into int64s. Shift right by 8 for the chunk's code. """
+    return ((numpy.asarray(cx, 'int64') & 0xffffff) << 32) | ((numpy.asarray(cz, 'int64') & 0xffffff) << 8) | numpy.asarray(sy, 'int64')
+
+
+class SectionGrid(object):
+    """ The section connectivity of the loaded chunks laid out for
+    MCRenderer.findVisibleSections on a (width, length, height) grid with a border of
+    unloaded sections. Section (x, z, y) is numbered (x * length + z) * height + y.
+    Chunks without connectivity (e.g. low detail chunks) are open from every face. """
+
+    # face, dx, dy, dz, opposite face
+    steps = (
+        (pymclevel.faces.FaceXIncreasing, 1, 0, 0, pymclevel.faces.FaceXDecreasing),
+        (pymclevel.faces.FaceXDecreasing, -1, 0, 0, pymclevel.faces.FaceXIncreasing),
+        (pymclevel.faces.FaceYIncreasing, 0, 1, 0, pymclevel.faces.FaceYDecreasing),
+        (pymclevel.faces.FaceYDecreasing, 0, -1, 0, pymclevel.faces.FaceYIncreasing),
+        (pymclevel.faces.FaceZIncreasing, 0, 0, 1, pymclevel.faces.FaceZDecreasing),
+        (pymclevel.faces.FaceZDecreasing, 0, 0, -1, pymclevel.faces.FaceZIncreasing),
+    )
+
+    def __init__(self, chunkRenderers, sectionCount):
+        positions = numpy.array(chunkRenderers.keys(), 'int64').reshape(-1, 2)
+        self.chunkCodes = numpy.unique(sectionCodes(positions[:, 0], 0, positions[:, 1]) >> 8)
+
+        self.origin = positions.min(0) - 1
+        width, length = positions.max(0) - self.origin + 2
+        height = sectionCount + 2
+        self.shape = (width, length, height)
+
+        opened = numpy.empty((sectionCount, 6), 'uint8')
+        opened.fill(0x3f)
+        x, z = (positions - self.origin).T
+        loaded = numpy.zeros(self.shape, 'bool')
+        loaded[x, z, 1:-1] = True
+        connectivity = numpy.zeros(self.shape + (6,), 'uint8')
+        connectivity[x, z, 1:-1] = [opened if cr.sectionConnectivity is None else cr.sectionConnectivity
+                                    for cr in chunkRenderers.itervalues()]
+
+        # Leave only through faces into loaded sections. Only loaded sections are entered
+        # and the border keeps their neighbors on the grid, so the roll never wraps for them.
+        self.faces = numpy.array([step[0] for step in self.steps], 'uint8')
+        self.offsets = numpy.array([(dx * length + dz) * height + dy for _, dx, dy, dz, _ in self.steps], 'int64')
+        self.opposites = numpy.array([step[4] for step in self.steps], 'int64')
+        loaded = loaded.ravel()
+        self.neighbors = numpy.zeros(loaded.shape, 'uint8')
+        for face, offset in zip(self.faces, self.offsets):
+            self.neighbors |= numpy.roll(loaded, -offset).astype('uint8') << face
+
+        # [section * 6 + entered face] -> faces it can be left by
+        self.exits = (connectivity.reshape(-1, 6) & self.neighbors[:, numpy.newaxis]).ravel()
+
+    def index(self, cx, sy, cz):
+        """ The number of a section, or None if it isn't inside the border """
+        ox, oz = self.origin
+        width, length, height = self.shape
+        x, z, y = cx - ox, cz - oz, sy + 1
+        if not (0 < x < width - 1 and 0 < z < length - 1 and 0 < y < height - 1):
+            return None
+        return (x * length + z) * height + y
+
+    def sectionCodes(self, indices):
+        """ The sectionCodes of an array of section numbers """
+        ox, oz = self.origin
+        x, z, y = numpy.unravel_index(indices, self.shape)
+        return sectionCodes(x + ox, y - 1, z + oz)
+
+
+class SectionVisibility(object):
+    """ The result of MCRenderer.findVisibleSections """
+    def __init__(self, visibleCodes, grid):
+        self.visibleCodes = visibleCodes
+        self.searchedChunkCodes = grid.chunkCodes
+        self.grid = grid
+
+        self.stale = False
+
+
+class DrawRanges(object):
+    """ The vertex ranges drawn for one block renderer class in one renderstate, gathered
+    from all chunks, along with their bounding spheres for culling. ranges is a list of
+    (allocation, cx, sy, cz). sy is the 16-block section, or -1 for the whole chunk. """
+    def __init__(self, blockRendererClass, arena, ranges, height):
+        self.blockRendererClass = blockRendererClass
+        self.arena = arena
+
+        count = len(ranges)
+        self.firsts = numpy.fromiter((r[0].first for r in ranges), dtype='int32', count=count)
+        self.counts = numpy.fromiter((r[0].count for r in ranges), dtype='int32', count=count)
+        positions = numpy.array([r[1:] for r in ranges], dtype='int64').reshape(count, 3)
+        cx, sy, cz = positions.T
+        wholeChunk = sy < 0
+
+        self.centers = numpy.ones((count, 4), dtype='float64')
+        self.centers[:, 0] = (cx << 4) + 8
+        self.centers[:, 1] = numpy.where(wholeChunk, height / 2., (sy << 4) + 8)
+        self.centers[:, 2] = (cz << 4) + 8
+
+        radii = numpy.where(wholeChunk, numpy.sqrt(128 + (height / 2.) ** 2), numpy.sqrt(192))
+        self.radii = radii[:, numpy.newaxis]
+
+        self.codes = numpy.where(wholeChunk, -1, sectionCodes(cx, sy, cz))
+        self._unoccluded = None
+        self._visibility = None
+
+    def unoccluded(self, visibility):
+        """ Whole-chunk ranges, like entities, and sections of chunks the visibility search
+        didn't know about are never occluded. """
+        if visibility is not self._visibility:
+            codes = self.codes
+            self._unoccluded = ((codes == -1)
+                                | numpy.in1d(codes, visibility.visibleCodes, assume_unique=False)
+                                | ~numpy.in1d(codes >> 8, visibility.searchedChunkCodes))
+            self._visibility = visibility
+        return self._unoccluded
 
 
 class MCRenderer(object):
@@ -1988,11 +2913,15 @@ class MCRenderer(object):
         self.origin = (0, 0, 0)
         self.rotation = 0
 
-        self.bufferUsage = 0
+        self.vertexArenas = {}
+        self.arenaOrigin = None
 
-        self.invalidChunkQueue = deque()
+        self.chunkQueue = ChunkScheduler(self.chunkPriorities)
+        self.scheduledCamera = None
+        self.evictionHeap = None
         self._chunkWorker = None
         self.chunkRenderers = {}
+        self.chunkCenters = ChunkCenterArray()
         self.loadableChunkMarkers = DisplayList()
         self.visibleLayers = set(Layer.AllLayers)
 
@@ -2016,6 +2945,7 @@ class MCRenderer(object):
         Settings.fastLeaves.addObserver(self)
 
         Settings.roughGraphics.addObserver(self)
+        Settings.greedyMeshing.addObserver(self)
         Settings.showHiddenOres.addObserver(self)
         Settings.vertexBufferLimit.addObserver(self)
 
@@ -2029,6 +2959,10 @@ class MCRenderer(object):
         Settings.showChunkRedraw.addObserver(self, "showRedraw")
         Settings.spaceHeight.addObserver(self)
         Settings.targetFPS.addObserver(self, "targetFPS")
+        Settings.mesherProcesses.addObserver(self)
+        Settings.occlusionCulling.addObserver(self)
+        Settings.meshCacheSize.addObserver(self)
+        Settings.skin.addObserver(self, "texturePack")
 
         self.level = level
 
@@ -2048,8 +2982,13 @@ class MCRenderer(object):
         else:
             self.visibleLayers.discard(layer)
         for cr in self.chunkRenderers.itervalues():
-            cr.invalidLayers.add(layer)
+            # Hidden layers keep their renderers until the chunk is recalculated
+            if val and not any(br.layer == layer for br in cr.blockRenderers):
+                cr.invalidLayers.add(layer)
+            else:
+                cr.needsRedisplay = True
 
+        self.discardMasterList()
         self.loadNearbyChunks()
 
     def layerProperty(layer, default=True):  # @NoSelf
@@ -2152,12 +3091,16 @@ class MCRenderer(object):
         """ this probably warrants creating a new renderer """
         self.stopWork()
 
+        if self.prefetcher:
+            self.prefetcher.close()
+            self.prefetcher = None
+
         self._level = level
         self.oldPosition = None
         self.position = (0, 0, 0)
         self.chunkCalculator = None
 
-        self.invalidChunkQueue = deque()
+        self.chunkQueue.clear()
 
         self.discardAllChunks()
 
@@ -2165,6 +3108,8 @@ class MCRenderer(object):
 
         if level:
             self.chunkCalculator = self.calculatorClass(self.level)
+            if not self.isPreviewer:
+                self.prefetcher = chunkprefetch.getChunkPrefetcher(level)
 
             self.oldPosition = None
             level.allChunks
@@ -2182,10 +3127,13 @@ class MCRenderer(object):
 
         if distance is None:
             d = self.effectiveViewDistance
+            if not self.overheadMode:
+                # Keep the pending chunks that will still be in range, the new spiral adds the rest
+                self.chunkQueue.retain(lambda c: c in self.chunkRenderers or self.chunkDistance(c) <= d)
         else:
             d = distance
 
-        self.chunkIterator = self.iterateChunks(wx, wz, d * 2)
+        self.chunkIterator = self.frustumCulled(self.iterateChunks(wx, wz, d * 2))
 
     def iterateChunks(self, x, z, d):
         cx = x >> 4
@@ -2210,6 +3158,96 @@ class MCRenderer(object):
 
             dir = -dir
 
+    chunkBatchSize = 256
+
+    def frustumCulled(self, chunkIterator):
+        """ Yields the chunks from chunkIterator that are in the viewing frustum. Takes
+        chunkBatchSize chunks at a time to test them all with one Frustum.visible call. """
+        while True:
+            batch = list(itertools.islice(chunkIterator, self.chunkBatchSize))
+            if not batch:
+                return
+
+            frustum = self.viewingFrustum
+            if frustum is None:
+                for c in batch:
+                    yield c
+                continue
+
+            centers = ChunkCenterArray.chunkCenters(batch)
+            visible = frustum.visible(self.chunkPoints(centers), self.chunkRadius)
+            for c, v in zip(batch, visible):
+                if v:
+                    yield c
+
+    detailLevelPenalty = 4
+
+    def chunkPriorities(self, chunks):
+        """ Ranks chunks for meshing and for eviction, lowest first. The rank is the
+        distance from the camera in chunks, multiplied by up to 2 for chunks behind
+        the camera, plus detailLevelPenalty for each level of detail below the highest. """
+        chunks = list(chunks)
+        positions = numpy.array(chunks, dtype='float64').reshape(len(chunks), 2)
+
+        camx, camy, camz = self.position
+        ox, oy, oz = self.origin
+        dx = positions[:, 0] * 16 + 8 - (camx - ox)
+        dz = positions[:, 1] * 16 + 8 - (camz - oz)
+        distance = numpy.hypot(dx, dz)
+
+        direction = self.viewDirection
+        if direction is not None:
+            cosine = (dx * direction[0] + dz * direction[1]) / numpy.maximum(distance, 1.0)
+            distance *= 1.5 - 0.5 * cosine
+
+        lod = numpy.fromiter((self.detailLevelForChunk(c) for c in chunks), dtype='float64', count=len(chunks))
+        return distance / 16 + lod * self.detailLevelPenalty
+
+    @property
+    def viewDirection(self):
+        """ The horizontal direction the camera is facing, taken from the near plane of
+        the viewing frustum, or None when looking straight up or down. """
+        if self.viewingFrustum is None:
+            return None
+        x, y, z = self.viewingFrustum.planes[5, :3]
+        length = numpy.hypot(x, z)
+        if length < 0.01:
+            return None
+        return x / length, z / length
+
+    def schedulerCamera(self):
+        """ The camera's chunk and roughly where it is facing. The pending chunks are
+        ranked again when this changes. """
+        camx, camy, camz = self.position
+        ox, oy, oz = self.origin
+        direction = self.viewDirection
+        if direction is not None:
+            direction = tuple(int(round(d * 4)) for d in direction)
+        return int(numpy.floor(camx - ox)) >> 4, int(numpy.floor(camz - oz)) >> 4, direction
+
+    def chunkPoints(self, centers):
+        """ Move the chunk centers from a ChunkCenterArray into the frustum's coordinates """
+        ox, oy, oz = self.origin
+        return centers + (ox, oy + self.level.Height / 2., oz, 0)
+
+    @property
+    def chunkRadius(self):
+        return numpy.sqrt(128 + (self.level.Height / 2.) ** 2)
+
+    def chunkInFrustum(self, c):
+        """ Tests a loaded chunk against the viewing frustum. All loaded chunks are tested
+        at once the first time this is called for each frustum. """
+        frustum = self.viewingFrustum
+        if frustum is None or c not in self.chunkCenters:
+            return True
+
+        visible = self.chunkCenters.visible
+        if self.chunkCenters.frustum is not frustum:
+            visible = frustum.visible(self.chunkPoints(self.chunkCenters.centers), self.chunkRadius)
+            self.chunkCenters.setVisible(frustum, visible)
+
+        return visible[self.chunkCenters.rows[c]]
+
     chunkIterator = None
 
     @property
@@ -2222,9 +3260,12 @@ class MCRenderer(object):
         self._chunkWorker = None
 
     def discardAllChunks(self):
-        self.bufferUsage = 0
-        self.forgetAllDisplayLists()
+        self.forgetAllVertexBuffers()
         self.chunkRenderers = {}
+        self.chunkCenters.clear()
+        self.evictionHeap = None
+        if self.prefetcher:
+            self.prefetcher.clear()
         self.oldPosition = None  # xxx force reload
 
     def discardChunksInBox(self, box):
@@ -2268,9 +3309,9 @@ class MCRenderer(object):
     def discardChunk(self, cx, cz):
         " discards the chunk renderer for this chunk and compresses the chunk "
         if (cx, cz) in self.chunkRenderers:
-            self.bufferUsage -= self.chunkRenderers[cx, cz].bufferSize
-            self.chunkRenderers[cx, cz].forgetDisplayLists()
+            self.chunkRenderers[cx, cz].forgetVertexBuffers()
             del self.chunkRenderers[cx, cz]
+            self.chunkCenters.remove((cx, cz))
 
     _fastLeaves = False
 
@@ -2298,6 +3339,56 @@ class MCRenderer(object):
 
         self._roughGraphics = bool(val)
 
+    _greedyMeshing = False
+
+    @property
+    def greedyMeshing(self):
+        return self._greedyMeshing
+
+    @greedyMeshing.setter
+    def greedyMeshing(self, val):
+        if self._greedyMeshing != bool(val):
+            self.discardAllChunks()
+
+        self._greedyMeshing = bool(val)
+
+    _mesherProcesses = 0
+    mesherPool = None
+    prefetcher = None
+
+    meshCache = None
+    texturePack = None
+
+    @property
+    def meshCacheSize(self):
+        return self._meshCacheSize
+
+    @meshCacheSize.setter
+    def meshCacheSize(self, val):
+        self._meshCacheSize = int(val)
+        self.meshCache = meshcache.getMeshCache(self._meshCacheSize)
+
+    @property
+    def mesherProcesses(self):
+        return self._mesherProcesses
+
+    @mesherProcesses.setter
+    def mesherProcesses(self, val):
+        self._mesherProcesses = int(val)
+        mesherPool = chunkmesher.getMesherPool(self._mesherProcesses)
+        if mesherPool is not self.mesherPool:
+            # chunks in flight were sent to the old pool
+            self.mesherPool = mesherPool
+            self.stopWork()
+            self.loadNearbyChunks()
+
+    @property
+    def concurrentChunks(self):
+        """ Chunks worked on at once. Only more than one while the mesher processes do the work. """
+        if self.mesherPool:
+            return self.mesherPool.maxPending
+        return 1
+
     _showHiddenOres = False
 
     @property
@@ -2311,30 +3402,64 @@ class MCRenderer(object):
 
         self._showHiddenOres = bool(val)
 
-    def invalidateChunk(self, cx, cz, layers=None):
-        " marks the chunk for regenerating vertex data and display lists "
+    def invalidateChunk(self, cx, cz, layers=None, sections=None):
+        """ marks the chunk for regenerating vertex data and display lists. sections
+        is a list of the bottom y of each 16-block section to remesh, or None for all """
+        if self.chunkCalculator:
+            self.chunkCalculator.forgetChunkEdges(cx, cz)
+        if self.prefetcher:
+            self.prefetcher.discard((cx, cz))
+
         if (cx, cz) in self.chunkRenderers:
             # self.chunkRenderers[(cx,cz)].invalidate()
-            # self.bufferUsage -= self.chunkRenderers[(cx, cz)].bufferSize
 
-            self.chunkRenderers[(cx, cz)].invalidate(layers)
-            # self.bufferUsage += self.chunkRenderers[(cx, cz)].bufferSize
+            self.chunkRenderers[(cx, cz)].invalidate(layers, sections)
 
-            self.invalidChunkQueue.append((cx, cz))  # xxx encapsulate
+            self.chunkQueue.add((cx, cz))
 
     def invalidateChunksInBox(self, box, layers=None):
         # If the box is at the edge of any chunks, expanding by 1 makes sure the neighboring chunk gets redrawn.
         box = box.expand(1)
 
-        self.invalidateChunks(box.chunkPositions, layers)
+        # Likewise for the sections above and below. Only those sections are remeshed.
+        miny = max(0, box.miny) & ~0xf
+        maxy = min(self.level.Height, box.maxy)
+        sections = range(miny, maxy, 16)
+
+        self.invalidateChunks(box.chunkPositions, layers, sections)
 
     def invalidateEntitiesInBox(self, box):
-        self.invalidateChunks(box.chunkPositions, [Layer.Entities])
+        self.invalidateChunks(box.chunkPositions, [Layer.Entities, Layer.Items])
+
+    def updateEntities(self, removed=(), added=(), tagList="Entities"):
+        """ Update the markers of the chunks where tags were removed from or added to
+        their Entities, TileEntities or TileTicks, named by tagList, without
+        recalculating the chunks' entity layers. A moved entity is removed with its
+        old tag and added with the new one. """
+        markerClass = {
+            "Entities": BaseEntityRenderer,
+            "TileEntities": TileEntityRenderer,
+            "TileTicks": TileTicksRenderer,
+        }[tagList]
+
+        chunkTags = defaultdict(lambda: ([], []))
+        for index, tags in enumerate((removed, added)):
+            for tag in tags:
+                try:
+                    x, y, z = markerClass.tagPosition(tag)
+                except KeyError:
+                    continue
+                chunkTags[int(numpy.floor(x)) >> 4, int(numpy.floor(z)) >> 4][index].append(tag)
 
-    def invalidateChunks(self, chunks, layers=None):
+        for c, (chunkRemoved, chunkAdded) in chunkTags.iteritems():
+            cr = self.chunkRenderers.get(c)
+            if cr is not None:
+                cr.updateEntities(tagList, chunkRemoved, chunkAdded)
+
+    def invalidateChunks(self, chunks, layers=None, sections=None):
         for c in chunks:
             cx, cz = c
-            self.invalidateChunk(cx, cz, layers)
+            self.invalidateChunk(cx, cz, layers, sections)
 
         self.stopWork()
         self.discardMasterList()
@@ -2343,9 +3468,33 @@ class MCRenderer(object):
     def invalidateAllChunks(self, layers=None):
         self.invalidateChunks(self.chunkRenderers.iterkeys(), layers)
 
-    def forgetAllDisplayLists(self):
+    def forgetAllVertexBuffers(self):
         for cr in self.chunkRenderers.itervalues():
-            cr.forgetDisplayLists()
+            cr.forgetVertexBuffers()
+
+    def vertexArena(self, stride):
+        arena = self.vertexArenas.get(stride)
+        if arena is None:
+            arena = self.vertexArenas[stride] = VertexArena(stride)
+        return arena
+
+    def arenaOffset(self, chunkPosition):
+        """ Vertices in the arenas are stored relative to the chunk at arenaOrigin, which
+        keeps their coordinates small enough for float32 far from the level origin. """
+        if self.arenaOrigin is None or not self.bufferUsage:
+            self.arenaOrigin = chunkPosition
+        cx, cz = chunkPosition
+        ox, oz = self.arenaOrigin
+        return (cx - ox) << 4, (cz - oz) << 4
+
+    @property
+    def bufferUsage(self):
+        """ Bytes of vertex data held in the vertex arenas """
+        return sum(arena.bytesUsed for arena in self.vertexArenas.itervalues())
+
+    @property
+    def bufferAllocated(self):
+        return sum(arena.bytesAllocated for arena in self.vertexArenas.itervalues())
 
     def invalidateMasterList(self):
         self.discardMasterList()
@@ -2354,6 +3503,8 @@ class MCRenderer(object):
 
     def discardMasterList(self):
         self.shouldRecreateMasterList = True
+        if self.sectionVisibility is not None:
+            self.sectionVisibility.stale = True
 
     @property
     def shouldDrawAll(self):
@@ -2497,9 +3648,12 @@ class MCRenderer(object):
                 cr.debugDraw()
     else:
         def createMasterLists(self):
+            """ Uploads the vertices of up to chunksPerFrame changed chunks, then gathers
+            the ranges of every chunk into one multi-draw call per renderstate and block
+            renderer class. masterLists maps each renderstate to a list of DrawRanges """
             if self.shouldRecreateMasterList:
                 lists = {}
-                chunkLists = defaultdict(list)
+                chunkRanges = defaultdict(list)
                 chunksPerFrame = 80
                 shouldRecreateAgain = False
 
@@ -2507,24 +3661,37 @@ class MCRenderer(object):
                     if chunksPerFrame:
                         if ch.needsRedisplay:
                             chunksPerFrame -= 1
-                        ch.makeDisplayLists()
+                        ch.makeVertexBuffers()
                     else:
                         shouldRecreateAgain = True
 
-                    if ch.renderstateLists:
-                        for rs in ch.renderstateLists:
-                            chunkLists[rs] += ch.renderstateLists[rs]
+                    if ch.renderstateAllocations:
+                        cx, cz = ch.chunkPosition
+                        for rs, allocations in ch.renderstateAllocations.iteritems():
+                            for cls, allocation, y in allocations:
+                                chunkRanges[rs, cls].append((allocation, cx, -1 if y is None else y >> 4, cz))
 
-                for rs in chunkLists:
-                    if len(chunkLists[rs]):
-                        lists[rs] = numpy.array(chunkLists[rs], dtype='uint32').ravel()
+                for (rs, cls), ranges in chunkRanges.iteritems():
+                    arena = self.vertexArena(cls.arenaStride())
+                    lists.setdefault(rs, []).append(DrawRanges(cls, arena, ranges, self.level.Height))
 
-                # lists = lists[lists.nonzero()]
                 self.masterLists = lists
                 self.shouldRecreateMasterList = shouldRecreateAgain
                 self.needsImmediateRedraw = shouldRecreateAgain
 
         def callMasterLists(self):
+            if self.arenaOrigin is None:
+                return
+
+            ox, oz = self.arenaOrigin
+            with gl.glPushMatrix(GL.GL_MODELVIEW):
+                GL.glTranslate(ox << 4, 0, oz << 4)
+                self.callMasterRanges()
+
+        def callMasterRanges(self):
+            self.updateSectionVisibility()
+            self.rangesDrawn = self.rangesTotal = 0
+
             for renderstate in self.chunkCalculator.renderstates:
                 if renderstate not in self.masterLists:
                     continue
@@ -2533,12 +3700,126 @@ class MCRenderer(object):
                     GL.glEnable(GL.GL_BLEND)
                 renderstate.bind()
 
-                GL.glCallLists(self.masterLists[renderstate])
+                for ranges in self.masterLists[renderstate]:
+                    firsts, counts = self.visibleRanges(ranges)
+                    self.rangesDrawn += len(firsts)
+                    self.rangesTotal += len(ranges.firsts)
+                    if not len(firsts):
+                        continue
+
+                    arena = ranges.arena
+                    arena.bind()
+                    ranges.blockRendererClass.drawRanges(arena, firsts, counts)
+                    arena.release()
 
                 renderstate.release()
                 if self.alpha != 0xff and renderstate is not ChunkCalculator.renderstateLowDetail:
                     GL.glDisable(GL.GL_BLEND)
 
+    rangesDrawn = rangesTotal = 0
+
+    def visibleRanges(self, ranges):
+        """ Returns the firsts and counts of the ranges that are inside the viewing
+        frustum and not hidden behind terrain """
+        visible = None
+        if self.viewingFrustum:
+            ox, oy, oz = self.origin
+            visible = self.viewingFrustum.visible(ranges.centers + (ox, oy, oz, 0), ranges.radii)
+
+        if self.sectionVisibility is not None:
+            unoccluded = ranges.unoccluded(self.sectionVisibility)
+            visible = unoccluded if visible is None else visible & unoccluded
+
+        if visible is None:
+            return ranges.firsts, ranges.counts
+        return ranges.firsts[visible], ranges.counts[visible]
+
+    sectionVisibility = None
+    occlusionCulling = True
+    _visibilitySearchStart = None
+    _visibilitySearchTime = datetime.min
+
+    # Searching again after chunks were loaded or changed waits at least this long
+    visibilitySearchInterval = timedelta(0, 0.5)
+
+    def updateSectionVisibility(self):
+        """ Find the sections that can be seen from the camera's section, when the camera moves
+        to another section or when chunks were loaded or changed. Sections of chunks loaded
+        since the last search are never hidden. """
+        if not (self.occlusionCulling and self.viewingFrustum) or self.isPreviewer or self.overheadMode:
+            self.sectionVisibility = None
+            return
+
+        x, y, z = (int(numpy.floor(p - o)) >> 4 for p, o in zip(self.position, self.origin))
+        if not 0 <= y < (self.level.Height + 15) >> 4 or (x, z) not in self.chunkRenderers:
+            self.sectionVisibility = None
+            self._visibilitySearchStart = None
+            return
+
+        start = (x, y, z)
+        now = datetime.now()
+        visibility = self.sectionVisibility
+        if start == self._visibilitySearchStart:
+            if visibility is None or not visibility.stale:
+                return
+            if now - self._visibilitySearchTime < self.visibilitySearchInterval:
+                return
+
+        # Crossing into another section searches the same chunks again
+        if visibility is None or visibility.stale or visibility.grid.index(*start) is None:
+            grid = SectionGrid(self.chunkRenderers, (self.level.Height + 15) >> 4)
+        else:
+            grid = visibility.grid
+
+        self.sectionVisibility = SectionVisibility(self.findVisibleSections(start, grid), grid)
+        self._visibilitySearchStart = start
+        self._visibilitySearchTime = now
+
+    def findVisibleSections(self, start, grid):
+        """ Breadth-first search outward from the camera's section, leaving each section
+        only through the faces that can be seen from the face it was entered by. The search
+        never steps back toward the camera, so every step leads one section farther from it
+        and each wave of the search is taken at once. A section reached through several
+        faces is searched from each of them. Returns the sectionCodes of the sections found. """
+        width, length, height = grid.shape
+        startIndex = grid.index(*start)
+
+        # Faces that don't step back toward the camera
+        cx, sy, cz = start
+        ox, oz = grid.origin
+        coords = (numpy.arange(width)[:, None, None] - (cx - ox),
+                  numpy.arange(height)[None, None, :] - (sy + 1),
+                  numpy.arange(length)[None, :, None] - (cz - oz))
+        forward = numpy.zeros(grid.shape, 'uint8')
+        for face, dx, dy, dz, _ in grid.steps:
+            for delta, coord in zip((dx, dy, dz), coords):
+                if delta:
+                    forward |= (coord * delta >= 0).astype('uint8') << face
+
+        exitsForward = (grid.exits.reshape(-1, 6) & forward.reshape(-1, 1)).ravel()
+
+        visible = numpy.zeros((width * length * height,), 'bool')
+        visible[startIndex] = True
+        entries = numpy.empty(exitsForward.shape, 'int64')
+
+        sections = numpy.array([startIndex], 'int64')
+        exits = grid.neighbors[sections]
+        while len(sections):
+            wave, step = ((exits[:, numpy.newaxis] >> grid.faces) & 1).nonzero()
+            sections = sections[wave] + grid.offsets[step]
+            keys = sections * 6 + grid.opposites[step]
+
+            # A section entered through the same face twice is searched once
+            order = numpy.arange(len(keys))
+            entries[keys] = order
+            first = entries[keys] == order
+            sections, keys = sections[first], keys[first]
+
+            visible[sections] = True
+            exits = exitsForward[keys]
+
+        return grid.sectionCodes(visible.nonzero()[0])
+
     errorLimit = 10
 
     def draw(self):
@@ -2559,6 +3840,10 @@ class MCRenderer(object):
             dx, dy, dz = self.origin
             GL.glTranslate(dx, dy, dz)
 
+            mirrored = self.multModelTransform()
+            if mirrored:
+                GL.glFrontFace(GL.GL_CW)
+
             GL.glEnable(GL.GL_CULL_FACE)
             GL.glEnable(GL.GL_DEPTH_TEST)
 
@@ -2587,6 +3872,8 @@ class MCRenderer(object):
 
             GL.glDisable(GL.GL_TEXTURE_2D)
             GL.glDisableClientState(GL.GL_TEXTURE_COORD_ARRAY)
+            if mirrored:
+                GL.glFrontFace(GL.GL_CCW)
                 # if self.drawLighting:
             self.drawLoadableChunkMarkers()
 
@@ -2594,18 +3881,36 @@ class MCRenderer(object):
             GL.glMatrixMode(GL.GL_TEXTURE)
             GL.glScalef(2., 2., 2.)
 
+    def multModelTransform(self):
+        """ Multiply the modelview matrix by any transform applied to the level's
+        vertices after they are moved to origin. Returns True if the transform
+        mirrors them, which turns their front faces around. """
+        return False
+
     renderErrorHandled = False
 
     def addDebugInfo(self, addDebugString):
-        addDebugString("BU: {0} MB, ".format(
+        addDebugString("BU: {0}/{1} MB, ".format(
             self.bufferUsage / 1000000,
+            self.bufferAllocated / 1000000,
              ))
 
-        addDebugString("WQ: {0}, ".format(len(self.invalidChunkQueue)))
+        addDebugString("WQ: {0}, ".format(len(self.chunkQueue)))
         if self.chunkIterator:
             addDebugString("[LR], ")
 
         addDebugString("CR: {0}, ".format(len(self.chunkRenderers),))
+        addDebugString("DR: {0}/{1}, ".format(self.rangesDrawn, self.rangesTotal))
+
+        if self.meshCache:
+            addDebugString("MC: {0} hits, {1} misses, ".format(self.meshCache.hits, self.meshCache.misses))
+        if self.prefetcher:
+            addDebugString("PF: {0} hits, ".format(self.prefetcher.hits))
+
+        if self.greedyMeshing:
+            crs = self.chunkRenderers.values()
+            addDebugString("Q: {0}/{1}, ".format(sum(cr.quadCount for cr in crs),
+                                                 sum(cr.sourceFaces for cr in crs)))
 
     def next(self):
         self.chunkWorker.next()
@@ -2614,48 +3919,28 @@ class MCRenderer(object):
         ''' does chunk face and vertex calculation work. returns a generator that can be
         iterated over for smaller work units.'''
 
+        work = deque()
         try:
             while True:
                 if self.level is None:
                     raise StopIteration
 
-                if len(self.invalidChunkQueue) > 1024:
-                    self.invalidChunkQueue.clear()
+                while len(work) < self.concurrentChunks:
+                    c = self.nextChunk(work)
+                    if c is None:
+                        break
+                    work.append((c, self.workOnChunk(c)))
 
-                if len(self.invalidChunkQueue):
-                    c = self.invalidChunkQueue[0]
-                    for i in self.workOnChunk(c):
-                        yield
-                    self.invalidChunkQueue.popleft()
-
-                elif self.chunkIterator is None:
+                if not len(work):
                     raise StopIteration
 
-                else:
-                    c = self.chunkIterator.next()
-                    if self.vertexBufferLimit:
-                        while self.bufferUsage > (0.9 * (self.vertexBufferLimit << 20)):
-                            deadChunk = None
-                            deadDistance = self.chunkDistance(c)
-                            for cr in self.chunkRenderers.itervalues():
-                                dist = self.chunkDistance(cr.chunkPosition)
-                                if dist > deadDistance:
-                                    deadChunk = cr
-                                    deadDistance = dist
-
-                            if deadChunk is not None:
-                                self.discardChunk(*deadChunk.chunkPosition)
-
-                            else:
-                                break
-
-                        else:
-                            for i in self.workOnChunk(c):
-                                yield
-
-                    else:
-                        for i in self.workOnChunk(c):
-                            yield
+                # round-robin the chunks in flight, so each one can wait on its mesher process
+                c, w = work.popleft()
+                try:
+                    w.next()
+                    work.append((c, w))
+                except StopIteration:
+                    pass
 
                 yield
 
@@ -2664,6 +3949,73 @@ class MCRenderer(object):
             if self.chunkIterator:
                 self.chunkIterator = None
 
+            # put back the chunks that were still in flight
+            self.chunkQueue.update(c for c, w in work)
+
+    def nextChunk(self, work):
+        """ Returns the position of the next chunk to work on, or None if there is nothing
+        to start right now. Discards far away chunks to make room for a chunk that
+        isn't loaded yet if the vertex buffer limit is reached. """
+        camera = self.schedulerCamera()
+        if camera != self.scheduledCamera:
+            self.scheduledCamera = camera
+            self.chunkQueue.reprioritize()
+            self.evictionHeap = None
+
+        inFlight = set(c for c, w in work)
+        while True:
+            if self.chunkIterator is not None and len(self.chunkQueue) < self.chunkBatchSize:
+                batch = list(itertools.islice(self.chunkIterator, self.chunkBatchSize))
+                if not batch:
+                    self.chunkIterator = None
+                self.chunkQueue.update(batch)
+
+            # chunks invalidated again while in flight wait for them to finish
+            c = self.chunkQueue.pop(inFlight)
+            if c is None:
+                return None
+
+            if not self.chunkInFrustum(c):
+                continue
+
+            # loaded chunks that were invalidated are always remeshed
+            if self.vertexBufferLimit and c not in self.chunkRenderers and not self.evictChunksAfter(c):
+                continue
+
+            if self.prefetcher:
+                self.prefetcher.request([c] + self.chunkQueue.lookahead(self.prefetchLookahead))
+            return c
+
+    prefetchLookahead = 32
+    prefetchTimeout = timedelta(0, 2)
+
+    def evictChunksAfter(self, c):
+        """ Discards the loaded chunks ranked after c until the vertex buffers are under
+        the limit. Returns False if that isn't possible. The loaded chunks are kept in a
+        heap, worst first, until the camera moves. """
+        limit = 0.9 * (self.vertexBufferLimit << 20)
+        if self.bufferUsage <= limit:
+            return True
+
+        priority = self.chunkPriorities([c])[0]
+        heap = self.evictionHeap
+        if heap is None:
+            positions = self.chunkRenderers.keys()
+            heap = zip((-self.chunkPriorities(positions)).tolist(), positions)
+            heapq.heapify(heap)
+            self.evictionHeap = heap
+
+        while self.bufferUsage > limit:
+            while len(heap) and heap[0][1] not in self.chunkRenderers:
+                heapq.heappop(heap)
+            if not len(heap) or -heap[0][0] <= priority:
+                return False
+
+            negPriority, deadChunk = heapq.heappop(heap)
+            self.discardChunk(*deadChunk)
+
+        return True
+
     vertexBufferLimit = 384
 
     def getChunkRenderer(self, c):
@@ -2675,8 +4027,6 @@ class MCRenderer(object):
         return cr
 
     def calcFacesForChunkRenderer(self, cr):
-        self.bufferUsage -= cr.bufferSize
-
         calc = cr.calcFaces()
         work = 0
         for i in calc:
@@ -2689,12 +4039,13 @@ class MCRenderer(object):
         work = 0
 
         if self.level.containsChunk(*c):
+            # let the prefetcher read the chunk, instead of waiting for the disk here
+            prefetcher = self.prefetcher
+            deadline = datetime.now() + self.prefetchTimeout
+            while prefetcher and prefetcher.pending(c) and datetime.now() < deadline:
+                yield
+
             cr = self.getChunkRenderer(c)
-            if self.viewingFrustum:
-                # if not self.viewingFrustum.visible(numpy.array([[c[0] * 16 + 8, 64, c[1] * 16 + 8, 1.0]]), 64).any():
-                if not self.viewingFrustum.visible1([c[0] * 16 + 8, self.level.Height / 2, c[1] * 16 + 8, 1.0], self.level.Height / 2):
-                    raise StopIteration
-                    yield
 
             faceInfoCalculator = self.calcFacesForChunkRenderer(cr)
             try:
@@ -2711,11 +4062,18 @@ class MCRenderer(object):
 
                 logging.info(u"Skipped chunk {f}: {e}".format(e=e, f=fn))
 
+            if prefetcher:
+                # prefetched, but the chunk was already loaded
+                prefetcher.discard(c)
+
     redrawChunks = 0
 
     def chunkDone(self, chunkRenderer, work):
-        self.chunkRenderers[chunkRenderer.chunkPosition] = chunkRenderer
-        self.bufferUsage += chunkRenderer.bufferSize
+        c = chunkRenderer.chunkPosition
+        if self.evictionHeap is not None and c not in self.chunkRenderers:
+            heapq.heappush(self.evictionHeap, (-self.chunkPriorities([c])[0], c))
+        self.chunkRenderers[c] = chunkRenderer
+        self.chunkCenters.add(c)
         # print "Chunk {0} used {1} work units".format(chunkRenderer.chunkPosition, work)
         if not self.needsRedraw:
             if self.redrawChunks:
@@ -2737,11 +4095,41 @@ class MCRenderer(object):
 
 
 class PreviewRenderer(MCRenderer):
+    """ Draws a level placed somewhere in the world, such as the clone tool's schematic.
+    If transform is not None, it is a 4x4 matrix applied to the level's coordinates
+    before they are moved to origin. It turns or mirrors the level without meshing
+    it again. """
     isPreviewer = True
+    transform = None
+
+    _cameraPosition = (0, 0, 0)
+
+    @property
+    def position(self):
+        """ The camera's position, moved into the level's coordinates by the inverse
+        of transform so the chunks near the camera are loaded first. """
+        if self.transform is None:
+            return self._cameraPosition
+
+        ox, oy, oz = self.origin
+        x, y, z = self._cameraPosition
+        x, y, z, w = numpy.linalg.inv(self.transform).dot((x - ox, y - oy, z - oz, 1.0))
+        return x + ox, y + oy, z + oz
+
+    @position.setter
+    def position(self, val):
+        self._cameraPosition = val
+
+    def multModelTransform(self):
+        if self.transform is None:
+            return False
+        GL.glMultMatrixd(numpy.ascontiguousarray(self.transform.T, dtype='float64'))
+        return numpy.linalg.det(self.transform[:3, :3]) < 0
 
 
-def rendermain():
+def rendermain(mesherProcesses=0):
     renderer = MCRenderer()
+    renderer.mesherProcesses = mesherProcesses
 
     renderer.level = pymclevel.mclevel.loadWorld("World1")
     renderer.viewDistance = 6
@@ -2762,7 +4150,8 @@ def rendermain():
 
     duration = datetime.now() - start
     perchunk = duration / len(renderer.chunkRenderers)
-    print "Duration: {0} ({1} chunks per second, {2} per chunk, {3} chunks)".format(duration, 1000000.0 / perchunk.microseconds, perchunk, len(renderer.chunkRenderers))
+    print "Duration: {0} ({1} chunks per second, {2} per chunk, {3} chunks, {4} mesher processes)".format(duration, 1000000.0 / perchunk.microseconds, perchunk, len(renderer.chunkRenderers),
+                                                                                                           renderer.mesherPool.processes if renderer.mesherPool else 0)
 
     # display.init( (640, 480), OPENGL | DOUBLEBUF )
     from mcedit import GLDisplayContext
@@ -2811,4 +4200,6 @@ import traceback
 import cProfile
 
 if __name__ == "__main__":
-    cProfile.run("rendermain()", "mcedit.profile")
+    # renderer.py [mesher processes]
+    procs = int(sys.argv[1]) if len(sys.argv) > 1 else 0
+    cProfile.run("rendermain({0})".format(procs), "mcedit.profile")
@@ -0,0 +1,153 @@
+"""Copyright (c) 2010-2012 David Rio Vierra
+
+Permission to use, copy, modify, and/or distribute this software for any
+purpose with or without fee is hereby granted, provided that the above
+copyright notice and this permission notice appear in all copies.
+
+THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE."""
+
+"""
+terrainatlas.py
+
+The terrain texture and its mipmaps, from MCEdit's terrain.png or a texture pack.
+
+terrain.png is a grid of 16 by 16 square tiles whose size is a power of two.
+Each mip level averages 2x2 blocks of the level above, and those blocks never
+straddle two tiles until a tile is a single pixel, which is the last level
+built. So tiles never bleed into each other at any level, and the tile
+coordinates used by the renderer stay the same. Colors are weighted by alpha,
+so the transparent parts of leaves and glass don't darken their edges.
+
+The mip chain is stored in the decoded PNG cache, keyed by the hash of the
+pack's terrain.png, so switching back to a pack doesn't build it again.
+"""
+
+import logging
+import os
+import zipfile
+
+import numpy
+
+import directories
+import mcplatform
+import pngdecode
+
+log = logging.getLogger(__name__)
+
+# Change this when the mipmaps built for any image change
+atlasVersion = 1
+
+tilesPerRow = 16
+
+defaultPacks = ("[Default]", "[Current]")
+
+
+def currentMinecraftPack():
+    """ The texture pack chosen in Minecraft's options, or None """
+    try:
+        with file(os.path.join(mcplatform.minecraftDir, "options.txt")) as f:
+            for line in f:
+                if line.startswith("skin:"):
+                    pack = line[len("skin:"):].strip()
+                    if pack != "Default":
+                        return pack
+    except EnvironmentError:
+        pass
+    return None
+
+
+def texturePackTerrain(pack):
+    """ Returns the contents of terrain.png from a texture pack zip file or
+    folder in the texture packs folder, or None """
+    path = os.path.join(mcplatform.texturePacksDir, pack)
+    try:
+        if os.path.isdir(path):
+            with file(os.path.join(path, "terrain.png"), "rb") as f:
+                return f.read()
+
+        with zipfile.ZipFile(path) as z:
+            return z.read("terrain.png")
+    except (EnvironmentError, KeyError, zipfile.BadZipfile), e:
+        log.warn(u"Unable to read terrain.png from texture pack {0}: {1!r}".format(pack, e))
+        return None
+
+
+def terrainPNGData(pack=None):
+    """ Returns the contents of the terrain.png to use for a texture pack, as
+    named by the MCEdit Skin setting """
+    if pack == "[Current]":
+        pack = currentMinecraftPack()
+
+    data = None
+    if pack and pack not in defaultPacks:
+        data = texturePackTerrain(pack)
+    if data is None:
+        with file(os.path.join(directories.dataDir, "terrain.png"), "rb") as f:
+            data = f.read()
+    return data
+
+
+def downsample(rgba):
+    """ Halve an RGBA image by averaging 2x2 blocks, weighting colors by alpha """
+    h, w = rgba.shape[:2]
+    blocks = rgba.reshape(h // 2, 2, w // 2, 2, 4).astype('uint32')
+    alpha = blocks[..., 3:]
+    alphaSum = alpha.sum(axis=(1, 3))
+    weighted = (blocks[..., :3] * alpha).sum(axis=(1, 3))
+    plain = blocks[..., :3].sum(axis=(1, 3)) >> 2
+
+    result = numpy.empty((h // 2, w // 2, 4), dtype='uint8')
+    result[..., :3] = numpy.where(alphaSum > 0, weighted // numpy.maximum(alphaSum, 1), plain)
+    result[..., 3:] = alphaSum >> 2
+    return result
+
+
+def buildMipmaps(rgba):
+    """ Returns a list of mip levels for a terrain image, largest first, down to one pixel per tile """
+    h, w = rgba.shape[:2]
+    tileSize = min(w, h) // tilesPerRow
+    if tileSize < 1 or tileSize & (tileSize - 1) or w % tilesPerRow or h % tilesPerRow:
+        return [rgba]
+
+    levels = [rgba]
+    while tileSize > 1:
+        levels.append(downsample(levels[-1]))
+        tileSize >>= 1
+    return levels
+
+
+def splitLevels(flat, w, h):
+    levels = []
+    offset = 0
+    while offset < len(flat):
+        size = w * h * 4
+        levels.append(flat[offset:offset + size].reshape(h, w, 4))
+        offset += size
+        w >>= 1
+        h >>= 1
+    return levels
+
+
+def terrainMipmaps(pack=None):
+    """ Returns the mip levels of the terrain texture for a texture pack, from
+    the cache if they were built before. """
+    data = terrainPNGData(pack)
+    cache = pngdecode.getDecodedPNGCache()
+    if cache:
+        key = cache.key(data, "terrain mipmaps {0}".format(atlasVersion))
+        flat = cache.get(key)
+        if flat is not None:
+            w, h = pngdecode.imageSize(data)
+            return splitLevels(flat, w, h)
+
+    w, h, rgba = pngdecode.decodePNG(data)
+    levels = buildMipmaps(rgba)
+    if cache:
+        cache.put(key, numpy.concatenate([level.ravel() for level in levels]))
+    return levels